@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+from config import AdmissionConfig
+
+
+class RecentAdmissions:
+    """
+    Bounded LRU of allowed admissions keyed by (metadata.uid, generation).
+
+    The apiserver retries a review that timed out or failed in transit, so
+    the same object generation can arrive more than once. The stored inputs
+    are compared on lookup because annotation-only edits keep the generation.
+    A deleted and re-created object has a new uid, so it never matches the
+    entry of its predecessor, whose answer may no longer hold. The cache is
+    per process; a hit only skips the preflight, the reconcile is still
+    submitted.
+    """
+
+    def __init__(self, size: int = None):
+        self.size = size if size is not None else AdmissionConfig.recent_size
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(request) -> str:
+        return request.object_uid
+
+    def get(self, request):
+        """Return the cached message for an identical request, or None."""
+        if not request.generation or not request.object_uid:
+            return None
+        key = self._key(request)
+        entry = self._entries.get(key)
+        if entry is None or entry[:2] != (request.generation, request.inputs()):
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def add(self, request, message: str):
+        if not request.generation or not request.object_uid or self.size <= 0:
+            return
+        key = self._key(request)
+        self._entries[key] = (request.generation, request.inputs(), message)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def discard(self, request):
+        self._entries.pop(self._key(request), None)
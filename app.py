@@ -1,9 +1,69 @@
 import argparse
+import asyncio
+import json
 import logging
+import os
+import sys
+import tempfile
 
 import uvicorn
+from uvicorn.main import STARTUP_FAILURE
+from uvicorn.supervisors import Multiprocess
 
-logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(message)s")
+from structured_logging import setup_logging
+from tls import ServerConfig
+
+setup_logging()
+
+
+def run_backfill(args):
+    # Imported here so that serving does not load the Kubernetes client up front.
+    from backfill import Backfill
+    from config import ApiServerConfig
+
+    if args.write_qps is not None:
+        ApiServerConfig.write_qps = args.write_qps
+    report = asyncio.run(
+        Backfill(
+            concurrency=args.concurrency,
+            page_size=args.page_size,
+            dry_run=args.dry_run,
+            checkpoint=args.checkpoint,
+        ).run()
+    )
+    print(json.dumps(report, indent=2))
+    if report["counts"]["failed"]:
+        sys.exit(1)
+
+
+def run_render_webhook(args):
+    import yaml
+
+    from webhook_config import ca_bundle_from, webhook_configuration
+
+    manifest = webhook_configuration(
+        ca_bundle_from(args.certfile),
+        name=args.name,
+        service_name=args.service_name,
+        service_namespace=args.service_namespace,
+        excluded_namespaces=args.exclude_namespace,
+        namespace_labels=dict(args.namespace_selector or []),
+        object_labels=dict(args.object_selector or []),
+        match_conditions=args.match_conditions,
+    )
+    rendered = yaml.safe_dump(manifest, sort_keys=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(rendered)
+    else:
+        sys.stdout.write(rendered)
+
+
+def label(value: str) -> tuple[str, str]:
+    key, separator, label_value = value.partition("=")
+    if not separator or not key:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {value!r}")
+    return key, label_value
 
 
 def main():
@@ -20,23 +80,180 @@ def main():
     parser.add_argument(
         "--host", default="0.0.0.0", help="Host interface to bind to (default: 0.0.0.0)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes; workers share cluster state (default: 1)",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=None,
+        help="Recycle a worker after it has served this many requests",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=30,
+        help="Seconds to let in-flight requests finish when a worker stops (default: 30)",
+    )
+    parser.add_argument(
+        "--keepalive-timeout",
+        type=int,
+        default=120,
+        help="Seconds to keep an idle connection open for reuse; longer than the "
+        "apiserver's 90s idle timeout so it closes first (default: 120)",
+    )
+    parser.add_argument(
+        "--tls-reload-interval",
+        type=float,
+        default=10,
+        help="Seconds between checks for a rotated certificate; 0 disables reloading (default: 10)",
+    )
+    parser.add_argument(
+        "--tls-session-tickets",
+        type=int,
+        default=2,
+        help="TLS 1.3 session tickets issued per handshake; 0 disables session resumption (default: 2)",
+    )
+
+    subcommands = parser.add_subparsers(dest="command")
+    backfill_parser = subcommands.add_parser(
+        "backfill", help="Provision Gateways and Certificates for existing VirtualServices"
+    )
+    backfill_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="VirtualServices reconciled at once (default: 16)",
+    )
+    backfill_parser.add_argument(
+        "--page-size",
+        type=int,
+        default=500,
+        help="VirtualServices per LIST page (default: 500)",
+    )
+    backfill_parser.add_argument(
+        "--dry-run", action="store_true", help="Run the preflight checks and report, without writing"
+    )
+    backfill_parser.add_argument(
+        "--checkpoint", help="File recording progress; an existing checkpoint is resumed from"
+    )
+    backfill_parser.add_argument(
+        "--write-qps",
+        type=float,
+        default=None,
+        help="Override APISERVER_WRITE_QPS for the backfill",
+    )
+
+    render_parser = subcommands.add_parser(
+        "render-webhook",
+        help="Print the ValidatingWebhookConfiguration, with the caBundle taken from --certfile",
+    )
+    render_parser.add_argument(
+        "--certfile",
+        default=argparse.SUPPRESS,
+        help="Certificate the webhook serves; without it the caBundle is a placeholder",
+    )
+    render_parser.add_argument(
+        "--name",
+        default="istio-cert-admission-webhook",
+        help="Name of the ValidatingWebhookConfiguration (default: istio-cert-admission-webhook)",
+    )
+    render_parser.add_argument(
+        "--service-name",
+        default="gateway-admission-webhook",
+        help="Service in front of the webhook (default: gateway-admission-webhook)",
+    )
+    render_parser.add_argument(
+        "--service-namespace",
+        default="istio-system",
+        help="Namespace of that Service (default: istio-system)",
+    )
+    render_parser.add_argument(
+        "--exclude-namespace",
+        action="append",
+        help="Namespace whose VirtualServices are never sent to the webhook; repeatable "
+        "(default: kube-system, kube-public, kube-node-lease)",
+    )
+    render_parser.add_argument(
+        "--namespace-selector",
+        action="append",
+        type=label,
+        metavar="KEY=VALUE",
+        help="Only send VirtualServices from namespaces with this label; repeatable",
+    )
+    render_parser.add_argument(
+        "--object-selector",
+        action="append",
+        type=label,
+        metavar="KEY=VALUE",
+        help="Only send VirtualServices with this label; repeatable",
+    )
+    render_parser.add_argument(
+        "--match-conditions",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Filter on the cert-manager annotations with CEL matchConditions; "
+        "needs Kubernetes 1.28 or later (default: on)",
+    )
+    render_parser.add_argument("--output", "-o", help="Write to this file instead of stdout")
 
     args = parser.parse_args()
+    if args.command == "backfill":
+        run_backfill(args)
+        return
+    if args.command == "render-webhook":
+        run_render_webhook(args)
+        return
 
     config = {
         "app": "main:app",
         "host": args.host,
         "port": args.port,
+        "workers": args.workers,
+        "limit_max_requests": args.max_requests,
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "timeout_keep_alive": args.keepalive_timeout,
+        "tls_reload_interval": args.tls_reload_interval,
+        "tls_session_tickets": args.tls_session_tickets,
+        # uvicorn's loggers propagate to the root logger set up above.
+        "log_config": None,
     }
 
+    manager = None
+    if args.workers > 1:
+        # Imported lazily so single-process mode does not pay for the manager.
+        from shared_state import start_manager
+
+        manager = start_manager()
+        os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="webhook-metrics-"))
+        logging.info("Running %s workers with shared cluster state", args.workers)
+
     if args.certfile and args.keyfile:
         config["ssl_certfile"] = args.certfile
         config["ssl_keyfile"] = args.keyfile
-        logging.info(f"Running with TLS using certificate: {args.certfile}")
+        logging.info("Running with TLS using certificate: %s", args.certfile)
     else:
         logging.warning("Running without TLS")
 
-    uvicorn.run(**config)
+    # uvicorn.run() cannot take a Config subclass, so this mirrors it.
+    server_config = ServerConfig(**config)
+    server = uvicorn.Server(server_config)
+    try:
+        if server_config.workers > 1:
+            sock = server_config.bind_socket()
+            Multiprocess(server_config, target=server.run, sockets=[sock]).run()
+        else:
+            server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if manager is not None:
+            manager.shutdown()
+    if server_config.workers == 1 and not server.started:
+        sys.exit(STARTUP_FAILURE)
 
 
 if __name__ == "__main__":
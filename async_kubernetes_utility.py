@@ -0,0 +1,219 @@
+import json
+import logging
+
+from kubernetes_asyncio import client, config
+from kubernetes_asyncio.client.exceptions import ApiException
+from kubernetes_asyncio.client.rest import RESTResponse
+
+from errors import ClusterIssuerDoesnotExist, IssuerDoesnotExist
+from metrics import APISERVER_REQUEST_LATENCY, observe_apiserver_call
+from rate_limit import RateLimitedRESTClient
+from resources import FIELD_MANAGER
+
+
+class AsyncKubernetesUtility:
+    """
+    asyncio counterpart of KubernetesUtility. All calls share a single
+    ApiClient, and therefore a single aiohttp connection pool, so concurrent
+    admissions overlap their apiserver round trips instead of blocking the
+    event loop. The pool and the read/write QPS budgets are set through
+    ApiServerConfig.
+    """
+
+    def __init__(self):
+        self.api_client = None
+        self.client = None
+
+    async def initialize(self):
+        if self.client is not None:
+            return
+        configuration = client.Configuration()
+        await config.load_config(client_configuration=configuration)
+        self.api_client = client.ApiClient(configuration)
+        await self.api_client.rest_client.close()
+        self.api_client.rest_client = RateLimitedRESTClient(configuration)
+        self.client = client.CustomObjectsApi(self.api_client)
+
+    async def warm_up(self):
+        """Open a pooled connection (TLS handshake, auth) before traffic arrives."""
+        try:
+            await client.VersionApi(self.api_client).get_code()
+        except Exception as e:
+            # Not fatal: readiness still waits for the informers to sync.
+            logging.warning("Could not warm up the apiserver connection: %s", e)
+
+    async def close(self):
+        if self.api_client is not None:
+            await self.api_client.close()
+            self.api_client = None
+            self.client = None
+
+    @observe_apiserver_call("certificates", "get")
+    async def get_certificate(self, name, namespace):
+        try:
+            return await self.client.get_namespaced_custom_object(
+                "cert-manager.io",
+                "v1",
+                namespace,
+                "certificates",
+                name,
+            )
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    @observe_apiserver_call("certificates", "apply")
+    async def apply_certificate(self, certificate_body: dict):
+        """Server-side apply a Certificate manifest built by certificate_manifest."""
+        return await self._apply("cert-manager.io", "certificates", certificate_body)
+
+    @observe_apiserver_call("issuers", "get")
+    async def get_issuer(self, name, namespace):
+        try:
+            return await self.client.get_namespaced_custom_object(
+                "cert-manager.io",
+                "v1",
+                namespace,
+                "issuers",
+                name,
+            )
+        except ApiException as e:
+            logging.error("Error fetching issuer: %s", e)
+            if e.status == 404:
+                raise IssuerDoesnotExist(
+                    f"Issuer {name} does not exist in namespace {namespace}"
+                )
+
+    @observe_apiserver_call("clusterissuers", "get")
+    async def get_cluster_issuer(self, name):
+        try:
+            return await self.client.get_cluster_custom_object(
+                "cert-manager.io",
+                "v1",
+                "clusterissuers",
+                name,
+            )
+        except ApiException as e:
+            logging.error("Error fetching cluster issuer: %s", e)
+            if e.status == 404:
+                raise ClusterIssuerDoesnotExist(f"ClusterIssuer {name} does not exist")
+
+    @observe_apiserver_call("gateways", "get")
+    async def get_istio_gateway(self, name, namespace):
+        try:
+            return await self.client.get_namespaced_custom_object(
+                "networking.istio.io",
+                "v1",
+                namespace,
+                "gateways",
+                name,
+            )
+        except ApiException as e:
+            logging.error("Error fetching Istio Gateway: %s", e)
+            if e.status == 404:
+                return None
+            raise
+
+    @observe_apiserver_call("virtualservices", "get")
+    async def get_virtual_service(self, name, namespace):
+        try:
+            return await self.client.get_namespaced_custom_object(
+                "networking.istio.io",
+                "v1",
+                namespace,
+                "virtualservices",
+                name,
+            )
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    @observe_apiserver_call("gateways", "apply")
+    async def apply_istio_gateway(self, gateway: dict):
+        """Server-side apply a Gateway manifest built by gateway_manifest."""
+        try:
+            return await self._apply("networking.istio.io", "gateways", gateway)
+        except ApiException as e:
+            logging.error("Error applying Istio Gateway: %s", e)
+            raise
+
+    async def _apply(self, group: str, plural: str, manifest: dict):
+        # The generated client only deserializes 200 responses for PATCH, but an
+        # apply that creates the object answers 201, so read the body ourselves.
+        metadata = manifest["metadata"]
+        response = await self.client.patch_namespaced_custom_object(
+            group,
+            "v1",
+            metadata["namespace"],
+            plural,
+            metadata["name"],
+            manifest,
+            field_manager=FIELD_MANAGER,
+            force=True,
+            _content_type="application/apply-patch+yaml",
+            _preload_content=False,
+        )
+        async with response:
+            data = await response.read()
+            if not 200 <= response.status <= 299:
+                raise ApiException(http_resp=RESTResponse(response, data))
+        return json.loads(data)
+
+    async def iter_custom_objects(
+        self, group: str, plural: str, namespace: str = None, page_size: int = 500, label_selector: str = None
+    ):
+        """Yield pages of a collection using limit/continue instead of one unbounded LIST."""
+        _continue = None
+        while True:
+            kwargs = {"limit": page_size}
+            if label_selector:
+                kwargs["label_selector"] = label_selector
+            if _continue:
+                kwargs["_continue"] = _continue
+            with APISERVER_REQUEST_LATENCY.labels(plural, "list").time():
+                if namespace:
+                    response = await self.client.list_namespaced_custom_object(
+                        group, "v1", namespace, plural, **kwargs
+                    )
+                else:
+                    response = await self.client.list_cluster_custom_object(
+                        group, "v1", plural, **kwargs
+                    )
+            yield response.get("items", [])
+            _continue = response.get("metadata", {}).get("continue")
+            if not _continue:
+                return
+
+    @observe_apiserver_call("certificates", "delete")
+    async def delete_certificate(self, name: str, namespace: str):
+        try:
+            await self.client.delete_namespaced_custom_object(
+                "cert-manager.io",
+                "v1",
+                namespace,
+                "certificates",
+                name,
+            )
+        except ApiException as e:
+            if e.status != 404:
+                logging.error("Error deleting Certificate: %s", e)
+                raise
+
+    @observe_apiserver_call("gateways", "delete")
+    async def delete_istio_gateway(self, name: str, namespace: str):
+        try:
+            await self.client.delete_namespaced_custom_object(
+                "networking.istio.io",
+                "v1",
+                namespace,
+                "gateways",
+                name,
+            )
+        except ApiException as e:
+            logging.error("Error deleting Istio Gateway: %s", e)
+            if e.status == 404:
+                logging.error("Istio Gateway %s not found.", name)
+            else:
+                raise
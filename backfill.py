@@ -0,0 +1,222 @@
+"""
+Provisions Gateways and Certificates for VirtualServices that existed before
+the webhook was installed. Run with ``python app.py backfill``.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from errors import (
+    AnnotationDoesNotExist,
+    ClusterIssuerDoesnotExist,
+    Deferred,
+    GatewayAlreadyExists,
+    IssuerDoesnotExist,
+    IstioGatewayNamespaceError,
+    SharedGatewayConflict,
+)
+from handler import IstioHandler, cluster_cache, kubernetes_utility
+from resync import DriftResync
+from schemas import ReconcileRequestSchema
+
+# Retrying cannot fix these; they are reported as failures straight away.
+PERMANENT_ERRORS = (
+    AnnotationDoesNotExist,
+    ClusterIssuerDoesnotExist,
+    GatewayAlreadyExists,
+    IssuerDoesnotExist,
+    IstioGatewayNamespaceError,
+    SharedGatewayConflict,
+)
+
+
+class _InformerView:
+    """Name lookups on a synced namespaced informer, as DriftResync.drift expects."""
+
+    def __init__(self, informer):
+        self.informer = informer
+
+    def get(self, name):
+        return self.informer.get(name, self.informer.namespace)
+
+
+class Backfill:
+    """
+    Pages through every VirtualService and reconciles the ones whose Gateway
+    or Certificate is missing or out of date, ``concurrency`` at a time.
+
+    Gateways, Certificates and issuers are read from informers, so only
+    VirtualServices that need a change cost apiserver calls, and those go
+    through the client's read/write rate limits. The LIST is ordered by
+    namespace/name; once every VirtualService of a page is done, the last
+    key is written to the checkpoint file, and a resumed run skips
+    everything up to it and reports on the rest. With ``dry_run`` the
+    preflight checks run but nothing is written, the checkpoint included.
+    VirtualServices whose Certificate the issuance budget defers are counted
+    as deferred; the webhook's drift resync provisions them later.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 16,
+        page_size: int = 500,
+        dry_run: bool = False,
+        checkpoint: str = None,
+        retries: int = 3,
+        report_interval: float = 10,
+    ):
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.dry_run = dry_run
+        self.checkpoint = checkpoint
+        self.retries = retries
+        self.report_interval = report_interval
+        self.resync = DriftResync(kubernetes_utility, cluster_cache, None)
+        self.resume_after = ""
+        self.resumed_after = None
+        self.counts = {"processed": 0, "changed": 0, "up_to_date": 0, "skipped": 0, "deferred": 0, "failed": 0}
+        self.reasons = {}
+        self.failures = []
+        self._started = None
+        self._pages = {}
+        self._next_page = 0
+        self._load_checkpoint()
+
+    @staticmethod
+    def _key(virtual_service: dict) -> str:
+        # The apiserver lists in etcd key order, which is this string's order.
+        metadata = virtual_service["metadata"]
+        return f"{metadata.get('namespace', '')}/{metadata['name']}"
+
+    def _load_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        self.resume_after = self.resumed_after = state["last"]
+        logging.info("Resuming backfill after %s", self.resume_after)
+
+    def _write_checkpoint(self):
+        if not self.checkpoint or self.dry_run:
+            return
+        state = {"last": self.resume_after, **self.report()}
+        temporary = f"{self.checkpoint}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(state, f)
+        os.replace(temporary, self.checkpoint)
+
+    def report(self) -> dict:
+        seconds = time.monotonic() - self._started if self._started else 0
+        processed = self.counts["processed"]
+        return {
+            "dry_run": self.dry_run,
+            "resumed_after": self.resumed_after,
+            "counts": dict(self.counts),
+            "reasons": dict(self.reasons),
+            "failures": list(self.failures),
+            "seconds": round(seconds, 3),
+            "per_second": round(processed / seconds, 1) if seconds else 0.0,
+        }
+
+    async def run(self) -> dict:
+        await kubernetes_utility.initialize()
+        # The informers are started regardless of CacheConfig: without them
+        # every VirtualService would cost a GET per Gateway and Certificate.
+        for informer in cluster_cache.informers:
+            informer.start()
+        work = asyncio.Queue(self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(work)) for _ in range(self.concurrency)]
+        progress = asyncio.create_task(self._log_progress())
+        try:
+            for informer in cluster_cache.informers:
+                await informer.wait_for_sync()
+            self._started = time.monotonic()
+            page_index = 0
+            async for page in kubernetes_utility.iter_custom_objects(
+                "networking.istio.io", "virtualservices", page_size=self.page_size
+            ):
+                page = [vs for vs in page if self._key(vs) > (self.resumed_after or "")]
+                if not page:
+                    continue
+                self._pages[page_index] = [len(page), self._key(page[-1])]
+                for virtual_service in page:
+                    await work.put((page_index, virtual_service))
+                page_index += 1
+            await work.join()
+        finally:
+            for task in [*workers, progress]:
+                task.cancel()
+            await asyncio.gather(*workers, progress, return_exceptions=True)
+            self._write_checkpoint()
+            await cluster_cache.stop()
+            await kubernetes_utility.close()
+        return self.report()
+
+    async def _worker(self, work: asyncio.Queue):
+        while True:
+            page_index, virtual_service = await work.get()
+            try:
+                await self._process(virtual_service)
+            finally:
+                work.task_done()
+                self._page_done(page_index)
+
+    def _page_done(self, page_index: int):
+        self._pages[page_index][0] -= 1
+        # Only advance past pages whose VirtualServices, and every page
+        # before them, are all done.
+        advanced = False
+        while self._pages.get(self._next_page, [None])[0] == 0:
+            self.resume_after = self._pages.pop(self._next_page)[1]
+            self._next_page += 1
+            advanced = True
+        if advanced:
+            self._write_checkpoint()
+
+    async def _process(self, virtual_service: dict):
+        request = ReconcileRequestSchema.from_virtual_service(virtual_service, "BACKFILL")
+        self.counts["processed"] += 1
+        if not request.annotations or not request.gateways or not request.gateways[0].startswith("istio-system/"):
+            self.counts["skipped"] += 1
+            return
+        reason = self.resync.drift(
+            request, _InformerView(cluster_cache.gateways), _InformerView(cluster_cache.certificates)
+        )
+        if reason is None:
+            self.counts["up_to_date"] += 1
+            return
+        for attempt in range(self.retries + 1):
+            handler = IstioHandler(request.as_request_object())
+            try:
+                if self.dry_run:
+                    await handler.preflight_check()
+                else:
+                    await handler.reconcile()
+                break
+            except Deferred:
+                self.counts["deferred"] += 1
+                return
+            except Exception as e:
+                if isinstance(e, PERMANENT_ERRORS) or attempt == self.retries:
+                    self.counts["failed"] += 1
+                    self.failures.append(
+                        {"virtual_service": self._key(virtual_service), "error": f"{type(e).__name__}: {e}"}
+                    )
+                    return
+                await asyncio.sleep(2 ** attempt)
+        self.counts["changed"] += 1
+        reason = "/".join(reason)
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    async def _log_progress(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            report = self.report()
+            counts = report["counts"]
+            logging.info(
+                "Backfill: %s processed, %s %s, %s failed, %s/s",
+                counts["processed"], counts["changed"], "would change" if self.dry_run else "changed",
+                counts["failed"], report["per_second"],
+            )
@@ -0,0 +1,239 @@
+"""
+In-process stand-in for the parts of the Kubernetes API the webhook uses:
+namespaced and cluster-scoped custom objects (get, list, watch, create,
+replace, apply, delete) with configurable injected latency and errors.
+"""
+import asyncio
+import itertools
+import json
+import random
+import uuid
+from collections import Counter
+
+from aiohttp import web
+
+_NAMESPACED = "/apis/{group}/{version}/namespaces/{namespace}/{plural}"
+_CLUSTER = "/apis/{group}/{version}/{plural}"
+
+
+class FakeApiServer:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.objects = {}
+        self.calls = Counter()
+        self._resource_version = itertools.count(1)
+        self._watchers = []
+        self._runner = None
+        self.port = None
+
+    def seed(self, group: str, plural: str, obj: dict, namespace: str = None):
+        obj = json.loads(json.dumps(obj))
+        metadata = obj.setdefault("metadata", {})
+        if namespace:
+            metadata["namespace"] = namespace
+        metadata.setdefault("uid", str(uuid.uuid4()))
+        metadata["resourceVersion"] = str(next(self._resource_version))
+        self.objects[(group, plural, namespace, metadata["name"])] = obj
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def api_calls(self) -> int:
+        return sum(count for (verb, _), count in self.calls.items() if verb != "watch")
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/_stats", self._stats)
+        app.router.add_get("/version", self._version)
+        app.router.add_get("/version/", self._version)
+        for prefix in (_NAMESPACED, _CLUSTER):
+            app.router.add_route("*", prefix, self._collection)
+            app.router.add_route("*", prefix + "/{name}", self._member)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        for _, queue in self._watchers:
+            queue.put_nowait(None)
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def kubeconfig(self) -> str:
+        return json.dumps({
+            "apiVersion": "v1",
+            "kind": "Config",
+            "clusters": [{"name": "fake", "cluster": {"server": f"http://127.0.0.1:{self.port}"}}],
+            "users": [{"name": "fake", "user": {"token": "fake"}}],
+            "contexts": [{"name": "fake", "context": {"cluster": "fake", "user": "fake"}}],
+            "current-context": "fake",
+        })
+
+    async def _inject(self, verb: str, plural: str):
+        self.calls[(verb, plural)] += 1
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if verb != "watch" and self.error_rate and self.random.random() < self.error_rate:
+            return self._status(500, "InternalError", "injected failure")
+        return None
+
+    @staticmethod
+    def _status(code: int, reason: str, message: str) -> web.Response:
+        return web.json_response(
+            {"kind": "Status", "apiVersion": "v1", "status": "Failure", "code": code, "reason": reason, "message": message},
+            status=code,
+        )
+
+    def _key(self, request: web.Request, name: str = None):
+        info = request.match_info
+        return (info["group"], info["plural"], info.get("namespace"), name or info.get("name"))
+
+    def _matching(self, group: str, plural: str, namespace: str):
+        # The apiserver lists in etcd key order, namespace/name.
+        matching = [
+            (f"{obj_namespace}/{name}" if obj_namespace else name, obj)
+            for (obj_group, obj_plural, obj_namespace, name), obj in self.objects.items()
+            if obj_group == group and obj_plural == plural and (namespace is None or obj_namespace == namespace)
+        ]
+        return [obj for _, obj in sorted(matching, key=lambda item: item[0])]
+
+    def _store(self, key, obj: dict, event_type: str) -> dict:
+        obj["metadata"]["resourceVersion"] = str(next(self._resource_version))
+        self.objects[key] = obj
+        self._notify(key, event_type, obj)
+        return obj
+
+    def _notify(self, key, event_type: str, obj: dict):
+        for matches, queue in list(self._watchers):
+            if matches(key):
+                queue.put_nowait({"type": event_type, "object": obj})
+
+    async def _collection(self, request: web.Request):
+        group, plural, namespace, _ = self._key(request)
+        if request.method == "GET" and request.query.get("watch") in ("true", "True", "1"):
+            return await self._watch(request, group, plural, namespace)
+        verb = {"GET": "list", "POST": "create"}.get(request.method, request.method.lower())
+        failure = await self._inject(verb, plural)
+        if failure is not None:
+            return failure
+        if request.method == "GET":
+            items = self._matching(group, plural, namespace)
+            selector = request.query.get("labelSelector")
+            if selector:
+                # Equality requirements only, which is all the webhook sends.
+                wanted = dict(term.split("=", 1) for term in selector.split(","))
+                items = [
+                    item for item in items
+                    if all((item["metadata"].get("labels") or {}).get(k) == v for k, v in wanted.items())
+                ]
+            limit = int(request.query.get("limit", 0) or 0)
+            offset = int(request.query.get("continue", 0) or 0)
+            metadata = {"resourceVersion": str(next(self._resource_version))}
+            if limit:
+                if offset + limit < len(items):
+                    metadata["continue"] = str(offset + limit)
+                items = items[offset:offset + limit]
+            return web.json_response({"items": items, "metadata": metadata})
+        if request.method == "POST":
+            body = await request.json()
+            key = self._key(request, body["metadata"]["name"])
+            if key in self.objects:
+                return self._status(409, "AlreadyExists", f"{plural} {key[3]} already exists")
+            body["metadata"]["uid"] = str(uuid.uuid4())
+            if namespace:
+                body["metadata"]["namespace"] = namespace
+            return web.json_response(self._store(key, body, "ADDED"), status=201)
+        return self._status(405, "MethodNotAllowed", request.method)
+
+    async def _member(self, request: web.Request):
+        key = self._key(request)
+        group, plural, namespace, name = key
+        verb = {"GET": "get", "PUT": "update", "DELETE": "delete"}.get(request.method)
+        if request.method == "PATCH":
+            content_type = request.headers.get("Content-Type", "")
+            verb = "apply" if "apply-patch" in content_type else "patch"
+        failure = await self._inject(verb or request.method.lower(), plural)
+        if failure is not None:
+            return failure
+        existing = self.objects.get(key)
+        if request.method == "GET":
+            if existing is None:
+                return self._status(404, "NotFound", f"{plural} {name} not found")
+            return web.json_response(existing)
+        if request.method == "DELETE":
+            if existing is None:
+                return self._status(404, "NotFound", f"{plural} {name} not found")
+            del self.objects[key]
+            self._notify(key, "DELETED", existing)
+            return web.json_response({"kind": "Status", "status": "Success"})
+        body = json.loads(await request.read() or b"{}")
+        if request.method == "PUT":
+            if existing is None:
+                return self._status(404, "NotFound", f"{plural} {name} not found")
+            resource_version = body["metadata"].get("resourceVersion")
+            if resource_version and resource_version != existing["metadata"]["resourceVersion"]:
+                return self._status(409, "Conflict", f"{plural} {name} has been modified")
+            body["metadata"]["uid"] = existing["metadata"]["uid"]
+            return web.json_response(self._store(key, body, "MODIFIED"))
+        if request.method == "PATCH":
+            metadata = body.setdefault("metadata", {})
+            if namespace:
+                metadata["namespace"] = namespace
+            if existing is None:
+                metadata["uid"] = str(uuid.uuid4())
+                return web.json_response(self._store(key, body, "ADDED"), status=201)
+            merged = {**existing, **body}
+            merged["metadata"] = {**existing["metadata"], **metadata}
+            return web.json_response(self._store(key, merged, "MODIFIED"))
+        return self._status(405, "MethodNotAllowed", request.method)
+
+    async def _watch(self, request: web.Request, group: str, plural: str, namespace: str):
+        await self._inject("watch", plural)
+        timeout = float(request.query.get("timeoutSeconds", 300))
+        queue = asyncio.Queue()
+        watcher = (
+            lambda key: key[0] == group and key[1] == plural and (namespace is None or key[2] == namespace),
+            queue,
+        )
+        self._watchers.append(watcher)
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if event is None:
+                    break
+                await response.write(json.dumps(event).encode() + b"\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The watcher went away; nothing left to deliver.
+            pass
+        finally:
+            self._watchers.remove(watcher)
+        return response
+
+    async def _version(self, request: web.Request):
+        return web.json_response({"major": "1", "minor": "31", "gitVersion": "v1.31.0-fake", "platform": "linux/amd64"})
+
+    async def _stats(self, request: web.Request):
+        return web.json_response(
+            {"calls": {f"{verb} {plural}": count for (verb, plural), count in self.calls.items()}}
+        )
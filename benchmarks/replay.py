@@ -0,0 +1,232 @@
+"""
+Replay captured AdmissionReviews (CAPTURE_ENABLED) through main:app against
+a fake apiserver, optionally seeded with a snapshot of the cluster.
+
+    python -m benchmarks.replay admission-capture-*.jsonl.gz --speed 10
+    python -m benchmarks.replay capture.jsonl.gz --speed 0 --snapshot cluster.json
+    python -m benchmarks.replay capture.jsonl.gz --write-baseline before.json
+    python -m benchmarks.replay capture.jsonl.gz --baseline before.json
+
+A snapshot is the output of
+
+    kubectl get gateways.networking.istio.io,certificates.cert-manager.io,\\
+        issuers.cert-manager.io,clusterissuers.cert-manager.io -A -o json
+
+--speed 1 keeps the recorded timing, higher values compress it and 0 sends
+everything at once, --concurrency at a time. Issuers the reviews name are
+added to the fake apiserver unless --no-seed-issuers is given. The report
+has the same metrics as benchmarks.run, so --baseline compares two runs,
+plus the recorded latencies and how many admission decisions changed.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import aiohttp
+
+from benchmarks.fake_apiserver import FakeApiServer
+from benchmarks.run import compare, percentile, start_webhook, wait_for
+from capture import read_capture
+
+KIND_PLURALS = {
+    "Gateway": "gateways",
+    "Certificate": "certificates",
+    "Issuer": "issuers",
+    "ClusterIssuer": "clusterissuers",
+    "VirtualService": "virtualservices",
+}
+
+
+def load_records(paths: list[str], limit: int = None) -> list[dict]:
+    records = [record for path in paths for record in read_capture(path)]
+    records.sort(key=lambda record: record["t"])
+    return records[:limit] if limit else records
+
+
+def seed_snapshot(apiserver: FakeApiServer, path: str) -> int:
+    with open(path) as file:
+        data = json.load(file)
+    items = data.get("items", []) if isinstance(data, dict) else data
+    seeded = 0
+    for obj in items:
+        plural = KIND_PLURALS.get(obj.get("kind"))
+        if plural is None:
+            continue
+        group = obj["apiVersion"].split("/")[0]
+        apiserver.seed(group, plural, obj, obj["metadata"].get("namespace"))
+        seeded += 1
+    return seeded
+
+
+def seed_issuers(apiserver: FakeApiServer, records: list[dict]):
+    """Add the Issuers and ClusterIssuers the reviews refer to, if missing."""
+    for record in records:
+        request = record["review"].get("request") or {}
+        for obj in (request.get("object"), request.get("oldObject")):
+            if not obj:
+                continue
+            annotations = obj.get("metadata", {}).get("annotations") or {}
+            cluster_issuer = annotations.get("cert-manager.io/cluster-issuer")
+            issuer = annotations.get("cert-manager.io/issuer")
+            if cluster_issuer and ("cert-manager.io", "clusterissuers", None, cluster_issuer) not in apiserver.objects:
+                apiserver.seed("cert-manager.io", "clusterissuers", {"metadata": {"name": cluster_issuer}})
+            namespace = obj.get("metadata", {}).get("namespace")
+            if issuer and ("cert-manager.io", "issuers", namespace, issuer) not in apiserver.objects:
+                apiserver.seed("cert-manager.io", "issuers", {"metadata": {"name": issuer}}, namespace)
+
+
+async def replay(session, base_url: str, records: list[dict], speed: float, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    latencies = []
+    denied = 0
+    failed = 0
+    changed = 0
+    first = records[0]["t"]
+    start = loop.time()
+
+    async def send(record):
+        nonlocal denied, failed, changed
+        if speed:
+            await asyncio.sleep(max(0.0, start + (record["t"] - first) / speed - loop.time()))
+        body = json.dumps(record["review"]).encode()
+        async with semaphore:
+            sent = time.perf_counter()
+            try:
+                async with session.post(
+                    base_url + record["path"], data=body, headers={"Content-Type": "application/json"}
+                ) as response:
+                    payload = await response.json(content_type=None)
+                    allowed = payload.get("response", {}).get("allowed") if payload else None
+                    if response.status != 200:
+                        failed += 1
+                    elif allowed is False:
+                        denied += 1
+                    if record.get("allowed") is not None and allowed is not None and allowed != record["allowed"]:
+                        changed += 1
+            except aiohttp.ClientError:
+                failed += 1
+            latencies.append(time.perf_counter() - sent)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(record) for record in records))
+    return latencies, time.perf_counter() - started, denied, failed, changed
+
+
+async def run(args) -> dict:
+    records = load_records(args.captures, args.limit)
+    if not records:
+        raise SystemExit("No records in the capture files")
+    apiserver = FakeApiServer(args.latency, args.jitter, args.error_rate, args.seed)
+    seeded = seed_snapshot(apiserver, args.snapshot) if args.snapshot else 0
+    if args.seed_issuers:
+        seed_issuers(apiserver, records)
+    await apiserver.start()
+
+    started = time.monotonic()
+    webhook, base_url, log_path = start_webhook(apiserver, dict(args.env or []))
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_for(session, f"{base_url}/readyz", lambda status: True, args.startup_timeout)
+            startup_seconds = time.monotonic() - started
+            apiserver.reset_calls()
+            latencies, elapsed, denied, failed, changed = await replay(
+                session, base_url, records, args.speed, args.concurrency
+            )
+            await wait_for(
+                session,
+                f"{base_url}/queue",
+                lambda stats: stats["depth"] == 0 and stats["in_flight"] == 0,
+                args.drain_timeout,
+            )
+    finally:
+        webhook.terminate()
+        webhook.wait()
+        await apiserver.stop()
+
+    recorded = [record["ms"] for record in records]
+    return {
+        "config": {
+            "captures": args.captures,
+            "records": len(records),
+            "speed": args.speed,
+            "concurrency": args.concurrency,
+            "snapshot": args.snapshot,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+        },
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "startup_seconds": round(startup_seconds, 3),
+        "apiserver_calls_per_admission": round(apiserver.api_calls() / len(records), 3),
+        "apiserver_calls": {f"{verb} {plural}": count for (verb, plural), count in sorted(apiserver.calls.items())},
+        "denied": denied,
+        "failed": failed,
+        "changed_decisions": changed,
+        "recorded": {
+            "p50_ms": round(percentile(recorded, 0.50), 3),
+            "p95_ms": round(percentile(recorded, 0.95), 3),
+            "p99_ms": round(percentile(recorded, 0.99), 3),
+            "seconds": round(records[-1]["t"] - records[0]["t"], 3),
+        },
+        "replay_seconds": round(elapsed, 3),
+        "seeded_objects": seeded,
+        "webhook_log": log_path,
+    }
+
+
+def env_var(value: str) -> tuple[str, str]:
+    key, separator, env_value = value.partition("=")
+    if not separator or not key:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {value!r}")
+    return key, env_value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="Capture files; records are merged by time")
+    parser.add_argument("--speed", type=float, default=1.0, help="Timing multiplier; 0 sends as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=256, help="Requests in flight at most")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N records")
+    parser.add_argument("--snapshot", help="Kubernetes List of objects to seed the fake apiserver with")
+    parser.add_argument("--seed-issuers", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--env", action="append", type=env_var, metavar="KEY=VALUE", help="Set for the webhook")
+    parser.add_argument("--latency", type=float, default=0.005, help="Injected apiserver latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra uniform random apiserver latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of apiserver calls answered with 500")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--baseline", help="Fail if the run regresses against this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--write-baseline", help="Store this run as the baseline")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as file:
+            json.dump({key: value for key, value in result.items() if key != "webhook_log"}, file, indent=2)
+            file.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("config") != result["config"]:
+            print("warning: baseline was recorded with a different configuration", file=sys.stderr)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            for regression in regressions:
+                print(f"REGRESSION {regression}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
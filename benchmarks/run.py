@@ -0,0 +1,280 @@
+"""
+Drive /validate with synthetic AdmissionReviews against a fake apiserver.
+
+    python -m benchmarks.run --requests 2000 --concurrency 50 --latency 0.005
+    python -m benchmarks.run --write-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+
+With --baseline the run exits non-zero when latency, throughput or apiserver
+calls per admission regress by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.fake_apiserver import FakeApiServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# metric -> direction in which a change counts as a regression
+REGRESSION_CHECKS = {
+    "p50_ms": "higher",
+    "p95_ms": "higher",
+    "p99_ms": "higher",
+    "throughput_rps": "lower",
+    "startup_seconds": "higher",
+    "apiserver_calls_per_admission": "higher",
+}
+
+
+def virtual_service(name: str, namespace: str, hosts: list[str], routes: int) -> dict:
+    return {
+        "apiVersion": "networking.istio.io/v1",
+        "kind": "VirtualService",
+        "metadata": {
+            "name": name,
+            "namespace": namespace,
+            "generation": 1,
+            "annotations": {"cert-manager.io/cluster-issuer": "letsencrypt"},
+        },
+        "spec": {
+            "gateways": [f"istio-system/{name}-gateway"],
+            "hosts": hosts,
+            "http": [
+                {
+                    "match": [{"uri": {"prefix": f"/route-{index}"}}],
+                    "route": [{"destination": {"host": f"svc-{index}.{namespace}.svc.cluster.local", "port": {"number": 8080}}}],
+                }
+                for index in range(routes)
+            ],
+        },
+    }
+
+
+def admission_review(uid: str, operation: str, obj: dict = None, old_obj: dict = None) -> dict:
+    return {
+        "apiVersion": "admission.k8s.io/v1",
+        "kind": "AdmissionReview",
+        "request": {
+            "uid": uid,
+            "operation": operation,
+            "object": obj,
+            "oldObject": old_obj,
+        },
+    }
+
+
+def build_workload(requests: int, routes: int, mix: tuple[int, int, int], seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    live = []
+    reviews = []
+    for index in range(requests):
+        operation = rng.choices(["CREATE", "UPDATE", "DELETE"], weights=mix)[0] if live else "CREATE"
+        uid = f"bench-{index}"
+        if operation == "CREATE":
+            vs = virtual_service(f"vs-{index}", f"ns-{index % 20}", [f"vs-{index}.example.com"], routes)
+            live.append(vs)
+            reviews.append(admission_review(uid, "CREATE", vs))
+        elif operation == "UPDATE":
+            position = rng.randrange(len(live))
+            old_vs = live[position]
+            vs = json.loads(json.dumps(old_vs))
+            vs["metadata"]["generation"] += 1
+            if rng.random() < 0.5:
+                vs["spec"]["hosts"] = [f"{vs['metadata']['name']}-{index}.example.com"]
+            live[position] = vs
+            reviews.append(admission_review(uid, "UPDATE", vs, old_vs))
+        else:
+            old_vs = live.pop(rng.randrange(len(live)))
+            reviews.append(admission_review(uid, "DELETE", None, old_vs))
+    return reviews
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for(session: aiohttp.ClientSession, url: str, predicate, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200 and predicate(await response.json()):
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.02)
+    raise TimeoutError(f"Timed out waiting for {url}")
+
+
+async def drive(session, url: str, reviews: list[dict], concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    denied = 0
+    failed = 0
+
+    async def send(review):
+        nonlocal denied, failed
+        body = json.dumps(review).encode()
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(url, data=body, headers={"Content-Type": "application/json"}) as response:
+                    payload = await response.json(content_type=None)
+                    if response.status != 200:
+                        failed += 1
+                    elif not payload["response"]["allowed"]:
+                        denied += 1
+            except aiohttp.ClientError:
+                failed += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(review) for review in reviews))
+    return latencies, time.perf_counter() - start, denied, failed
+
+
+def start_webhook(apiserver: FakeApiServer, env: dict = None):
+    """Run main:app under uvicorn against ``apiserver``; returns (process, base URL, log path)."""
+    workdir = tempfile.mkdtemp(prefix="webhook-bench-")
+    kubeconfig = os.path.join(workdir, "kubeconfig")
+    with open(kubeconfig, "w") as file:
+        file.write(apiserver.kubeconfig())
+    port = free_port()
+    log_path = os.path.join(workdir, "webhook.log")
+    env = {**os.environ, **(env or {}), "KUBECONFIG": kubeconfig}
+    with open(log_path, "w") as log:
+        webhook = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=REPO_ROOT,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    return webhook, f"http://127.0.0.1:{port}", log_path
+
+
+async def run(args) -> dict:
+    apiserver = FakeApiServer(args.latency, args.jitter, args.error_rate, args.seed)
+    apiserver.seed("cert-manager.io", "clusterissuers", {"metadata": {"name": "letsencrypt"}})
+    await apiserver.start()
+
+    started = time.monotonic()
+    webhook, base_url, log_path = start_webhook(apiserver)
+    reviews = build_workload(args.requests, args.routes, tuple(args.mix), args.seed)
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_for(session, f"{base_url}/readyz", lambda status: True, args.startup_timeout)
+            startup_seconds = time.monotonic() - started
+            await asyncio.sleep(args.warmup)
+            apiserver.reset_calls()
+            latencies, elapsed, denied, failed = await drive(
+                session, f"{base_url}/validate", reviews, args.concurrency
+            )
+            await wait_for(
+                session,
+                f"{base_url}/queue",
+                lambda stats: stats["depth"] == 0 and stats["in_flight"] == 0,
+                args.drain_timeout,
+            )
+    finally:
+        webhook.terminate()
+        webhook.wait()
+        await apiserver.stop()
+
+    return {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "routes": args.routes,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "mix": list(args.mix),
+        },
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "startup_seconds": round(startup_seconds, 3),
+        "apiserver_calls_per_admission": round(apiserver.api_calls() / len(reviews), 3),
+        "apiserver_calls": {f"{verb} {plural}": count for (verb, plural), count in sorted(apiserver.calls.items())},
+        "denied": denied,
+        "failed": failed,
+        "webhook_log": log_path,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for metric, direction in REGRESSION_CHECKS.items():
+        if metric not in baseline:
+            # A check the baseline predates would otherwise pass silently.
+            regressions.append(f"{metric}: missing from the baseline, re-record it with --write-baseline")
+            continue
+        expected, actual = baseline[metric], result[metric]
+        if direction == "higher" and actual > expected * (1 + tolerance):
+            regressions.append(f"{metric}: {actual} > {expected} (+{tolerance:.0%})")
+        if direction == "lower" and actual < expected * (1 - tolerance):
+            regressions.append(f"{metric}: {actual} < {expected} (-{tolerance:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--routes", type=int, default=10, help="HTTP routes per synthetic VirtualService")
+    parser.add_argument("--mix", type=int, nargs=3, default=[50, 40, 10], metavar=("CREATE", "UPDATE", "DELETE"))
+    parser.add_argument("--latency", type=float, default=0.005, help="Injected apiserver latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra uniform random apiserver latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of apiserver calls answered with 500")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--warmup", type=float, default=0.0, help="Extra seconds to wait after /readyz")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--baseline", help="Fail if the run regresses against this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--write-baseline", help="Store this run as the baseline")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as file:
+            json.dump({key: value for key, value in result.items() if key != "webhook_log"}, file, indent=2)
+            file.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("config") != result["config"]:
+            print("warning: baseline was recorded with a different configuration", file=sys.stderr)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            for regression in regressions:
+                print(f"REGRESSION {regression}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
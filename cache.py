@@ -0,0 +1,444 @@
+import asyncio
+import logging
+import time
+
+from kubernetes_asyncio import watch
+from kubernetes_asyncio.client.exceptions import ApiException
+
+from config import CacheConfig
+from errors import CircuitOpen, ClusterIssuerDoesnotExist, DeadlineExceeded, IssuerDoesnotExist
+from metrics import APISERVER_REQUEST_LATENCY, DEGRADED_READS
+from resources import gateway_hosts, gateway_owner, owner_selector
+
+
+class MemoryStore:
+    """
+    Process-local object store behind a ResourceInformer. It also keeps the
+    informer's indices, from the index values the informer computes for each
+    object, and since when the informer has been failing.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._synced = False
+        self._index_values = {}
+        self._indices = {}
+        self._failing_since = None
+
+    def get(self, key: str):
+        return self._items.get(key)
+
+    def values(self) -> list[dict]:
+        return list(self._items.values())
+
+    def items(self) -> dict:
+        return dict(self._items)
+
+    def by_index(self, name: str, value: str) -> list[dict]:
+        return [self._items[key] for key in self._indices.get(name, {}).get(value, ()) if key in self._items]
+
+    async def fetch(self, key: str):
+        return self.get(key)
+
+    async def fetch_by_index(self, name: str, value: str) -> list[dict]:
+        return self.by_index(name, value)
+
+    def set(self, key: str, obj: dict, index_values: dict = None):
+        self._unindex(key)
+        self._items[key] = obj
+        self._index(key, index_values)
+
+    def delete(self, key: str):
+        self._unindex(key)
+        self._items.pop(key, None)
+
+    def replace(self, items: dict, index_values: dict = None):
+        self._items = items
+        self._index_values = {}
+        self._indices = {}
+        for key, values in (index_values or {}).items():
+            self._index(key, values)
+        self._synced = True
+
+    def synced(self) -> bool:
+        return self._synced
+
+    def failing_since(self):
+        return self._failing_since
+
+    def set_failing_since(self, value):
+        self._failing_since = value
+
+    def _index(self, key: str, index_values: dict):
+        if not index_values:
+            return
+        self._index_values[key] = index_values
+        for name, values in index_values.items():
+            index = self._indices.setdefault(name, {})
+            for value in values:
+                index.setdefault(value, set()).add(key)
+
+    def _unindex(self, key: str):
+        for name, values in self._index_values.pop(key, {}).items():
+            index = self._indices.get(name, {})
+            for value in values:
+                keys = index.get(value)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[value]
+
+
+class ResourceInformer:
+    """
+    Keeps an in-memory copy of a custom resource collection in sync with the
+    apiserver using list+watch, resuming watches from the last seen
+    resourceVersion and relisting every resync period.
+
+    ``transform`` reduces each object before it is stored, and ``on_change``
+    is called with (event type, old, new) for every watch event and for
+    every difference a relist finds, so changes missed while the watch was
+    down are still delivered. Indices added with add_index() map derived
+    values to objects; the informer computes the values and the store keeps
+    the index, so a shared store serves it to every worker.
+    """
+
+    def __init__(
+        self,
+        kubernetes_utility,
+        group: str,
+        version: str,
+        plural: str,
+        namespace: str = None,
+        transform=None,
+        on_change=None,
+    ):
+        self.kubernetes_utility = kubernetes_utility
+        self.group = group
+        self.version = version
+        self.plural = plural
+        self.namespace = namespace
+        self.transform = transform
+        self.on_change = on_change
+        self.store = MemoryStore()
+        self._indexers = {}
+        self._resource_version = None
+        self._last_list = 0.0
+        self._task = None
+
+    @staticmethod
+    def _key(name, namespace=None):
+        return f"{namespace}/{name}" if namespace else name
+
+    def _object_key(self, obj: dict):
+        metadata = obj["metadata"]
+        return self._key(metadata["name"], metadata.get("namespace"))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name=f"informer-{self.plural}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def has_synced(self) -> bool:
+        return self.store.synced()
+
+    def staleness(self) -> float:
+        """Seconds since list+watch stopped working, 0 while it works."""
+        failing_since = self.store.failing_since()
+        if failing_since is None:
+            return 0.0
+        return time.monotonic() - failing_since
+
+    def is_fresh(self) -> bool:
+        return self.has_synced() and self.staleness() <= CacheConfig.max_staleness
+
+    async def wait_for_sync(self, timeout: float = None) -> bool:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self.has_synced():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    def get(self, name, namespace=None):
+        return self.store.get(self._key(name, namespace))
+
+    def list(self) -> list[dict]:
+        return self.store.values()
+
+    async def fetch(self, name, namespace=None):
+        """Like get(), without blocking the event loop on a shared store."""
+        return await self.store.fetch(self._key(name, namespace))
+
+    def add_index(self, name: str, func):
+        """Index objects by the values ``func(obj)`` returns."""
+        self._indexers[name] = func
+
+    def by_index(self, name: str, value: str) -> "list[dict]":
+        return self.store.by_index(name, value)
+
+    async def fetch_by_index(self, name: str, value: str) -> "list[dict]":
+        return await self.store.fetch_by_index(name, value)
+
+    def _index_values(self, obj: dict):
+        if not self._indexers:
+            return None
+        return {name: list(func(obj)) for name, func in self._indexers.items()}
+
+    def _set_failing(self, failing: bool):
+        # Only changes reach the store, which may be shared.
+        if failing and self.store.failing_since() is None:
+            self.store.set_failing_since(time.monotonic())
+        elif not failing and self.store.failing_since() is not None:
+            self.store.set_failing_since(None)
+
+    def upsert(self, obj: dict):
+        """Record an object we just wrote so reads do not wait for the watch event."""
+        if not obj:
+            return
+        self.store.set(self._object_key(obj), obj, self._index_values(obj))
+
+    def remove(self, name, namespace=None):
+        self.store.delete(self._key(name, namespace))
+
+    def _list_func(self):
+        api = self.kubernetes_utility.client
+        if self.namespace:
+            return api.list_namespaced_custom_object, (
+                self.group, self.version, self.namespace, self.plural
+            )
+        return api.list_cluster_custom_object, (
+            self.group, self.version, self.plural
+        )
+
+    async def _list(self):
+        func, args = self._list_func()
+        with APISERVER_REQUEST_LATENCY.labels(self.plural, "list").time():
+            response = await func(*args)
+        transform = self.transform or (lambda obj: obj)
+        items = {self._object_key(obj): transform(obj) for obj in response.get("items", [])}
+        index_values = {key: self._index_values(obj) for key, obj in items.items()} if self._indexers else None
+        # The first list only fills the store; later ones replace what the
+        # watch delivered.
+        previous = self.store.items() if self.on_change and self.store.synced() else None
+        self.store.replace(items, index_values)
+        self._resource_version = response["metadata"]["resourceVersion"]
+        self._last_list = time.monotonic()
+        self._set_failing(False)
+        if previous is not None:
+            self._emit_changes(previous, items)
+        logging.info(
+            "Informer for %s listed %s objects at resourceVersion %s",
+            self.plural, len(items), self._resource_version,
+        )
+
+    def _emit_changes(self, previous: dict, items: dict):
+        """Call on_change for what differs between two lists, as the watch events would have."""
+        for key, new in items.items():
+            old = previous.get(key)
+            if old is None:
+                self.on_change("ADDED", None, new)
+            elif old != new:
+                self.on_change("MODIFIED", old, new)
+        for key in previous.keys() - items.keys():
+            self.on_change("DELETED", previous[key], previous[key])
+
+    async def _watch(self):
+        func, args = self._list_func()
+        remaining = CacheConfig.resync_period - (time.monotonic() - self._last_list)
+        timeout = max(1, int(min(CacheConfig.watch_timeout, remaining)))
+        async with watch.Watch() as stream:
+            async for event in stream.stream(
+                func,
+                *args,
+                resource_version=self._resource_version,
+                allow_watch_bookmarks=True,
+                timeout_seconds=timeout,
+            ):
+                obj = event["raw_object"]
+                event_type = event["type"]
+                if event_type in ("ADDED", "MODIFIED", "DELETED"):
+                    self._apply_event(event_type, obj)
+                self._resource_version = obj["metadata"]["resourceVersion"]
+                self._set_failing(False)
+
+    def _apply_event(self, event_type: str, obj: dict):
+        key = self._object_key(obj)
+        new = self.transform(obj) if self.transform else obj
+        old = self.store.get(key) if self.on_change else None
+        if event_type == "DELETED":
+            self.store.delete(key)
+        else:
+            self.store.set(key, new, self._index_values(new))
+        if self.on_change:
+            self.on_change(event_type, old, new)
+
+    async def _run(self):
+        backoff = 1
+        while True:
+            try:
+                if (
+                    self._resource_version is None
+                    or time.monotonic() - self._last_list >= CacheConfig.resync_period
+                ):
+                    await self._list()
+                await self._watch()
+                self._set_failing(False)
+                backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except ApiException as e:
+                if e.status == 410:
+                    logging.info("Watch on %s expired, relisting", self.plural)
+                    self._resource_version = None
+                    continue
+                logging.error("Error watching %s: %s", self.plural, e)
+                self._set_failing(True)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            except Exception as e:
+                logging.error("Error watching %s: %s", self.plural, e)
+                self._set_failing(True)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+
+class ClusterCache:
+    """
+    Serves the lookups used by the admission preflight from informer-backed
+    memory, falling back to live reads until the informers have synced, or
+    once an informer has been unable to reach the apiserver for longer than
+    ``CacheConfig.max_staleness``.
+
+    Live reads remember their answer. When one cannot be made in time, because
+    the resource's circuit breaker is open or the admission deadline is
+    reached, the last answer is used instead if it is not older than
+    ``CacheConfig.max_staleness``.
+    """
+
+    def __init__(self, kubernetes_utility):
+        self.kubernetes_utility = kubernetes_utility
+        self._last_known = {}
+        self.gateways = ResourceInformer(
+            kubernetes_utility, "networking.istio.io", "v1", "gateways", "istio-system"
+        )
+        self.gateways.add_index("owner", lambda gateway: [owner] if (owner := gateway_owner(gateway)) else [])
+        self.gateways.add_index("host", gateway_hosts)
+        self.issuers = ResourceInformer(
+            kubernetes_utility, "cert-manager.io", "v1", "issuers"
+        )
+        self.cluster_issuers = ResourceInformer(
+            kubernetes_utility, "cert-manager.io", "v1", "clusterissuers"
+        )
+        self.certificates = ResourceInformer(
+            kubernetes_utility, "cert-manager.io", "v1", "certificates", "istio-system"
+        )
+
+    @property
+    def informers(self):
+        return [self.gateways, self.issuers, self.cluster_issuers, self.certificates]
+
+    def start(self):
+        if not CacheConfig.enabled:
+            logging.info("Informer cache disabled, reading from the apiserver")
+            return
+        for informer in self.informers:
+            informer.start()
+
+    async def stop(self):
+        for informer in self.informers:
+            await informer.stop()
+
+    def has_synced(self) -> bool:
+        return all(informer.has_synced() for informer in self.informers)
+
+    async def _read_through(self, resource: str, key: str, read):
+        """Await the live read ``read``, or answer from its last known result."""
+        now = time.monotonic()
+        try:
+            result = await read
+        except (IssuerDoesnotExist, ClusterIssuerDoesnotExist) as e:
+            self._remember(resource, key, now, e)
+            raise
+        except (CircuitOpen, DeadlineExceeded) as e:
+            known = self._last_known.get((resource, key))
+            if known is None or now - known[0] > CacheConfig.max_staleness:
+                raise
+            DEGRADED_READS.labels(resource).inc()
+            logging.warning("Answering %s %s from state %.0fs old: %s", resource, key, now - known[0], e)
+            if isinstance(known[1], Exception):
+                raise known[1]
+            return known[1]
+        self._remember(resource, key, now, result)
+        return result
+
+    def _remember(self, resource: str, key: str, now: float, result):
+        if len(self._last_known) >= 4096:
+            self._last_known = {
+                entry_key: entry for entry_key, entry in self._last_known.items()
+                if now - entry[0] <= CacheConfig.max_staleness
+            }
+        self._last_known[(resource, key)] = (now, result)
+
+    async def get_istio_gateway(self, name, namespace):
+        if self.gateways.is_fresh() and namespace == self.gateways.namespace:
+            return await self.gateways.fetch(name, namespace)
+        return await self._read_through(
+            "gateways", f"{namespace}/{name}", self.kubernetes_utility.get_istio_gateway(name, namespace)
+        )
+
+    async def owned_gateways(self, namespace: str, name: str) -> list[dict]:
+        """Gateways owned by a VirtualService, from the index or a label-selector LIST."""
+        owner = f"{namespace}/{name}"
+        if self.gateways.is_fresh():
+            return await self.gateways.fetch_by_index("owner", owner)
+        return await self._read_through("gateways", f"owner={owner}", self._list_owned_gateways(namespace, name))
+
+    async def _list_owned_gateways(self, namespace: str, name: str) -> list[dict]:
+        owner = f"{namespace}/{name}"
+        gateways = []
+        async for page in self.kubernetes_utility.iter_custom_objects(
+            "networking.istio.io", "gateways", "istio-system", label_selector=owner_selector(namespace, name)
+        ):
+            gateways.extend(gateway for gateway in page if gateway_owner(gateway) == owner)
+        return gateways
+
+    async def gateways_for_host(self, host: str) -> list[dict]:
+        return await self.gateways.fetch_by_index("host", host)
+
+    async def get_certificate(self, name, namespace):
+        if self.certificates.is_fresh() and namespace == self.certificates.namespace:
+            return await self.certificates.fetch(name, namespace)
+        return await self._read_through(
+            "certificates", f"{namespace}/{name}", self.kubernetes_utility.get_certificate(name, namespace)
+        )
+
+    async def get_issuer(self, name, namespace):
+        if not self.issuers.is_fresh():
+            return await self._read_through(
+                "issuers", f"{namespace}/{name}", self.kubernetes_utility.get_issuer(name, namespace)
+            )
+        issuer = await self.issuers.fetch(name, namespace)
+        if not issuer:
+            raise IssuerDoesnotExist(
+                f"Issuer {name} does not exist in namespace {namespace}"
+            )
+        return issuer
+
+    async def get_cluster_issuer(self, name):
+        if not self.cluster_issuers.is_fresh():
+            return await self._read_through(
+                "clusterissuers", name, self.kubernetes_utility.get_cluster_issuer(name)
+            )
+        cluster_issuer = await self.cluster_issuers.fetch(name)
+        if not cluster_issuer:
+            raise ClusterIssuerDoesnotExist(f"ClusterIssuer {name} does not exist")
+        return cluster_issuer
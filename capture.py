@@ -0,0 +1,189 @@
+"""
+Opt-in recording of the AdmissionReviews sent to /validate and /delete
+(CAPTURE_ENABLED), for replay with ``python -m benchmarks.replay``.
+
+Each record is one JSON line in a gzip file:
+{"t": unix time, "path": ..., "status": ..., "ms": handler latency,
+"allowed": ..., "review": redacted AdmissionReview}.
+"""
+import atexit
+import gzip
+import logging
+import os
+import queue
+import threading
+import time
+
+import orjson
+
+from config import CaptureConfig
+from metrics import CAPTURED_REVIEWS
+
+CAPTURED_PATHS = ("/validate", "/delete")
+REDACTED = "<redacted>"
+# Annotations the webhook reads; the values of all others are redacted.
+KEPT_ANNOTATION_PREFIX = "cert-manager.io/"
+DROPPED_ANNOTATIONS = ("kubectl.kubernetes.io/last-applied-configuration",)
+
+
+def _redact_object(obj: dict):
+    if not isinstance(obj, dict):
+        return
+    metadata = obj.get("metadata") or {}
+    metadata.pop("managedFields", None)
+    annotations = metadata.get("annotations")
+    if annotations:
+        metadata["annotations"] = {
+            key: value if key.startswith(KEPT_ANNOTATION_PREFIX) else REDACTED
+            for key, value in annotations.items()
+            if key not in DROPPED_ANNOTATIONS
+        }
+    if not CaptureConfig.keep_spec and isinstance(obj.get("spec"), dict):
+        obj["spec"] = {key: obj["spec"][key] for key in ("gateways", "hosts") if key in obj["spec"]}
+
+
+def redact(review: dict) -> dict:
+    """Strip who made the request and what the webhook does not read, in place."""
+    request = review.get("request") or {}
+    if "userInfo" in request:
+        request["userInfo"] = {"username": REDACTED}
+    for field in ("object", "oldObject"):
+        _redact_object(request.get(field))
+    return review
+
+
+class CaptureWriter:
+    """
+    Appends records from a background thread, so the request path only
+    enqueues bytes. Each process writes its own file; every run appends a
+    new gzip member, which readers see as one stream. The file is flushed
+    whenever the queue runs empty, so a crash loses at most the records
+    still queued.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = (path or CaptureConfig.path).format(pid=os.getpid())
+        self._records = queue.Queue(CaptureConfig.queue_size)
+        self._written = 0
+        self._thread = threading.Thread(target=self._run, name="admission-capture", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        logging.info("Capturing AdmissionReviews to %s", self.path)
+
+    def submit(self, record: tuple):
+        try:
+            self._records.put_nowait(record)
+        except queue.Full:
+            CAPTURED_REVIEWS.labels("queue_full").inc()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._records.put(None)
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        with gzip.open(self.path, "ab") as file:
+            while True:
+                try:
+                    record = self._records.get(timeout=1)
+                except queue.Empty:
+                    file.flush()
+                    continue
+                if record is None:
+                    return
+                line = self._encode(*record)
+                if line is None:
+                    continue
+                if self._written + len(line) > CaptureConfig.max_bytes:
+                    CAPTURED_REVIEWS.labels("over_budget").inc()
+                    continue
+                file.write(line)
+                self._written += len(line)
+                CAPTURED_REVIEWS.labels("written").inc()
+                if self._records.empty():
+                    file.flush()
+
+    @staticmethod
+    def _encode(started: float, path: str, status: int, seconds: float, body: bytes, response: bytes):
+        try:
+            review = redact(orjson.loads(body))
+        except (orjson.JSONDecodeError, AttributeError):
+            CAPTURED_REVIEWS.labels("invalid").inc()
+            return None
+        try:
+            allowed = orjson.loads(response)["response"]["allowed"]
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            allowed = None
+        record = {
+            "t": round(started, 6),
+            "path": path,
+            "status": status,
+            "ms": round(seconds * 1000, 3),
+            "allowed": allowed,
+            "review": review,
+        }
+        return orjson.dumps(record) + b"\n"
+
+
+class CaptureMiddleware:
+    """
+    ASGI middleware that hands the request and response bodies of
+    CAPTURED_PATHS to a CaptureWriter. It is only installed when
+    CAPTURE_ENABLED is set.
+    """
+
+    def __init__(self, app, writer: CaptureWriter = None):
+        self.app = app
+        self.writer = writer or CaptureWriter()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in CAPTURED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        body = []
+        response = []
+        size = 0
+        status = None
+
+        async def capture_receive():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size <= CaptureConfig.max_review_bytes:
+                    body.append(chunk)
+            return message
+
+        async def capture_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response.append(message.get("body", b""))
+            await send(message)
+
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            if size > CaptureConfig.max_review_bytes:
+                CAPTURED_REVIEWS.labels("too_large").inc()
+            else:
+                self.writer.submit(
+                    (started, scope["path"], status, time.perf_counter() - start, b"".join(body), b"".join(response))
+                )
+
+
+def read_capture(path: str):
+    """Yield the records of a capture file, ignoring a last line cut off by a crash."""
+    with gzip.open(path, "rb") as file:
+        try:
+            for line in file:
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    return
+        except (EOFError, gzip.BadGzipFile):
+            return
@@ -0,0 +1,95 @@
+import logging
+
+from metrics import CERTIFICATE_ISSUANCE
+from resources import (
+    SPEC_HASH_ANNOTATION,
+    certificate_condition,
+    certificate_issuer,
+    certificate_ready,
+    gateway_credential,
+    gateway_hosts,
+    gateway_owner,
+    is_shared,
+    parse_timestamp,
+)
+
+
+class CertificateTracker:
+    """
+    Follows the Ready condition of the Certificates the webhook manages.
+
+    Gateways are created without a credentialName and are bound to the
+    secret once cert-manager has issued it. When a Certificate turns Ready
+    the tracker records how long issuance took and queues a reconcile of the
+    owning VirtualService, which binds its Gateway. It runs off the
+    certificates informer's change events, which include what a relist finds
+    after a dropped watch; without the informer cache the periodic resync
+    does the binding instead.
+    """
+
+    def __init__(self, cluster_cache, submit, request_type):
+        self.cluster_cache = cluster_cache
+        self.submit = submit
+        self.request_type = request_type
+
+    def start(self):
+        self.cluster_cache.certificates.on_change = self._on_certificate
+
+    def _on_certificate(self, event_type: str, old, new):
+        if event_type == "DELETED" or not certificate_ready(new) or certificate_ready(old):
+            return
+        if SPEC_HASH_ANNOTATION not in (new["metadata"].get("annotations") or {}):
+            return
+        self._observe_issuance(old, new)
+        for owner_reference in new["metadata"].get("ownerReferences") or []:
+            if owner_reference.get("kind") == "Gateway":
+                self._bind(owner_reference["name"], new)
+
+    @staticmethod
+    def _observe_issuance(old, new):
+        # Measured from apiserver timestamps, so the result does not depend on
+        # when this replica saw the events.
+        previous = certificate_condition(old)
+        started = parse_timestamp(
+            previous.get("lastTransitionTime") if previous else new["metadata"].get("creationTimestamp")
+        )
+        ready = parse_timestamp(certificate_condition(new).get("lastTransitionTime"))
+        if started is None or ready is None:
+            return
+        elapsed = max((ready - started).total_seconds(), 0)
+        CERTIFICATE_ISSUANCE.labels(certificate_issuer(new)).observe(elapsed)
+        logging.info("Certificate %s became Ready after %.1fs", new["metadata"]["name"], elapsed)
+
+    def _bind(self, gateway_name: str, certificate: dict):
+        gateway = self.cluster_cache.gateways.get(gateway_name, "istio-system")
+        if gateway is None:
+            return
+        if is_shared(gateway):
+            # Serve the hosts the re-issued shard Certificate now covers.
+            self.submit(
+                self.request_type.model_construct(
+                    operation="REFRESH",
+                    name=gateway_name,
+                    namespace="istio-system",
+                    gateways=[f"istio-system/{gateway_name}"],
+                    hosts=[],
+                    annotations={},
+                )
+            )
+            return
+        if gateway_credential(gateway) == certificate["metadata"]["name"]:
+            return
+        owner = gateway_owner(gateway)
+        if not owner:
+            return
+        namespace, _, name = owner.partition("/")
+        self.submit(
+            self.request_type.model_construct(
+                operation="CERTIFICATE_READY",
+                name=name,
+                namespace=namespace,
+                gateways=[f"istio-system/{gateway_name}"],
+                hosts=gateway_hosts(gateway),
+                annotations={},
+            )
+        )
@@ -0,0 +1,82 @@
+import logging
+import re
+import time
+
+from config import ApiServerConfig
+from errors import CircuitOpen
+from metrics import CIRCUIT_BREAKER_STATE, CIRCUIT_BREAKER_TRANSITIONS
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+# /apis/<group>/<version> or /api/<version>, then [namespaces/<namespace>/]<plural>
+_RESOURCE_PATH = re.compile(r"/(?:apis/[^/]+|api)/[^/]+/(?:namespaces/[^/]+/)?([^/?]+)")
+
+
+def resource_of(url: str) -> str:
+    match = _RESOURCE_PATH.search(url)
+    return match.group(1) if match else "other"
+
+
+class CircuitBreaker:
+    """
+    Stops calls for one resource type once the apiserver has failed
+    ``ApiServerConfig.breaker_failures`` of them in a row, so callers fail
+    at once instead of each waiting out its timeout. After
+    ``breaker_open_seconds`` one probe call is let through: success closes
+    the breaker, failure opens it again. Only timeouts, connection errors,
+    429s and 5xx responses count as failures.
+    """
+
+    def __init__(self, resource: str, clock=time.monotonic):
+        self.resource = resource
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        CIRCUIT_BREAKER_STATE.labels(resource).set(0)
+
+    def _enter(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        CIRCUIT_BREAKER_STATE.labels(self.resource).set(_STATE_VALUES[state])
+        CIRCUIT_BREAKER_TRANSITIONS.labels(self.resource, state).inc()
+        log = logging.warning if state == OPEN else logging.info
+        log("Circuit breaker for %s is %s", self.resource, state.replace("_", "-"))
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go to the apiserver now."""
+        if self.state == OPEN:
+            if self.clock() - self._opened_at < ApiServerConfig.breaker_open_seconds:
+                raise CircuitOpen(f"Circuit breaker for {self.resource} is open")
+            self._enter(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                raise CircuitOpen(f"Circuit breaker for {self.resource} is waiting for a probe")
+            self._probing = True
+
+    def success(self):
+        self._probing = False
+        self.failures = 0
+        self._enter(CLOSED)
+
+    def failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= ApiServerConfig.breaker_failures:
+            self._opened_at = self.clock()
+            self._enter(OPEN)
+
+    def release(self):
+        """End a call that neither succeeded nor failed, e.g. because it was cancelled."""
+        self._probing = False
+
+
+_breakers = {}
+
+
+def breaker_for(resource: str) -> CircuitBreaker:
+    if resource not in _breakers:
+        _breakers[resource] = CircuitBreaker(resource)
+    return _breakers[resource]
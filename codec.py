@@ -0,0 +1,65 @@
+from typing import NamedTuple, Optional
+
+import orjson
+
+from schemas import ReconcileRequestSchema
+
+_RESPONSE_PREFIX = {
+    True: b'{"apiVersion":"admission.k8s.io/v1","kind":"AdmissionReview","response":{"allowed":true,"uid":',
+    False: b'{"apiVersion":"admission.k8s.io/v1","kind":"AdmissionReview","response":{"allowed":false,"uid":',
+}
+_RESPONSE_SUFFIX = b"}}"
+
+VALIDATION_PASSED = "Validation passed"
+ANNOTATION_SKIPPED = "Annotation does not exist, skipping certificate creation"
+
+
+class AdmissionRequest(NamedTuple):
+    uid: str
+    operation: str
+    object: Optional[ReconcileRequestSchema]
+    old_object: Optional[ReconcileRequestSchema]
+
+
+def decode_admission_review(body: bytes) -> AdmissionRequest:
+    """
+    Parse an AdmissionReview and keep only the fields IstioHandler reads, so
+    the rest of the (possibly very large) VirtualService is released at once.
+    """
+    request = orjson.loads(body)["request"]
+    uid = request["uid"]
+    operation = request["operation"]
+    virtual_service = request.get("object")
+    old_virtual_service = request.get("oldObject")
+    return AdmissionRequest(
+        uid=uid,
+        operation=operation,
+        object=ReconcileRequestSchema.from_virtual_service(virtual_service, operation, uid)
+        if virtual_service
+        else None,
+        old_object=ReconcileRequestSchema.from_virtual_service(old_virtual_service, operation, uid)
+        if old_virtual_service
+        else None,
+    )
+
+
+def _encode_message(message: str) -> bytes:
+    return b',"status":{"message":' + orjson.dumps(message) + b"}"
+
+
+_ENCODED_MESSAGES = {
+    message: _encode_message(message)
+    for message in (VALIDATION_PASSED, ANNOTATION_SKIPPED)
+}
+
+
+def encode_admission_response(uid: str, allowed: bool, message: str) -> bytes:
+    """Render the AdmissionReview response from pre-serialized fragments."""
+    return b"".join(
+        (
+            _RESPONSE_PREFIX[allowed],
+            orjson.dumps(uid),
+            _ENCODED_MESSAGES.get(message) or _encode_message(message),
+            _RESPONSE_SUFFIX,
+        )
+    )
@@ -1,5 +1,5 @@
-from pydantic import field_validator
-from pydantic_settings import BaseSettings
+from pydantic import field_validator, model_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class _CertificateConfig(BaseSettings):
@@ -13,4 +13,177 @@ class _CertificateConfig(BaseSettings):
         return value
 
 
+class _CacheConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="CACHE_")
+
+    enabled: bool = True
+    resync_period: int = 300
+    watch_timeout: int = 240
+    # How old cached state may be, counted from when the apiserver stopped
+    # answering, and still be used for admission decisions.
+    max_staleness: float = 300.0
+
+
+class _QueueConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="QUEUE_")
+
+    workers: int = 4
+    max_retries: int = 8
+    base_delay: float = 0.5
+    max_delay: float = 60.0
+    high_watermark: int = 1000
+    shutdown_timeout: float = 10.0
+
+
+class _ResyncConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="RESYNC_")
+
+    enabled: bool = True
+    period: int = 600
+    page_size: int = 500
+    max_pending: int = 500
+
+
+class _AdmissionConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="ADMISSION_")
+
+    recent_size: int = 4096
+    # Keep in sync with timeoutSeconds of the ValidatingWebhookConfiguration.
+    timeout: float = 5.0
+    # Time left to write the response after the last apiserver call.
+    deadline_margin: float = 0.5
+
+
+class _LeaderElectionConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="LEADER_ELECTION_")
+
+    enabled: bool = False
+    lease_name: str = "istio-cert-manager-webhook"
+    lease_namespace: str = "istio-system"
+    identity: str = ""
+    lease_duration: int = 15
+    renew_deadline: int = 10
+    retry_period: int = 2
+
+
+class _ApiServerConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="APISERVER_")
+
+    read_qps: float = 100.0
+    read_burst: int = 200
+    write_qps: float = 50.0
+    write_burst: int = 100
+    pool_size: int = 32
+    keepalive_timeout: float = 60.0
+    # Timeout of calls made outside an admission request.
+    request_timeout: float = 30.0
+    # Consecutive failures that open a resource's circuit breaker, and how
+    # long it stays open before a single probe request is let through.
+    breaker_failures: int = 5
+    breaker_open_seconds: float = 30.0
+
+
+class _LoggingConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="LOG_")
+
+    level: str = "INFO"
+    format: str = "json"
+    queue_size: int = 10000
+    payload_sample_rate: float = 0.01
+
+    @field_validator("format")
+    def validate_format(cls, value: str) -> str:
+        if value not in ("json", "text"):
+            raise ValueError("LOG_FORMAT must be 'json' or 'text'")
+        return value
+
+
+class _ConsolidationConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="CONSOLIDATION_")
+
+    enabled: bool = False
+    gateway_prefix: str = "shared-"
+    max_hosts: int = 100
+
+    @field_validator("max_hosts")
+    def validate_max_hosts(cls, value: int) -> int:
+        if value < 1:
+            raise ValueError("CONSOLIDATION_MAX_HOSTS must be at least 1")
+        return value
+
+
+class _IssuanceConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="ISSUANCE_")
+
+    # Defaults follow Let's Encrypt: 50 certificates per registered domain
+    # per week and 300 new orders per account every three hours.
+    enabled: bool = True
+    domain_limit: int = 50
+    domain_window: int = 7 * 24 * 3600
+    issuer_limit: int = 300
+    issuer_window: int = 3 * 3600
+    # Share of each limit held back for renewals cert-manager starts itself.
+    reserve: float = 0.1
+    # The budget applies to ACME issuers only; these ("ClusterIssuer/name" or
+    # "Issuer/name") are exempt too, e.g. an internal ACME server.
+    exempt_issuers: list[str] = []
+    # Multi-label public suffixes; a registered domain is one label more.
+    public_suffixes: list[str] = [
+        "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "org.au",
+        "co.nz", "co.jp", "co.in", "co.za", "com.br", "com.cn", "com.mx",
+    ]
+
+    @field_validator("reserve")
+    def validate_reserve(cls, value: float) -> float:
+        if not 0 <= value < 1:
+            raise ValueError("ISSUANCE_RESERVE must be at least 0 and below 1")
+        return value
+
+
+class _CaptureConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="CAPTURE_")
+
+    enabled: bool = False
+    # "{pid}" keeps the files of --workers processes apart.
+    path: str = "admission-capture-{pid}.jsonl.gz"
+    # Uncompressed bytes written per process before capturing stops.
+    max_bytes: int = 512 * 1024 * 1024
+    # Larger AdmissionReviews are counted but not recorded.
+    max_review_bytes: int = 256 * 1024
+    queue_size: int = 10000
+    # Without it only spec.gateways and spec.hosts are kept.
+    keep_spec: bool = False
+
+
+class _DebugConfig(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="DEBUG_")
+
+    enabled: bool = False
+    # Bearer token required by every /debug endpoint.
+    token: str = ""
+    max_profile_seconds: float = 300.0
+    sample_interval: float = 0.005
+    tracemalloc_frames: int = 10
+    max_snapshots: int = 4
+    loop_lag_interval: float = 0.1
+    loop_lag_window: float = 600.0
+
+    @model_validator(mode="after")
+    def validate_token(self):
+        if self.enabled and not self.token:
+            raise ValueError("DEBUG_TOKEN must be set when DEBUG_ENABLED is true")
+        return self
+
+
 CertificateConfig = _CertificateConfig()
+CacheConfig = _CacheConfig()
+QueueConfig = _QueueConfig()
+ResyncConfig = _ResyncConfig()
+AdmissionConfig = _AdmissionConfig()
+LeaderElectionConfig = _LeaderElectionConfig()
+ApiServerConfig = _ApiServerConfig()
+LoggingConfig = _LoggingConfig()
+ConsolidationConfig = _ConsolidationConfig()
+IssuanceConfig = _IssuanceConfig()
+CaptureConfig = _CaptureConfig()
+DebugConfig = _DebugConfig()
@@ -0,0 +1,271 @@
+"""
+Consolidation mode: VirtualServices that reference the same shared gateway
+(CONSOLIDATION_GATEWAY_PREFIX) are served by one multi-server Gateway, and
+their hosts are packed into SAN Certificates of at most
+CONSOLIDATION_MAX_HOSTS hosts per issuer. A handful of servers and
+Certificates then stand in for one Gateway and one Certificate per
+VirtualService, which shrinks the ingress gateway's listeners and the
+number of issuances.
+"""
+import asyncio
+import json
+import logging
+
+from config import ConsolidationConfig
+from errors import GatewayAlreadyExists, IssuanceDeferred, SharedGatewayConflict
+from resources import (
+    FIELD_MANAGER,
+    MANAGED_BY_LABEL,
+    MEMBERS_ANNOTATION,
+    SHARDS_ANNOTATION,
+    certificate_condition,
+    certificate_issued,
+    certificate_manifest,
+    certificate_ready,
+    gateway_manifest,
+    gateway_members,
+    gateway_server,
+    gateway_shards,
+    is_shared,
+    is_up_to_date,
+)
+from schemas import CertificateSchema, GatewayOwnerReferenceSchema
+
+NAMESPACE = "istio-system"
+
+
+def certificate_profile(certificate_data: dict) -> str:
+    """Hosts can share a Certificate only when these settings are equal."""
+    return "/".join((
+        certificate_data["issuer_kind"],
+        certificate_data["issuer_name"],
+        certificate_data["duration"],
+        certificate_data["renew_before"],
+    ))
+
+
+def member_record(request_object: dict, certificate_data: dict) -> dict:
+    return {
+        "hosts": sorted(set(request_object["spec"]["hosts"])),
+        "profile": certificate_profile(certificate_data),
+    }
+
+
+def pack(gateway_name: str, members: dict, shards: dict, max_hosts: int) -> dict:
+    """
+    Place every member host in a shard of its profile while changing as few
+    shards as possible: hosts no member needs are dropped, placed hosts stay
+    where they are, and new hosts go to the first shard of their profile
+    with room, or to a new shard. Adding or removing a host therefore
+    re-issues one Certificate.
+    """
+    wanted = {}
+    for member in members.values():
+        wanted.setdefault(member["profile"], set()).update(member["hosts"])
+    packed = {}
+    placed = set()
+    for name, shard in sorted(shards.items()):
+        hosts = [host for host in shard["hosts"] if host in wanted.get(shard["profile"], ())]
+        if hosts:
+            packed[name] = {"profile": shard["profile"], "hosts": hosts}
+            placed.update((shard["profile"], host) for host in hosts)
+    for profile, hosts in sorted(wanted.items()):
+        for host in sorted(hosts):
+            if (profile, host) in placed:
+                continue
+            shard = next(
+                (
+                    shard for _, shard in sorted(packed.items())
+                    if shard["profile"] == profile and len(shard["hosts"]) < max_hosts
+                ),
+                None,
+            )
+            if shard is None:
+                index = 0
+                while f"{gateway_name}-{index}-tls" in packed:
+                    index += 1
+                shard = packed[f"{gateway_name}-{index}-tls"] = {"profile": profile, "hosts": []}
+            shard["hosts"].append(host)
+    return packed
+
+
+def _covers(certificate: dict, hosts: list[str]) -> bool:
+    """Whether the issued secret is for the current spec and includes ``hosts``."""
+    if not certificate_ready(certificate):
+        return False
+    observed = certificate_condition(certificate).get("observedGeneration")
+    generation = certificate["metadata"].get("generation")
+    if observed is not None and generation is not None and observed < generation:
+        return False
+    return set(hosts) <= set(certificate.get("spec", {}).get("dnsNames") or [])
+
+
+class SharedGateways:
+    """
+    Maintains shared gateways. Membership and the host packing are stored
+    in annotations on the Gateway, so every change is computed from the
+    Gateway alone and only touches the shards whose hosts changed. Updates
+    to one Gateway are serialized with a lock; they all run in the process
+    that performs writes.
+
+    A shard's server serves only the hosts its secret already covers: a new
+    host is added to the Certificate first and to the server once the
+    re-issued Certificate is Ready. A shard whose re-issue the issuance
+    budget defers keeps its current Certificate, and the hosts added to it
+    until the budget has room are issued together.
+    """
+
+    def __init__(self, kubernetes_utility, cluster_cache, issuance_budget):
+        self.kubernetes_utility = kubernetes_utility
+        self.cluster_cache = cluster_cache
+        self.issuance_budget = issuance_budget
+        self._locks = {}
+
+    def check(self, gateway: dict, request_object: dict, certificate_data: dict):
+        """Reject a member whose hosts are already on the gateway with another profile."""
+        if gateway is None:
+            return
+        if not is_shared(gateway):
+            raise GatewayAlreadyExists(f"Gateway {gateway['metadata']['name']} already exists")
+        metadata = request_object["metadata"]
+        key = f"{metadata['namespace']}/{metadata['name']}"
+        profile = certificate_profile(certificate_data)
+        hosts = set(request_object["spec"]["hosts"])
+        for member_key, member in gateway_members(gateway).items():
+            conflicting = hosts.intersection(member["hosts"])
+            if member_key != key and member["profile"] != profile and conflicting:
+                raise SharedGatewayConflict(
+                    f"Host {sorted(conflicting)[0]} is already on Gateway {gateway['metadata']['name']} "
+                    f"through {member_key} with issuer {member['profile']}"
+                )
+
+    def drift(self, gateway_name: str, request_object: dict, certificate_data: dict, gateways, certificates):
+        """Return (resource, reason) when a member is missing from or stale on its gateway."""
+        gateway = gateways.get(gateway_name)
+        if gateway is None:
+            return "gateways", "missing"
+        if not is_shared(gateway):
+            return None
+        metadata = request_object["metadata"]
+        member = gateway_members(gateway).get(f"{metadata['namespace']}/{metadata['name']}")
+        if member != member_record(request_object, certificate_data):
+            return "gateways", "changed"
+        if any(certificates.get(name) is None for name in gateway_shards(gateway)):
+            return "certificates", "missing"
+        return None
+
+    async def add(self, gateway_name: str, request_object: dict, certificate_data: dict):
+        metadata = request_object["metadata"]
+        key = f"{metadata['namespace']}/{metadata['name']}"
+        record = member_record(request_object, certificate_data)
+        await self._update(gateway_name, lambda members: members.__setitem__(key, record))
+
+    async def remove(self, gateway_name: str, namespace: str, name: str):
+        await self._update(gateway_name, lambda members: members.pop(f"{namespace}/{name}", None))
+
+    async def refresh(self, gateway_name: str):
+        """Re-evaluate which hosts each shard serves, e.g. after a Certificate became Ready."""
+        await self._update(gateway_name, lambda members: None)
+
+    async def _update(self, gateway_name: str, change):
+        lock = self._locks.setdefault(gateway_name, asyncio.Lock())
+        async with lock:
+            existing = await self.cluster_cache.get_istio_gateway(gateway_name, NAMESPACE)
+            if existing is not None and not is_shared(existing):
+                raise GatewayAlreadyExists(f"Gateway {gateway_name} already exists")
+            members = gateway_members(existing)
+            shards = gateway_shards(existing)
+            change(members)
+            if not members:
+                if existing is not None:
+                    await self._delete(gateway_name, shards)
+                return
+            packed = pack(gateway_name, members, shards, ConsolidationConfig.max_hosts)
+            certificates = {
+                name: await self.cluster_cache.get_certificate(name, NAMESPACE) for name in packed
+            }
+            gateway = self.desired_gateway(gateway_name, members, packed, existing, certificates)
+            if is_up_to_date(existing, gateway):
+                applied = existing
+            else:
+                applied = await self.kubernetes_utility.apply_istio_gateway(gateway)
+                self.cluster_cache.gateways.upsert(applied)
+                logging.info(
+                    "Shared Gateway %s applied with %s members in %s Certificates",
+                    gateway_name, len(members), len(packed),
+                )
+            deferred = []
+            for name, shard in packed.items():
+                certificate = self.desired_certificate(name, shard, applied)
+                if is_up_to_date(certificates[name], certificate):
+                    continue
+                try:
+                    await self.issuance_budget.reserve(certificates[name], certificate)
+                except IssuanceDeferred as e:
+                    deferred.append(e)
+                    continue
+                self.cluster_cache.certificates.upsert(
+                    await self.kubernetes_utility.apply_certificate(certificate)
+                )
+                logging.info("Certificate %s applied with %s hosts", name, len(shard["hosts"]))
+            for name in shards.keys() - packed.keys():
+                await self.kubernetes_utility.delete_certificate(name, NAMESPACE)
+                self.cluster_cache.certificates.remove(name, NAMESPACE)
+                logging.info("Certificate %s of shared Gateway %s deleted", name, gateway_name)
+            if deferred:
+                raise min(deferred, key=lambda e: e.retry_after)
+
+    async def _delete(self, gateway_name: str, shards: dict):
+        await self.kubernetes_utility.delete_istio_gateway(gateway_name, NAMESPACE)
+        self.cluster_cache.gateways.remove(gateway_name, NAMESPACE)
+        for name in shards:
+            self.cluster_cache.certificates.remove(name, NAMESPACE)
+        logging.info("Shared Gateway %s has no members left and was deleted", gateway_name)
+
+    @staticmethod
+    def desired_gateway(gateway_name: str, members: dict, shards: dict, existing, certificates: dict) -> dict:
+        served = {
+            server["tls"]["credentialName"]: set(server.get("hosts") or [])
+            for server in (existing or {}).get("spec", {}).get("servers") or []
+            if (server.get("tls") or {}).get("credentialName")
+        }
+        servers = []
+        for name, shard in sorted(shards.items()):
+            port_name = "https-" + name[len(gateway_name) + 1:-len("-tls")]
+            certificate = certificates.get(name)
+            hosts = sorted(shard["hosts"])
+            if certificate_issued(certificate) and not _covers(certificate, hosts):
+                hosts = sorted(served.get(name, set()).intersection(hosts))
+            if hosts and certificate_issued(certificate):
+                servers.append(gateway_server(hosts, name, port_name))
+            else:
+                servers.append(gateway_server(sorted(shard["hosts"]), None, port_name))
+        return gateway_manifest(
+            gateway_name,
+            NAMESPACE,
+            {
+                MEMBERS_ANNOTATION: json.dumps(members, sort_keys=True, separators=(",", ":")),
+                SHARDS_ANNOTATION: json.dumps(shards, sort_keys=True, separators=(",", ":")),
+            },
+            [],
+            labels={MANAGED_BY_LABEL: FIELD_MANAGER},
+            servers=servers,
+        )
+
+    @staticmethod
+    def desired_certificate(name: str, shard: dict, gateway: dict) -> dict:
+        issuer_kind, issuer_name, duration, renew_before = shard["profile"].split("/")
+        certificate = CertificateSchema(
+            namespace=NAMESPACE,
+            name=name,
+            secret_name=name,
+            issuer_name=issuer_name,
+            issuer_kind=issuer_kind,
+            dns_names=sorted(shard["hosts"]),
+            duration=duration,
+            renew_before=renew_before,
+        )
+        owner_reference = GatewayOwnerReferenceSchema(
+            name=gateway["metadata"]["name"], uid=gateway["metadata"]["uid"]
+        )
+        return certificate_manifest(certificate, owner_reference)
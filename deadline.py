@@ -0,0 +1,18 @@
+import contextvars
+import time
+
+# Monotonic time by which the current admission must have its answer; None
+# outside admissions. Every apiserver call made on its behalf is bounded by it.
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+def set_deadline(seconds: float):
+    request_deadline.set(time.monotonic() + seconds)
+
+
+def remaining():
+    """Seconds left until the current deadline, or None if there is none."""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
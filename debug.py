@@ -0,0 +1,409 @@
+"""
+Diagnostics for a running webhook (DEBUG_ENABLED), under /debug and behind
+``Authorization: Bearer $DEBUG_TOKEN``. Nothing here is imported, installed
+or started unless it is enabled. With --workers each request is answered by
+one worker process, whose pid every response names.
+
+    POST /debug/profile?requests=100                 cProfile of the next 100 /validate requests
+    POST /debug/profile?seconds=30&mode=sampling     collapsed stacks, for flamegraph.pl or speedscope
+    POST /debug/tracemalloc/start                    start tracing allocations
+    POST /debug/tracemalloc/snapshots                take a snapshot, returns its id and top allocations
+    GET  /debug/tracemalloc/snapshots/{id}           download it, for tracemalloc.Snapshot.load()
+    GET  /debug/tracemalloc/diff?base=1[&other=2]    what grew since snapshot 1
+    POST /debug/tracemalloc/stop
+    GET  /debug/memory                               RSS, and memory held by queued requests and handlers
+    GET  /debug/loop                                 event loop lag
+"""
+import asyncio
+import cProfile
+import gc
+import hmac
+import io
+import marshal
+import os
+import pickle
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from pydantic import BaseModel
+
+from config import DebugConfig
+
+
+def authenticate(authorization: str = Header(default="")):
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), DebugConfig.token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid debug token", headers={"WWW-Authenticate": "Bearer"})
+
+
+router = APIRouter(prefix="/debug", dependencies=[Depends(authenticate)], include_in_schema=False)
+
+
+def _artifact(content: bytes, filename: str, media_type: str, headers: dict = None) -> Response:
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Debug-Pid": str(os.getpid()),
+            **(headers or {}),
+        },
+    )
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread and counts
+    the stacks in the collapsed format ("outer;inner count" per line).
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="debug-stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = getattr(code, "co_qualname", code.co_name)
+                stack.append(f"{name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            if stack:
+                self._stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self) -> bytes:
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common()).encode()
+
+
+class _ProfileSession:
+    def __init__(self, mode: str, requests: int = None):
+        self.mode = mode
+        self.limit = requests
+        self.requests = 0
+        self.finished = asyncio.Event()
+        self._profiler = None
+        self._sampler = None
+
+    def start(self):
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident(), DebugConfig.sample_interval)
+            self._sampler.start()
+
+    def request_finished(self):
+        self.requests += 1
+        if self.limit is not None and self.requests >= self.limit:
+            self.finished.set()
+
+    def stop(self, output: str) -> tuple[bytes, str, str]:
+        """Returns the profile as (content, file extension, media type)."""
+        if self._sampler is not None:
+            self._sampler.stop()
+            return self._sampler.collapsed(), "folded", "text/plain"
+        self._profiler.disable()
+        if output == "text":
+            stream = io.StringIO()
+            pstats.Stats(self._profiler, stream=stream).sort_stats("cumulative").print_stats(100)
+            return stream.getvalue().encode(), "txt", "text/plain"
+        self._profiler.create_stats()
+        # The format of pstats.Stats.dump_stats(), so snakeviz and pstats can load it.
+        return marshal.dumps(self._profiler.stats), "pstats", "application/octet-stream"
+
+
+_profile = None
+
+
+class ProfileMiddleware:
+    """Counts the /validate requests answered while a profile runs."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if _profile is not None and scope["type"] == "http" and scope["path"] == "/validate":
+            _profile.request_finished()
+
+
+@router.post("/profile")
+async def profile(
+    mode: Literal["cprofile", "sampling"] = "cprofile",
+    requests: int = Query(None, gt=0),
+    seconds: float = Query(None, gt=0),
+    output: Literal["pstats", "text"] = "pstats",
+):
+    """
+    Profile the event loop thread until ``requests`` /validate requests
+    have been answered or ``seconds`` have passed, whichever is first. The
+    profile covers everything the process runs meanwhile, including the
+    background reconciles.
+    """
+    global _profile
+    if requests is None and seconds is None:
+        raise HTTPException(status_code=400, detail="Either requests or seconds is required")
+    if _profile is not None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    timeout = DebugConfig.max_profile_seconds
+    session = _profile = _ProfileSession(mode, requests)
+    started = time.monotonic()
+    session.start()
+    try:
+        await asyncio.wait_for(session.finished.wait(), min(seconds or timeout, timeout))
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        _profile = None
+        content, extension, media_type = session.stop(output)
+    return _artifact(
+        content,
+        f"profile-{os.getpid()}-{int(time.time())}.{extension}",
+        media_type,
+        {"X-Profiled-Requests": str(session.requests), "X-Profiled-Seconds": f"{time.monotonic() - started:.3f}"},
+    )
+
+
+def _deep_size(obj) -> int:
+    """Bytes of obj and the containers and models it holds."""
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        elif isinstance(current, BaseModel):
+            stack.append(current.__dict__)
+    return size
+
+
+def _held_memory() -> dict:
+    """Memory held by queued reconcile requests and live IstioHandlers."""
+    held = {"queue": None, "handlers": None}
+    # Only once main has imported them; importing them here would load the
+    # Kubernetes client.
+    runtime = sys.modules.get("runtime")
+    if runtime is not None:
+        items = runtime.reconcile_queue.queued_items()
+        held["queue"] = {"items": len(items), "bytes": sum(_deep_size(item) for item in items)}
+    handler = sys.modules.get("handler")
+    if handler is not None:
+        handlers = [obj for obj in gc.get_objects() if isinstance(obj, handler.IstioHandler)]
+        held["handlers"] = {
+            "live": len(handlers),
+            "bytes": sum(sys.getsizeof(obj) + sys.getsizeof(obj.__dict__) for obj in handlers),
+            "request_object_bytes": sum(_deep_size(obj.request_object) for obj in handlers),
+        }
+    return held
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+@router.get("/memory")
+async def memory():
+    traced, peak = tracemalloc.get_traced_memory()
+    return {
+        "pid": os.getpid(),
+        "rss_bytes": _rss_bytes(),
+        # ru_maxrss is in KiB on Linux.
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "gc": {"counts": gc.get_count(), "objects": len(gc.get_objects())},
+        "tracemalloc": {"tracing": tracemalloc.is_tracing(), "traced_bytes": traced, "peak_bytes": peak},
+        **_held_memory(),
+    }
+
+
+_snapshots = {}
+_snapshot_ids = iter(range(1, sys.maxsize))
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not tracing; POST /debug/tracemalloc/start")
+    return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+
+def _statistic(stat) -> dict:
+    entry = {
+        "size": stat.size,
+        "count": stat.count,
+        "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+    }
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        entry["size_diff"] = stat.size_diff
+        entry["count_diff"] = stat.count_diff
+    return entry
+
+
+GroupBy = Literal["lineno", "filename", "traceback"]
+
+
+@router.post("/tracemalloc/start")
+async def tracemalloc_start(frames: int = Query(None, gt=0, le=100)):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames or DebugConfig.tracemalloc_frames)
+    return {"tracing": True, "frames": tracemalloc.get_traceback_limit()}
+
+
+@router.post("/tracemalloc/stop")
+async def tracemalloc_stop():
+    tracemalloc.stop()
+    _snapshots.clear()
+    return {"tracing": False}
+
+
+@router.post("/tracemalloc/snapshots")
+async def tracemalloc_snapshot(group_by: GroupBy = "lineno", limit: int = Query(25, gt=0, le=1000)):
+    snapshot = _take_snapshot()
+    snapshot_id = next(_snapshot_ids)
+    _snapshots[snapshot_id] = snapshot
+    while len(_snapshots) > DebugConfig.max_snapshots:
+        del _snapshots[next(iter(_snapshots))]
+    traced, peak = tracemalloc.get_traced_memory()
+    return {
+        "id": snapshot_id,
+        "pid": os.getpid(),
+        "traced_bytes": traced,
+        "peak_bytes": peak,
+        "held": _held_memory(),
+        "top": [_statistic(stat) for stat in snapshot.statistics(group_by)[:limit]],
+    }
+
+
+def _stored_snapshot(snapshot_id: int) -> tracemalloc.Snapshot:
+    if snapshot_id not in _snapshots:
+        raise HTTPException(status_code=404, detail=f"No snapshot {snapshot_id}; kept: {sorted(_snapshots)}")
+    return _snapshots[snapshot_id]
+
+
+@router.get("/tracemalloc/snapshots/{snapshot_id}")
+async def tracemalloc_download(snapshot_id: int):
+    snapshot = _stored_snapshot(snapshot_id)
+    # What Snapshot.dump() writes, so Snapshot.load() reads it.
+    content = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+    return _artifact(content, f"tracemalloc-{os.getpid()}-{snapshot_id}.pickle", "application/octet-stream")
+
+
+@router.get("/tracemalloc/diff")
+async def tracemalloc_diff(
+    base: int,
+    other: int = None,
+    group_by: GroupBy = "lineno",
+    limit: int = Query(25, gt=0, le=1000),
+):
+    """Compare snapshot ``other``, or a new snapshot, against ``base``."""
+    base_snapshot = _stored_snapshot(base)
+    other_snapshot = _stored_snapshot(other) if other is not None else _take_snapshot()
+    stats = other_snapshot.compare_to(base_snapshot, group_by)
+    return {
+        "base": base,
+        "other": other,
+        "pid": os.getpid(),
+        "size_diff": sum(stat.size_diff for stat in stats),
+        "top": [_statistic(stat) for stat in stats[:limit]],
+    }
+
+
+class LoopLagMonitor:
+    """
+    Measures how late a sleep of ``interval`` wakes up, which is how long
+    callbacks and coroutine steps kept the event loop from running others.
+    """
+
+    def __init__(self, interval: float, window: float):
+        self.interval = interval
+        self.samples = deque(maxlen=max(1, int(window / interval)))
+        self.max_lag = 0.0
+        self.total = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            self.total += 1
+
+    def stats(self) -> dict:
+        samples = list(self.samples)
+        return {
+            "interval_seconds": self.interval,
+            "window_seconds": round(len(samples) * self.interval, 3),
+            "samples": len(samples),
+            "p50_ms": round(_percentile(samples, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(samples, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(samples, 0.99) * 1000, 3),
+            "max_ms": round(max(samples, default=0.0) * 1000, 3),
+            "over_100ms": sum(1 for lag in samples if lag > 0.1),
+            "max_since_start_ms": round(self.max_lag * 1000, 3),
+            "samples_since_start": self.total,
+        }
+
+
+loop_lag = LoopLagMonitor(DebugConfig.loop_lag_interval, DebugConfig.loop_lag_window)
+
+
+@router.get("/loop")
+async def loop(samples: bool = False):
+    stats = {"pid": os.getpid(), "tasks": len(asyncio.all_tasks()), **loop_lag.stats()}
+    if samples:
+        stats["lag_ms"] = [round(lag * 1000, 3) for lag in loop_lag.samples]
+    return stats
@@ -28,3 +28,26 @@ class GatewayAlreadyExists(Exception):
 class IstioGatewayNamespaceError(Exception):
     """Exception raised when there is an error with the Istio gateway namespace."""
     pass
+
+class SharedGatewayConflict(Exception):
+    """Exception raised when a host is already on a shared gateway with another issuer."""
+    pass
+
+class Deferred(Exception):
+    """Exception raised when work should be retried after ``retry_after`` seconds, without counting as a failure."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class IssuanceDeferred(Deferred):
+    """Exception raised when a certificate write would exceed the issuance budget."""
+    pass
+
+class DeadlineExceeded(Exception):
+    """Exception raised when an apiserver call cannot finish before the request deadline."""
+    pass
+
+class CircuitOpen(Exception):
+    """Exception raised instead of calling the apiserver while a resource's circuit breaker is open."""
+    pass
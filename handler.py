@@ -1,112 +1,213 @@
+import asyncio
+import datetime
 import logging
 
+from async_kubernetes_utility import AsyncKubernetesUtility
+from cache import ClusterCache
 from config import CertificateConfig
-from errors import AnnotationDoesNotExist, GatewayAlreadyExists, IstioGatewayNamespaceError
-from kubernetes_utility import KubernetesUtility
-from schemas import CertificateSchema, GatewayOwnerReferenceSchema, VirtualServiceOwnerReferenceSchema
+from consolidation import SharedGateways
+from errors import AnnotationDoesNotExist, Deferred, GatewayAlreadyExists, IstioGatewayNamespaceError
+from issuance_budget import IssuanceBudget
+from metrics import TIME_TO_TLS, observe_phase
+from resources import (
+    certificate_issued,
+    certificate_issuer,
+    certificate_manifest,
+    gateway_credential,
+    gateway_manifest,
+    gateway_owner,
+    is_up_to_date,
+    owner_labels,
+    parse_timestamp,
+)
+from schemas import (
+    CertificateSchema,
+    GatewayOwnerReferenceSchema,
+    ReconcileRequestSchema,
+    VirtualServiceOwnerReferenceSchema,
+    is_shared_gateway,
+)
 
-kubernetes_utility = KubernetesUtility()
+kubernetes_utility = AsyncKubernetesUtility()
+cluster_cache = ClusterCache(kubernetes_utility)
+issuance_budget = IssuanceBudget(kubernetes_utility, cluster_cache)
+shared_gateways = SharedGateways(kubernetes_utility, cluster_cache, issuance_budget)
 
 class IstioHandler:
     def __init__(self, request_object: dict):
 
         self.request_object = request_object
         self.kubernetes_utility = kubernetes_utility
+        self.cluster_cache = cluster_cache
+        self.shared_gateways = shared_gateways
+        self.issuance_budget = issuance_budget
         self.certificate_data = {}
-        self.gateway_data = {}
 
-    def preflight_check(self):
-        self._check_gateway_exists()
-        self._handle_annotations()
+    @property
+    def gateway_name(self) -> str:
+        return self.request_object["spec"]["gateways"][0].split("/")[-1]
 
-    def create_certificate(self):
-        try:
-            if self.gateway_data == {}:
-                logging.error("Gateway data is empty, hence skipping certificate creation")
-                return
-            gateway_metadata = self.gateway_data["metadata"]
-            gateway_spec = self.gateway_data["spec"]
-            owner_reference = GatewayOwnerReferenceSchema(
-                name=gateway_metadata["name"], uid=gateway_metadata["uid"]
-            )
-            certificate = CertificateSchema(
-                namespace=gateway_metadata["namespace"],
-                name=gateway_spec["servers"][0]["tls"]["credentialName"],
-                dns_names=gateway_spec["servers"][0]["hosts"],
-                duration=self.certificate_data["duration"],
-                renew_before=self.certificate_data["renew_before"],
-                issuer_name=self.certificate_data["issuer_name"],
-                issuer_kind=self.certificate_data["issuer_kind"],
-                secret_name=gateway_spec["servers"][0]["tls"]["credentialName"],
-            )
-            if self.kubernetes_utility.get_certificate(
-                certificate.name, certificate.namespace
-            ):
-                self.kubernetes_utility.update_certificate(certificate, owner_reference)
-                logging.info(
-                    f"Certificate {certificate.name} already exists, updating it"
-                )
-            else:
-                self.kubernetes_utility.create_certificate(certificate, owner_reference)
-                logging.info(f"Certificate {certificate.name} created successfully")
-        except AnnotationDoesNotExist as e:
-            logging.info(
-                f"Annotation does not exist, hence skipping certificate creation"
-            )
-        except Exception as e:
-            raise e
+    @property
+    def gateway_names(self) -> list[str]:
+        """Names of the istio-system Gateways the VirtualService references, in order."""
+        names = []
+        for reference in self.request_object.get("spec", {}).get("gateways") or []:
+            if isinstance(reference, str) and reference.startswith("istio-system/"):
+                name = reference.split("/")[-1]
+                if name not in names:
+                    names.append(name)
+        return names
+
+    @property
+    def dedicated_gateways(self) -> list[str]:
+        return [name for name in self.gateway_names if not is_shared_gateway(name)]
 
-    def create_gateway(self):
+    @property
+    def shared_gateway_names(self) -> list[str]:
+        return [name for name in self.gateway_names if is_shared_gateway(name)]
+
+    async def preflight_check(self):
+        await self._check_gateway_exists()
+        await self._handle_annotations()
+        names = self.shared_gateway_names
+        existing = await gather_lookups(
+            *(self.cluster_cache.get_istio_gateway(name, "istio-system") for name in names)
+        )
+        for gateway in existing:
+            self.shared_gateways.check(gateway, self.request_object, self.certificate_data)
+
+    async def reconcile(self):
+        # Ownership and issuers may have changed while the request was queued.
+        await self.preflight_check()
+        # Every Gateway runs its own pipeline, so a VirtualService with
+        # several Gateways takes about as long as one with a single Gateway.
+        await gather_all(
+            *(
+                self.shared_gateways.add(name, self.request_object, self.certificate_data)
+                for name in self.shared_gateway_names
+            ),
+            *(self._reconcile_gateway(name) for name in self.dedicated_gateways),
+            self._delete_unreferenced_gateways(),
+        )
+
+    async def _reconcile_gateway(self, gateway_name: str):
+        """Apply one Gateway, then its Certificate as soon as the Gateway's UID is known."""
+        existing_certificate, existing_gateway = await asyncio.gather(
+            self.cluster_cache.get_certificate(self.credential_name(gateway_name), "istio-system"),
+            self.cluster_cache.get_istio_gateway(gateway_name, "istio-system"),
+        )
+        gateway = await self.create_gateway(gateway_name, existing_gateway, existing_certificate)
+        await self.create_certificate(gateway, existing_certificate)
+
+    async def create_certificate(self, gateway: dict, existing: dict):
+        certificate_body = self.desired_certificate(gateway)
+        certificate_name = certificate_body["metadata"]["name"]
+        if is_up_to_date(existing, certificate_body):
+            logging.debug("Certificate %s is up to date, skipping write", certificate_name)
+            return
+        await self.issuance_budget.reserve(existing, certificate_body)
+        applied = await self.kubernetes_utility.apply_certificate(certificate_body)
+        self.cluster_cache.certificates.upsert(applied)
+        logging.info("Certificate %s applied successfully", certificate_name)
+
+    def credential_name(self, gateway_name: str) -> str:
+        """Name of the Certificate of one of the Gateways, and of the secret it issues."""
+        vs_name = self.request_object["metadata"]["name"]
+        dedicated = self.dedicated_gateways
+        # The first Gateway keeps the name from before VirtualServices could
+        # have several, so existing Certificates are not issued again.
+        if not dedicated or gateway_name == dedicated[0]:
+            return f"{vs_name}-tls"
+        return f"{vs_name}-{gateway_name}-tls"
+
+    def desired_certificate(self, gateway_data: dict) -> dict:
+        """Certificate manifest for an applied Gateway; needs certificate_settings()."""
+        gateway_metadata = gateway_data["metadata"]
+        credential_name = self.credential_name(gateway_metadata["name"])
+        owner_reference = GatewayOwnerReferenceSchema(
+            name=gateway_metadata["name"], uid=gateway_metadata["uid"]
+        )
+        certificate = CertificateSchema(
+            namespace=gateway_metadata["namespace"],
+            name=credential_name,
+            dns_names=self.request_object["spec"]["hosts"],
+            duration=self.certificate_data["duration"],
+            renew_before=self.certificate_data["renew_before"],
+            issuer_name=self.certificate_data["issuer_name"],
+            issuer_kind=self.certificate_data["issuer_kind"],
+            secret_name=credential_name,
+        )
+        return certificate_manifest(certificate, owner_reference)
+
+    def desired_gateway(self, gateway_name: str, certificate: dict = None) -> dict:
+        """Gateway manifest, bound to the secret once ``certificate`` has issued it."""
+        vs_namespace = self.request_object["metadata"]["namespace"]
+        vs_name = self.request_object["metadata"]["name"]
+        return gateway_manifest(
+            gateway_name,
+            "istio-system",
+            {"vs": f"{vs_namespace}/{vs_name}"},
+            self.request_object["spec"]["hosts"],
+            self.credential_name(gateway_name) if certificate_issued(certificate) else None,
+            labels=owner_labels(vs_namespace, vs_name),
+        )
+
+    async def create_gateway(self, gateway_name: str, existing: dict, certificate: dict) -> dict:
         try:
-            if self.kubernetes_utility.get_istio_gateway(
-                self.request_object["spec"]["gateways"][0].split("/")[-1], "istio-system"
-            ):
-                self.kubernetes_utility.update_istio_gateway(
-                    self.request_object["spec"]["gateways"][0].split("/")[-1],
-                    "istio-system",
-                    {"vs": f"{self.request_object['metadata']['namespace']}/{self.request_object['metadata']['name']}"},
-                    self.request_object["spec"]["hosts"],
-                    f"{self.request_object['metadata']['name']}-tls",
-                )
-            else:
-                self.gateway_data = self.kubernetes_utility.create_istio_gateway(
-                        f"{self.request_object['spec']['gateways'][0].split('/')[-1]}",
-                        "istio-system",
-                        {"vs": f"{self.request_object['metadata']['namespace']}/{self.request_object['metadata']['name']}"},
-                        self.request_object["spec"]["hosts"],
-                        f"{self.request_object['metadata']['name']}-tls"
-                    )
+            gateway = self.desired_gateway(gateway_name, certificate)
+            if is_up_to_date(existing, gateway):
+                logging.debug("Gateway %s is up to date, skipping write", gateway_name)
+                return existing
+            applied = await self.kubernetes_utility.apply_istio_gateway(gateway)
+            self.cluster_cache.gateways.upsert(applied)
 
-            logging.info(
-                f"Gateway {self.request_object['spec']['gateways'][0]} created successfully"
-            )
+            logging.info("Gateway istio-system/%s applied successfully", gateway_name)
+            if existing and not gateway_credential(existing) and gateway_credential(gateway):
+                self._observe_time_to_tls(certificate)
+            return applied
 
         except GatewayAlreadyExists as e:
-            logging.error(
-                f"Gateway {self.request_object['spec']['gateways'][0]} already exists"
-            )
+            logging.error("Gateway %s already exists", gateway_name)
             raise e
         except Exception as e:
-            logging.error(f"Error creating gateway: {e}")
+            logging.error("Error creating gateway: %s", e)
             raise e
 
-    def _handle_annotations(self):
+    def _observe_time_to_tls(self, certificate: dict):
+        created = parse_timestamp(certificate["metadata"].get("creationTimestamp"))
+        if created is None:
+            return
+        elapsed = (datetime.datetime.now(datetime.timezone.utc) - created).total_seconds()
+        TIME_TO_TLS.labels(certificate_issuer(certificate)).observe(max(elapsed, 0))
+        logging.info(
+            "Gateway bound to %s %.1fs after the Certificate was created", certificate["metadata"]["name"], elapsed
+        )
+
+    @observe_phase("handle_annotations")
+    async def _handle_annotations(self):
+        self.certificate_settings()
+        issuer_name = self.certificate_data["issuer_name"]
+        if self.certificate_data["issuer_kind"] == "Issuer":
+            logging.debug("Using Issuer: %s", issuer_name)
+            await self.cluster_cache.get_issuer(
+                issuer_name, self.request_object["metadata"]["namespace"]
+            )
+        else:
+            logging.debug("Using ClusterIssuer: %s", issuer_name)
+            await self.cluster_cache.get_cluster_issuer(issuer_name)
+
+    def certificate_settings(self):
+        """Fill certificate_data from the cert-manager.io annotations."""
         gateway_annotations = self.request_object["metadata"]["annotations"]
         issuer = gateway_annotations.get("cert-manager.io/issuer")
         cluster_issuer = gateway_annotations.get("cert-manager.io/cluster-issuer")
 
         if issuer:
-            logging.info(f"Using Issuer: {issuer}")
             self.certificate_data["issuer_name"] = issuer
             self.certificate_data["issuer_kind"] = "Issuer"
-            self.kubernetes_utility.get_issuer(
-                issuer, self.request_object["metadata"]["namespace"]
-            )
         elif cluster_issuer:
-            logging.info(f"Using ClusterIssuer: {cluster_issuer}")
             self.certificate_data["issuer_name"] = cluster_issuer
             self.certificate_data["issuer_kind"] = "ClusterIssuer"
-            self.kubernetes_utility.get_cluster_issuer(cluster_issuer)
         else:
             raise AnnotationDoesNotExist(
                 "Gateway must have either 'cert-manager.io/issuer' or 'cert-manager.io/cluster-issuer' annotation"
@@ -119,7 +220,8 @@ class IstioHandler:
         )
 
 
-    def _check_gateway_exists(self):
+    @observe_phase("check_gateway_exists")
+    async def _check_gateway_exists(self):
         """
         Check if an Istio Gateway exists and validate its ownership.
         Raises appropriate exceptions for invalid gateway configurations.
@@ -133,41 +235,135 @@ class IstioHandler:
             logging.error("Gateway needs to be in the istio-system namespace")
             raise IstioGatewayNamespaceError("Gateway must be in the istio-system namespace")
         
-        gateway_name = gateway_reference.split("/")[-1]
-        
-        gateway_data = self.kubernetes_utility.get_istio_gateway(gateway_name, "istio-system")
-        if not gateway_data:
-            logging.info(f"Gateway {gateway_name} does not exist")
+        dedicated = self.dedicated_gateways
+        if not dedicated:
+            # Shared gateways have many members; preflight_check validates them.
             return
-        
-        annotations = gateway_data.get("metadata", {}).get("annotations", {})
-        vs_details = annotations.get("vs", "")
-        
         current_vs_name = self.request_object.get("metadata", {}).get("name", "")
         current_vs_namespace = self.request_object.get("metadata", {}).get("namespace", "")
-        
-        try:
-            vs_namespace, vs_name = vs_details.split("/", 1)
-            if vs_name == current_vs_name and vs_namespace == current_vs_namespace:
-                logging.info(f"Gateway {gateway_name} already exists and is owned by the same VirtualService")
-                return
-        except ValueError:
-            # Invalid vs annotation format - treat as unowned
-            pass
-            
-        # Gateway exists but is not owned by this VirtualService
-        logging.error(f"Gateway {gateway_name} already exists")
-        raise GatewayAlreadyExists(f"Gateway {gateway_name} already exists")
-
-    def delete_gateway(self):
+        current_owner = f"{current_vs_namespace}/{current_vs_name}"
+        await self._warn_about_shared_hosts(current_owner)
+
+        existing = await gather_lookups(
+            *(self.cluster_cache.get_istio_gateway(name, "istio-system") for name in dedicated)
+        )
+        for gateway_name, gateway_data in zip(dedicated, existing):
+            if not gateway_data:
+                logging.debug("Gateway %s does not exist", gateway_name)
+                continue
+
+            if gateway_owner(gateway_data) == current_owner:
+                logging.debug("Gateway %s already exists and is owned by the same VirtualService", gateway_name)
+                continue
+
+            # Gateway exists but is not owned by this VirtualService
+            logging.error("Gateway %s already exists", gateway_name)
+            raise GatewayAlreadyExists(f"Gateway {gateway_name} already exists")
+
+    async def _warn_about_shared_hosts(self, current_owner: str):
+        hosts = self.request_object.get("spec", {}).get("hosts") or []
+        served = await gather_lookups(*(self.cluster_cache.gateways_for_host(host) for host in hosts))
+        for host, gateways in zip(hosts, served):
+            for gateway in gateways:
+                owner = gateway_owner(gateway)
+                if owner and owner != current_owner:
+                    logging.warning(
+                        "Host %s is already served by Gateway %s of VirtualService %s",
+                        host, gateway["metadata"]["name"], owner,
+                    )
+
+    async def delete_gateway(self, only: list[str] = None):
+        """Delete the Gateways this VirtualService owns, or only those named in ``only``."""
         try:
-            gateway_name = self.request_object["spec"]["gateways"][0].split("/")[-1]
-            logging.info(
-                f"Deleting Gateway {gateway_name}"
-            )
-            self.kubernetes_utility.delete_istio_gateway(
-                gateway_name, "istio-system"
-            )
-            logging.info(f"Gateway {gateway_name} deleted successfully")
+            metadata = self.request_object["metadata"]
+            removals = [
+                self.shared_gateways.remove(name, metadata["namespace"], metadata["name"])
+                for name in self.shared_gateway_names
+                if only is None or name in only
+            ]
+            gateways = await self.cluster_cache.owned_gateways(metadata["namespace"], metadata["name"])
+            names = [gateway["metadata"]["name"] for gateway in gateways]
+            if only is not None:
+                names = [name for name in names if name in only]
+            if not names and not removals:
+                logging.debug(
+                    "VirtualService %s/%s owns no Gateways to delete", metadata["namespace"], metadata["name"]
+                )
+            await gather_all(*removals, *(self._delete_gateway(name) for name in names))
         except Exception as e:
-            logging.error(f"Error deleting gateway: {e}")
+            logging.error("Error deleting gateway: %s", e)
+            raise e
+
+    async def _delete_gateway(self, gateway_name: str):
+        logging.info("Deleting Gateway %s", gateway_name)
+        await self.kubernetes_utility.delete_istio_gateway(
+            gateway_name, "istio-system"
+        )
+        self.cluster_cache.gateways.remove(gateway_name, "istio-system")
+        logging.info("Gateway %s deleted successfully", gateway_name)
+
+    async def _delete_unreferenced_gateways(self):
+        """Delete owned Gateways that the VirtualService no longer references."""
+        metadata = self.request_object["metadata"]
+        referenced = self.dedicated_gateways
+        gateways = await self.cluster_cache.owned_gateways(metadata["namespace"], metadata["name"])
+        await gather_all(
+            *(
+                self._delete_gateway(gateway["metadata"]["name"])
+                for gateway in gateways
+                if gateway["metadata"]["name"] not in referenced
+            )
+        )
+
+
+async def gather_all(*awaitables):
+    """
+    Run ``awaitables`` concurrently and wait for all of them, so one failure
+    does not abandon writes that are under way. Then raise the first error,
+    or, if every error is a deferral, the one that asks for the shortest wait.
+    """
+    if len(awaitables) <= 1:
+        return [await awaitable for awaitable in awaitables]
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    failures = [error for error in errors if not isinstance(error, Deferred)]
+    if failures:
+        raise failures[0]
+    if errors:
+        raise min(errors, key=lambda error: error.retry_after)
+    return results
+
+
+async def gather_lookups(*lookups) -> list:
+    """
+    asyncio.gather for cache lookups. Most VirtualServices have one Gateway
+    and one host, and a lookup answered from memory finishes without
+    suspending, so a single one is awaited directly instead of as a task.
+    """
+    if len(lookups) <= 1:
+        return [await lookup for lookup in lookups]
+    return await asyncio.gather(*lookups)
+
+
+async def reconcile(request: ReconcileRequestSchema):
+    istio_handler = IstioHandler(request.as_request_object())
+    if request.operation == "DELETE":
+        await istio_handler.delete_gateway()
+    elif request.operation == "PRUNE":
+        # Orphans found by the resync: the VirtualService still exists.
+        await istio_handler.delete_gateway(only=[gateway.split("/")[-1] for gateway in request.gateways])
+    elif request.operation == "REFRESH":
+        await shared_gateways.refresh(request.gateways[0].split("/")[-1])
+    elif request.operation == "CERTIFICATE_READY":
+        # Sent by the CertificateTracker, which only knows the Gateway, so
+        # reconcile from the current VirtualService. This may have replaced a
+        # queued request for the same Gateway, including a DELETE.
+        virtual_service = await kubernetes_utility.get_virtual_service(request.name, request.namespace)
+        if virtual_service is None:
+            await istio_handler.delete_gateway()
+            return
+        await IstioHandler(
+            ReconcileRequestSchema.from_virtual_service(virtual_service, request.operation).as_request_object()
+        ).reconcile()
+    else:
+        await istio_handler.reconcile()
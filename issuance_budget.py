@@ -0,0 +1,239 @@
+"""
+Keeps certificate writes within the issuer's rate limits. ACME CAs such as
+Let's Encrypt limit certificates per registered domain and new orders per
+account over sliding windows; a write that would cross a limit fails at the
+CA and is retried for hours. Writes that start an issuance are counted per
+registered domain and per Issuer/ClusterIssuer, and once a window is nearly
+spent further ones are deferred until it has room again. Only ACME issuers
+have such limits; Certificates of self-signed, CA and other issuers are never
+counted or deferred.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+from config import IssuanceConfig, ResyncConfig
+from errors import ClusterIssuerDoesnotExist, IssuanceDeferred, IssuerDoesnotExist
+from metrics import ISSUANCE_BUDGET_REMAINING, ISSUANCE_DEFERRED, ISSUANCE_DOMAIN_BUDGET_REMAINING
+from resources import certificate_issuer, parse_timestamp
+
+NAMESPACE = "istio-system"
+
+
+def registered_domain(host: str) -> str:
+    """
+    The domain a CA counts a host against: one label below the public
+    suffix. Suffixes of more than one label come from
+    ``IssuanceConfig.public_suffixes``; any other suffix is one label.
+    """
+    labels = host.lower().rstrip(".").removeprefix("*.").split(".")
+    suffix_length = 2 if ".".join(labels[-2:]) in IssuanceConfig.public_suffixes else 1
+    return ".".join(labels[-(suffix_length + 1):])
+
+
+def starts_issuance(existing: dict, desired: dict) -> bool:
+    """Whether applying ``desired`` over ``existing`` makes cert-manager issue a new certificate."""
+    if not existing:
+        return True
+    existing_spec = existing.get("spec", {})
+    desired_spec = desired["spec"]
+    return (
+        set(existing_spec.get("dnsNames") or []) != set(desired_spec.get("dnsNames") or [])
+        or certificate_issuer(existing) != certificate_issuer(desired)
+        or existing_spec.get("secretName") != desired_spec.get("secretName")
+    )
+
+
+class _Window:
+    """Timestamps of the issuances within the last ``length`` seconds."""
+
+    def __init__(self, limit: int, length: float):
+        self.limit = limit
+        self.length = length
+        self.times = collections.deque()
+
+    def expire(self, now: float):
+        while self.times and self.times[0] <= now - self.length:
+            self.times.popleft()
+
+    def allowed(self) -> int:
+        return int(self.limit * (1 - IssuanceConfig.reserve))
+
+    def remaining(self, now: float) -> int:
+        self.expire(now)
+        return max(self.allowed() - len(self.times), 0)
+
+    def delay(self, now: float) -> float:
+        """Seconds until one more issuance fits, 0 if it fits now."""
+        self.expire(now)
+        excess = len(self.times) - self.allowed()
+        if excess < 0:
+            return 0.0
+        if excess >= len(self.times):
+            # The limit leaves no room at all; check again after a window.
+            return self.length
+        return self.times[excess] + self.length - now
+
+    def record(self, at: float):
+        # Seeded timestamps can arrive out of order.
+        if self.times and at < self.times[-1]:
+            self.times = collections.deque(sorted([*self.times, at]))
+        else:
+            self.times.append(at)
+
+
+class IssuanceBudget:
+    """
+    Sliding-window issuance counts for the process that performs writes.
+
+    reserve() is called before a Certificate is applied. Writes for
+    issuers without an ``acme`` spec always pass, and so does a write that
+    keeps the dnsNames, issuer and secret, as it starts no issuance. Any
+    other write is counted against its issuer and every registered
+    domain among its hosts, or raises IssuanceDeferred with the seconds
+    until all of them have room. The reconcile queue retries deferred items
+    at that time without counting a failure, and since the queue keeps only
+    the latest item per key, host changes made in the meantime are issued
+    together in one certificate.
+
+    Counts start from the ``notBefore`` of the Certificates in the cluster,
+    so a restart or a new leader does not begin with a full budget. ``clock``
+    returns Unix seconds and can be replaced in tests.
+    """
+
+    def __init__(self, kubernetes_utility, cluster_cache, clock=time.time):
+        self.kubernetes_utility = kubernetes_utility
+        self.cluster_cache = cluster_cache
+        self.clock = clock
+        self._domains = {}
+        self._issuers = {}
+        self._seeded = False
+        self._seed_lock = asyncio.Lock()
+
+    def _domain_window(self, domain: str) -> _Window:
+        if domain not in self._domains:
+            self._domains[domain] = _Window(IssuanceConfig.domain_limit, IssuanceConfig.domain_window)
+        return self._domains[domain]
+
+    def _issuer_window(self, issuer: str) -> _Window:
+        if issuer not in self._issuers:
+            self._issuers[issuer] = _Window(IssuanceConfig.issuer_limit, IssuanceConfig.issuer_window)
+        return self._issuers[issuer]
+
+    def _windows(self, issuer: str, hosts: list[str]) -> list[tuple[str, _Window]]:
+        domains = sorted({registered_domain(host) for host in hosts})
+        return [("issuer", self._issuer_window(issuer))] + [
+            ("domain", self._domain_window(domain)) for domain in domains
+        ]
+
+    def delay(self, issuer: str, hosts: list[str]) -> tuple[float, str]:
+        """Seconds until an issuance for ``hosts`` fits, and the scope that limits it."""
+        now = self.clock()
+        delay, scope = 0.0, None
+        for window_scope, window in self._windows(issuer, hosts):
+            window_delay = window.delay(now)
+            if window_delay > delay:
+                delay, scope = window_delay, window_scope
+        return delay, scope
+
+    def record(self, issuer: str, hosts: list[str], at: float = None):
+        at = self.clock() if at is None else at
+        for _, window in self._windows(issuer, hosts):
+            window.record(at)
+
+    def seed(self, certificates: list[dict]):
+        """Count the issuances of ``certificates`` that fall within the windows."""
+        now = self.clock()
+        for certificate in certificates:
+            issuer = certificate_issuer(certificate)
+            if issuer in IssuanceConfig.exempt_issuers:
+                continue
+            issued_at = parse_timestamp(certificate.get("status", {}).get("notBefore"))
+            if issued_at is None:
+                continue
+            at = issued_at.timestamp()
+            if at > now - max(IssuanceConfig.domain_window, IssuanceConfig.issuer_window):
+                self.record(issuer, certificate.get("spec", {}).get("dnsNames") or [], at)
+        self._publish()
+
+    async def _rate_limited(self, issuer: str, namespace: str) -> bool:
+        """Whether ``issuer`` ("Kind/name") issues through ACME and is not exempt."""
+        if issuer in IssuanceConfig.exempt_issuers:
+            return False
+        kind, _, name = issuer.partition("/")
+        try:
+            if kind == "ClusterIssuer":
+                issuer_object = await self.cluster_cache.get_cluster_issuer(name)
+            else:
+                issuer_object = await self.cluster_cache.get_issuer(name, namespace)
+        except (ClusterIssuerDoesnotExist, IssuerDoesnotExist):
+            return False
+        return "acme" in ((issuer_object or {}).get("spec") or {})
+
+    async def _seed_from_cluster(self):
+        informer = self.cluster_cache.certificates
+        if informer.has_synced():
+            certificates = informer.list()
+        else:
+            certificates = []
+            async for page in self.kubernetes_utility.iter_custom_objects(
+                informer.group, informer.plural, NAMESPACE, ResyncConfig.page_size
+            ):
+                certificates.extend(page)
+        limited = {}
+        for certificate in certificates:
+            issuer = certificate_issuer(certificate)
+            if issuer not in limited:
+                limited[issuer] = await self._rate_limited(issuer, NAMESPACE)
+        certificates = [certificate for certificate in certificates if limited[certificate_issuer(certificate)]]
+        self.seed(certificates)
+        self._seeded = True
+        logging.info("Issuance budget seeded from %s Certificates", len(certificates))
+
+    async def reserve(self, existing: dict, desired: dict):
+        """Count the issuance ``desired`` starts, or raise IssuanceDeferred if it has to wait."""
+        if not IssuanceConfig.enabled or not starts_issuance(existing, desired):
+            return
+        issuer = certificate_issuer(desired)
+        if not await self._rate_limited(issuer, desired["metadata"].get("namespace", NAMESPACE)):
+            return
+        if not self._seeded:
+            # Reserves that arrive while the first one seeds wait for it, so
+            # the cluster's Certificates are counted once.
+            async with self._seed_lock:
+                if not self._seeded:
+                    await self._seed_from_cluster()
+        hosts = desired["spec"].get("dnsNames") or []
+        delay, scope = self.delay(issuer, hosts)
+        if delay > 0:
+            ISSUANCE_DEFERRED.labels(scope).inc()
+            self._publish()
+            raise IssuanceDeferred(
+                f"Certificate {desired['metadata']['name']} would exceed the {scope} issuance limit "
+                f"of {issuer}, deferring for {delay:.0f}s",
+                retry_after=delay,
+            )
+        self.record(issuer, hosts)
+        self._publish()
+
+    def remaining(self) -> dict:
+        now = self.clock()
+        return {
+            "issuers": {issuer: window.remaining(now) for issuer, window in self._issuers.items()},
+            "domains": {domain: window.remaining(now) for domain, window in self._domains.items()},
+        }
+
+    def _publish(self):
+        remaining = self.remaining()
+        for issuer, value in remaining["issuers"].items():
+            ISSUANCE_BUDGET_REMAINING.labels(issuer).set(value)
+        ISSUANCE_DOMAIN_BUDGET_REMAINING.set(
+            min(
+                remaining["domains"].values(),
+                default=int(IssuanceConfig.domain_limit * (1 - IssuanceConfig.reserve)),
+            )
+        )
+        # Domains whose window has emptied are forgotten again.
+        for domain in [domain for domain, window in self._domains.items() if not window.times]:
+            del self._domains[domain]
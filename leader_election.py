@@ -0,0 +1,159 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import time
+
+from kubernetes_asyncio import client
+from kubernetes_asyncio.client.exceptions import ApiException
+
+from config import LeaderElectionConfig
+from metrics import LEADER
+
+
+class LeaderElector:
+    """
+    coordination.k8s.io Lease based leader election across replicas.
+
+    Follows the client-go algorithm: the holder renews the Lease every retry
+    period, and another candidate takes over once it has seen the same
+    holder and renewTime for a full lease duration. Expiry is measured with
+    the local monotonic clock from when the Lease last changed, so clock
+    skew between nodes does not matter. Writes use the Lease resourceVersion,
+    and a conflicting update means another replica got there first.
+
+    ``on_started_leading`` is called when the Lease is acquired and
+    ``on_stopped_leading`` is awaited when it is lost or released.
+    """
+
+    def __init__(self, kubernetes_utility, on_started_leading, on_stopped_leading):
+        self.kubernetes_utility = kubernetes_utility
+        self.on_started_leading = on_started_leading
+        self.on_stopped_leading = on_stopped_leading
+        self.identity = f"{LeaderElectionConfig.identity or socket.gethostname()}_{os.getpid()}"
+        self.leading = False
+        self._observed = None
+        self._observed_at = 0.0
+        self._renewed_at = 0.0
+        self._task = None
+
+    @property
+    def _api(self):
+        return client.CoordinationV1Api(self.kubernetes_utility.api_client)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="leader-election")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self.leading:
+            # Stop writing before another replica can take over.
+            await self._set_leading(False)
+            await self._release()
+
+    async def _run(self):
+        while True:
+            try:
+                acquired = await self._try_acquire_or_renew()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("Error updating lease %s: %s", LeaderElectionConfig.lease_name, e)
+                acquired = False
+            if acquired:
+                self._renewed_at = time.monotonic()
+                await self._set_leading(True)
+            elif self.leading and time.monotonic() - self._renewed_at > LeaderElectionConfig.renew_deadline:
+                logging.warning("%s failed to renew lease %s", self.identity, LeaderElectionConfig.lease_name)
+                await self._set_leading(False)
+            await asyncio.sleep(LeaderElectionConfig.retry_period)
+
+    async def _set_leading(self, leading: bool):
+        if leading == self.leading:
+            return
+        self.leading = leading
+        LEADER.set(1 if leading else 0)
+        if leading:
+            logging.info("%s became the leader", self.identity)
+            self.on_started_leading()
+        else:
+            logging.info("%s stopped leading", self.identity)
+            await self.on_stopped_leading()
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    async def _try_acquire_or_renew(self) -> bool:
+        namespace = LeaderElectionConfig.lease_namespace
+        name = LeaderElectionConfig.lease_name
+        now = self._now()
+        try:
+            lease = await self._api.read_namespaced_lease(name, namespace)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            lease = client.V1Lease(
+                metadata=client.V1ObjectMeta(name=name, namespace=namespace),
+                spec=client.V1LeaseSpec(
+                    holder_identity=self.identity,
+                    lease_duration_seconds=LeaderElectionConfig.lease_duration,
+                    acquire_time=now,
+                    renew_time=now,
+                    lease_transitions=0,
+                ),
+            )
+            try:
+                await self._api.create_namespaced_lease(namespace, lease)
+            except ApiException as e:
+                if e.status == 409:
+                    return False
+                raise
+            return True
+
+        spec = lease.spec
+        observed = (spec.holder_identity, spec.renew_time, lease.metadata.resource_version)
+        if observed != self._observed:
+            self._observed = observed
+            self._observed_at = time.monotonic()
+        duration = spec.lease_duration_seconds or LeaderElectionConfig.lease_duration
+        expired = time.monotonic() - self._observed_at > duration
+        if spec.holder_identity and spec.holder_identity != self.identity and not expired:
+            return False
+
+        if spec.holder_identity != self.identity:
+            spec.acquire_time = now
+            spec.lease_transitions = (spec.lease_transitions or 0) + 1
+        spec.holder_identity = self.identity
+        spec.lease_duration_seconds = LeaderElectionConfig.lease_duration
+        spec.renew_time = now
+        try:
+            await self._api.replace_namespaced_lease(name, namespace, lease)
+        except ApiException as e:
+            if e.status == 409:
+                return False
+            raise
+        return True
+
+    async def _release(self):
+        """Hand the lease over straight away instead of letting it expire."""
+        namespace = LeaderElectionConfig.lease_namespace
+        name = LeaderElectionConfig.lease_name
+        try:
+            lease = await self._api.read_namespaced_lease(name, namespace)
+            if lease.spec.holder_identity != self.identity:
+                return
+            lease.spec.holder_identity = None
+            lease.spec.lease_duration_seconds = 1
+            lease.spec.renew_time = self._now()
+            await self._api.replace_namespaced_lease(name, namespace, lease)
+        except Exception as e:
+            logging.error("Error releasing lease %s: %s", name, e)
@@ -1,77 +1,195 @@
+import asyncio
+import importlib
 import logging
+from contextlib import asynccontextmanager
 
-from fastapi import BackgroundTasks, FastAPI, Request
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 
+from admission_cache import RecentAdmissions
+from codec import ANNOTATION_SKIPPED, VALIDATION_PASSED, decode_admission_review, encode_admission_response
+from config import AdmissionConfig, CaptureConfig, DebugConfig
+from deadline import set_deadline
 from errors import AnnotationDoesNotExist
-from handler import IstioHandler
-from schemas import AdmissionResponseSchema, ControllerResponseSchema
+from metrics import ADMISSION_LATENCY, ADMISSION_SHORTCUTS, count_error, mark_process_dead, render_metrics
+from structured_logging import payload_sampled, request_uid, setup_logging
 
-app = FastAPI()
+recent_admissions = RecentAdmissions()
+# The runtime module, once imported; see _start().
+runtime = None
+_startup = None
+
+
+async def _start():
+    global runtime
+    try:
+        # Imported off the event loop so /healthz answers while it loads.
+        runtime = await asyncio.to_thread(importlib.import_module, "runtime")
+        await runtime.start()
+    except Exception as e:
+        logging.error("Startup failed: %s", e)
+        raise
+
+
+async def _wait_for_startup():
+    if not _startup.done():
+        await asyncio.shield(_startup)
+    _startup.result()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _startup
+    setup_logging()
+    if DebugConfig.enabled:
+        debug.loop_lag.start()
+    _startup = asyncio.create_task(_start())
+    yield
+    if DebugConfig.enabled:
+        debug.loop_lag.stop()
+    _startup.cancel()
+    await asyncio.gather(_startup, return_exceptions=True)
+    if runtime is not None:
+        await runtime.stop()
+    mark_process_dead()
+
+
+app = FastAPI(lifespan=lifespan)
+if CaptureConfig.enabled:
+    from capture import CaptureMiddleware
+
+    app.add_middleware(CaptureMiddleware)
+if DebugConfig.enabled:
+    import debug
+
+    app.include_router(debug.router)
+    app.add_middleware(debug.ProfileMiddleware)
+
+
+@app.get("/healthz")
+async def healthz():
+    if _startup.done() and not _startup.cancelled() and _startup.exception():
+        return JSONResponse({"status": "failed"}, status_code=503)
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    if not _startup.done() or _startup.cancelled() or _startup.exception():
+        return JSONResponse({"status": "starting"}, status_code=503)
+    if not runtime.ready():
+        return JSONResponse({"status": "syncing"}, status_code=503)
+    return {"status": "ready"}
 
 
 @app.post("/validate")
-async def validate(request: Request, bg_tasks: BackgroundTasks):
+async def validate(request: Request):
+    with ADMISSION_LATENCY.labels("validate").time():
+        return await _validate(request)
+
+
+async def _validate(request: Request):
+    # Apiserver calls stop in time for the answer to reach the apiserver
+    # before it gives up on the webhook.
+    set_deadline(AdmissionConfig.timeout - AdmissionConfig.deadline_margin)
+    uid = ""
+    review = None
     try:
-        data = await request.json()
-        logging.info(f"Received data: {data}")
-        if data["request"]["operation"] in ["CREATE", "UPDATE"]:
-            istio_handler = IstioHandler(data["request"]["object"])
-            istio_handler.preflight_check()
-            bg_tasks.add_task(istio_handler.create_gateway)
-            bg_tasks.add_task(istio_handler.create_certificate)
-        elif data["request"]["operation"] == "DELETE":
-            istio_handler = IstioHandler(data["request"]["oldObject"])
-            bg_tasks.add_task(istio_handler.delete_gateway)
-        response = ControllerResponseSchema(
-            response=AdmissionResponseSchema(
-                uid=data["request"]["uid"],
-                allowed=True,
-                status={
-                    "message": "Validation passed",
-                },
-            )
-        )
-        logging.info(f"Response: {response}")
-        return response
+        review = decode_admission_review(await request.body())
+        uid = review.uid
+        request_uid.set(uid)
+        sampled = payload_sampled()
+        if sampled:
+            logging.debug("Received data: %s", review)
+        if review.operation in ["CREATE", "UPDATE"]:
+            shortcut = _shortcut(review)
+            if shortcut:
+                return Response(content=shortcut, media_type="application/json")
+            message = recent_admissions.get(review.object)
+            if message:
+                # A retried review: skip the preflight, but still reconcile.
+                ADMISSION_SHORTCUTS.labels("repeated").inc()
+                if message == VALIDATION_PASSED:
+                    await _wait_for_startup()
+                    runtime.coordinator.submit(review.object)
+                return Response(content=encode_admission_response(uid, True, message), media_type="application/json")
+            await _wait_for_startup()
+            istio_handler = runtime.IstioHandler(review.object.as_request_object())
+            await istio_handler.preflight_check()
+            runtime.coordinator.submit(review.object)
+            recent_admissions.add(review.object, VALIDATION_PASSED)
+        elif review.operation == "DELETE":
+            await _wait_for_startup()
+            recent_admissions.discard(review.old_object)
+            runtime.coordinator.submit(review.old_object)
+        response = encode_admission_response(uid, True, VALIDATION_PASSED)
+        if sampled:
+            logging.debug("Response: %s", response)
+        return Response(content=response, media_type="application/json")
 
     except AnnotationDoesNotExist as e:
-        logging.info(f"Annotation does not exist, hence skipping certificate creation")
-        return ControllerResponseSchema(
-            response=AdmissionResponseSchema(
-                uid=data["request"]["uid"],
-                allowed=True,
-                status={
-                    "message": "Annotation does not exist, skipping certificate creation",
-                },
-            )
+        count_error(e, "admission")
+        logging.info("Annotation does not exist, hence skipping certificate creation")
+        if review is not None and review.object is not None:
+            recent_admissions.add(review.object, ANNOTATION_SKIPPED)
+        return Response(
+            content=encode_admission_response(uid, True, ANNOTATION_SKIPPED),
+            media_type="application/json",
         )
 
     except Exception as e:
-        logging.error(f"Error validating data: {e}")
-        return ControllerResponseSchema(
-            response=AdmissionResponseSchema(
-                uid=data["request"]["uid"],
-                allowed=False,
-                status={
-                    "message": str(e),
-                },
-            )
+        count_error(e, "admission")
+        logging.error("Error validating data: %s", e)
+        return Response(
+            content=encode_admission_response(uid, False, str(e)),
+            media_type="application/json",
         )
 
+
+def _shortcut(review):
+    """Answer updates that cannot change what the reconcile would write."""
+    if review.operation == "UPDATE" and review.old_object is not None:
+        if review.object.inputs() == review.old_object.inputs():
+            ADMISSION_SHORTCUTS.labels("unchanged").inc()
+            return encode_admission_response(review.uid, True, VALIDATION_PASSED)
+    return None
+
+
 @app.post("/delete")
-async def delete(request: Request, bg_tasks: BackgroundTasks):
+async def delete(request: Request):
+    with ADMISSION_LATENCY.labels("delete").time():
+        return await _delete(request)
+
+
+async def _delete(request: Request):
+    uid = ""
     try:
-        data = await request.json()
-        istio_handler = IstioHandler(data["request"]["object"])
-        bg_tasks.add_task(istio_handler.delete_gateway)
+        review = decode_admission_review(await request.body())
+        uid = review.uid
+        request_uid.set(uid)
+        await _wait_for_startup()
+        # The apiserver sends the deleted VirtualService as oldObject.
+        virtual_service = review.old_object or review.object
+        recent_admissions.discard(virtual_service)
+        runtime.coordinator.submit(virtual_service.model_copy(update={"operation": "DELETE"}))
     except Exception as e:
-        logging.error(f"Error deleting data: {e}")
-        return ControllerResponseSchema(
-            response=AdmissionResponseSchema(
-                uid=data["request"]["uid"],
-                allowed=False,
-                status={
-                    "message": str(e),
-                },
-            )
+        count_error(e, "admission")
+        logging.error("Error deleting data: %s", e)
+        return Response(
+            content=encode_admission_response(uid, False, str(e)),
+            media_type="application/json",
         )
+    return Response(content=encode_admission_response(uid, True, VALIDATION_PASSED), media_type="application/json")
+
+
+@app.get("/queue")
+async def queue_stats():
+    await _wait_for_startup()
+    coordinator = runtime.coordinator
+    return {"primary": coordinator.primary, "leader": coordinator.leading, **runtime.reconcile_queue.stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
@@ -0,0 +1,194 @@
+import functools
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+ADMISSION_LATENCY = Histogram(
+    "webhook_admission_duration_seconds",
+    "Time spent answering an admission request.",
+    ["endpoint"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+PREFLIGHT_PHASE_LATENCY = Histogram(
+    "webhook_preflight_phase_duration_seconds",
+    "Time spent in each preflight phase of IstioHandler.",
+    ["phase"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+APISERVER_REQUEST_LATENCY = Histogram(
+    "webhook_apiserver_request_duration_seconds",
+    "Latency of Kubernetes API calls made by the webhook.",
+    ["resource", "verb"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RATE_LIMITER_WAIT = Histogram(
+    "webhook_apiserver_rate_limiter_wait_seconds",
+    "Time Kubernetes API calls waited for a client-side rate limiter token.",
+    ["budget"],
+    buckets=(0, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+ERRORS = Counter(
+    "webhook_errors_total",
+    "Errors raised while admitting or reconciling VirtualServices.",
+    ["error", "stage"],
+)
+ADMISSION_SHORTCUTS = Counter(
+    "webhook_admission_shortcuts_total",
+    "Admissions answered without a preflight, by reason (unchanged, repeated).",
+    ["reason"],
+)
+RECONCILE_DURATION = Histogram(
+    "webhook_reconcile_duration_seconds",
+    "Duration of background Gateway/Certificate reconciles.",
+    ["operation"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+RECONCILE_IN_FLIGHT = Gauge(
+    "webhook_reconcile_in_flight",
+    "Background reconciles currently running.",
+    multiprocess_mode="livesum",
+)
+QUEUE_DEPTH = Gauge(
+    "webhook_reconcile_queue_depth",
+    "Keys waiting in the reconcile queue.",
+    multiprocess_mode="livesum",
+)
+QUEUE_WAIT = Histogram(
+    "webhook_reconcile_queue_wait_seconds",
+    "Time a key waited in the reconcile queue before a worker picked it up.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+QUEUE_EVENTS = Counter(
+    "webhook_reconcile_queue_events_total",
+    "Reconcile queue events by type (added, coalesced, retried, dropped, deferred).",
+    ["event"],
+)
+
+LEADER = Gauge(
+    "webhook_leader",
+    "1 while this replica holds the leader Lease and performs writes.",
+    multiprocess_mode="livesum",
+)
+RESYNC_DURATION = Histogram(
+    "webhook_resync_duration_seconds",
+    "Duration of a full drift-detection pass.",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+RESYNC_DRIFT = Counter(
+    "webhook_resync_drift_total",
+    "Drifted objects found by the periodic resync, by resource and reason.",
+    ["resource", "reason"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "webhook_log_records_dropped_total",
+    "Log records dropped because the logging queue was full.",
+)
+CAPTURED_REVIEWS = Counter(
+    "webhook_captured_reviews_total",
+    "AdmissionReviews seen by the capture middleware, by result (written, queue_full, too_large, over_budget, invalid).",
+    ["result"],
+)
+CERTIFICATE_ISSUANCE = Histogram(
+    "webhook_certificate_issuance_seconds",
+    "Time from a Certificate being created or changed until it is Ready, by issuer.",
+    ["issuer"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+TIME_TO_TLS = Histogram(
+    "webhook_gateway_time_to_tls_seconds",
+    "Time from a Certificate being created until its Gateway serves the issued secret, by issuer.",
+    ["issuer"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+CIRCUIT_BREAKER_STATE = Gauge(
+    "webhook_apiserver_circuit_breaker_state",
+    "Circuit breaker state per resource: 0 closed, 1 half-open, 2 open.",
+    ["resource"],
+    multiprocess_mode="livemax",
+)
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    "webhook_apiserver_circuit_breaker_transitions_total",
+    "Circuit breaker state changes per resource, by the state entered.",
+    ["resource", "state"],
+)
+DEGRADED_READS = Counter(
+    "webhook_degraded_reads_total",
+    "Lookups answered from last-known state because the apiserver did not answer in time.",
+    ["resource"],
+)
+ISSUANCE_BUDGET_REMAINING = Gauge(
+    "webhook_issuance_budget_remaining",
+    "Issuances an issuer can start before certificate writes are deferred.",
+    ["issuer"],
+    multiprocess_mode="livemax",
+)
+ISSUANCE_DOMAIN_BUDGET_REMAINING = Gauge(
+    "webhook_issuance_domain_budget_remaining_min",
+    "Issuances left for the registered domain closest to its limit.",
+    multiprocess_mode="livemax",
+)
+ISSUANCE_DEFERRED = Counter(
+    "webhook_issuance_deferred_total",
+    "Certificate writes deferred because an issuance budget was spent, by scope (domain, issuer).",
+    ["scope"],
+)
+TLS_CERTIFICATE_RELOADS = Counter(
+    "webhook_tls_certificate_reloads_total",
+    "Reloads of the serving certificate after the files changed, by result.",
+    ["result"],
+)
+
+
+def observe_apiserver_call(resource: str, verb: str):
+    """Record the latency of an async KubernetesUtility call."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with APISERVER_REQUEST_LATENCY.labels(resource, verb).time():
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def observe_phase(phase: str):
+    """Record the latency of an async IstioHandler preflight phase."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with PREFLIGHT_PHASE_LATENCY.labels(phase).time():
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count_error(error: Exception, stage: str):
+    ERRORS.labels(type(error).__name__, stage).inc()
+
+
+def render_metrics() -> tuple[bytes, str]:
+    # With --workers every process writes to PROMETHEUS_MULTIPROC_DIR and any
+    # of them can serve the aggregated view.
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,139 @@
+import asyncio
+import ssl
+import time
+
+import aiohttp
+from kubernetes_asyncio.client import rest
+from kubernetes_asyncio.client.exceptions import ApiException
+
+from circuit_breaker import breaker_for, resource_of
+from config import ApiServerConfig
+from deadline import remaining
+from errors import DeadlineExceeded
+from metrics import RATE_LIMITER_WAIT
+
+
+class TokenBucket:
+    """
+    QPS/burst limiter in the style of client-go's flowcontrol. Each call
+    reserves a token straight away, possibly driving the balance negative,
+    and sleeps until that token would have been refilled, so waiters are
+    served in arrival order without a lock.
+    """
+
+    def __init__(self, qps: float, burst: int, clock=time.monotonic):
+        self.qps = qps
+        self.burst = max(1, burst)
+        self.clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+
+    def reserve(self, max_wait: float = None):
+        """
+        Take a token and return how long the caller must wait for it. When
+        the wait would be ``max_wait`` or longer the token is left for later
+        callers and None is returned.
+        """
+        if self.qps <= 0:
+            return 0.0
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.qps)
+        self._updated = now
+        delay = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.qps
+        if max_wait is not None and delay >= max_wait:
+            return None
+        self._tokens -= 1
+        return delay
+
+    async def acquire(self) -> float:
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class RateLimitedRESTClient(rest.RESTClientObject):
+    """
+    kubernetes_asyncio REST client with separate read and write budgets and
+    a tunable connection pool. Lease requests bypass the limiter so a burst
+    of writes cannot cost the leader its Lease.
+
+    Every call is bounded by the admission deadline when there is one and
+    by ``ApiServerConfig.request_timeout`` otherwise; a call that would have
+    to wait past the deadline for a token raises DeadlineExceeded without
+    being sent. Calls other than Lease requests and watches go through the
+    circuit breaker of their resource type.
+    """
+
+    def __init__(self, configuration):
+        # Mirrors RESTClientObject.__init__, which offers no way to pass
+        # connector options such as the keepalive timeout.
+        ssl_context = ssl.create_default_context(cafile=configuration.ssl_ca_cert)
+        if configuration.cert_file:
+            ssl_context.load_cert_chain(configuration.cert_file, keyfile=configuration.key_file)
+        if not configuration.verify_ssl:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        self.server_hostname = configuration.tls_server_name
+        self.proxy = configuration.proxy
+        self.proxy_headers = configuration.proxy_headers
+        connector = aiohttp.TCPConnector(
+            limit=ApiServerConfig.pool_size,
+            keepalive_timeout=ApiServerConfig.keepalive_timeout,
+            ssl=ssl_context,
+        )
+        self.pool_manager = aiohttp.ClientSession(
+            connector=connector, trust_env=True, read_bufsize=2**21
+        )
+        self.read_bucket = TokenBucket(ApiServerConfig.read_qps, ApiServerConfig.read_burst)
+        self.write_bucket = TokenBucket(ApiServerConfig.write_qps, ApiServerConfig.write_burst)
+
+    async def request(self, method, url, query_params=None, *args, **kwargs):
+        if "/apis/coordination.k8s.io/" in url:
+            return await super().request(method, url, query_params, *args, **kwargs)
+        budget, bucket = (
+            ("read", self.read_bucket) if method.upper() in ("GET", "HEAD")
+            else ("write", self.write_bucket)
+        )
+        delay = bucket.reserve(remaining())
+        if delay is None:
+            raise DeadlineExceeded(f"{method} {resource_of(url)} would wait past the deadline for the rate limiter")
+        if delay:
+            await asyncio.sleep(delay)
+        RATE_LIMITER_WAIT.labels(budget).observe(delay)
+        if any(key == "watch" for key, _ in query_params or ()):
+            # Watches are long-lived and bounded by their timeoutSeconds.
+            return await super().request(method, url, query_params, *args, **kwargs)
+
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded(f"No time left to {method} {resource_of(url)}")
+        timeout = kwargs.get("_request_timeout") or ApiServerConfig.request_timeout
+        if left is not None and left < timeout:
+            timeout = left
+        kwargs["_request_timeout"] = timeout
+        breaker = breaker_for(resource_of(url))
+        breaker.before_call()
+        try:
+            response = await super().request(method, url, query_params, *args, **kwargs)
+        except ApiException as e:
+            self._record(breaker, e.status)
+            raise
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            breaker.failure()
+            if isinstance(e, asyncio.TimeoutError) and left is not None and timeout == left:
+                raise DeadlineExceeded(f"{method} {resource_of(url)} did not finish before the deadline") from e
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        self._record(breaker, response.status)
+        return response
+
+    @staticmethod
+    def _record(breaker, status: int):
+        # Other 4xx answers still show a responsive apiserver.
+        if status == 429 or status >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
@@ -0,0 +1,254 @@
+import datetime
+import hashlib
+import json
+
+from schemas import CertificateSchema, GatewayOwnerReferenceSchema
+
+FIELD_MANAGER = "istio-cert-manager-webhook"
+SPEC_HASH_ANNOTATION = "istio-cert-manager-webhook/spec-hash"
+# Gateways record their VirtualService in the "vs" annotation; the labels
+# below carry the same ownership in a form the apiserver can select on.
+OWNER_ANNOTATION = "vs"
+MANAGED_BY_LABEL = "app.kubernetes.io/managed-by"
+OWNER_NAMESPACE_LABEL = "istio-cert-manager-webhook/vs-namespace"
+OWNER_NAME_LABEL = "istio-cert-manager-webhook/vs-name"
+MANAGED_SELECTOR = f"{MANAGED_BY_LABEL}={FIELD_MANAGER}"
+# Shared gateways (consolidation mode) record their member VirtualServices
+# and how hosts are packed into Certificates.
+MEMBERS_ANNOTATION = "istio-cert-manager-webhook/members"
+SHARDS_ANNOTATION = "istio-cert-manager-webhook/shards"
+
+
+def spec_hash(manifest: dict) -> str:
+    """Hash the fields we own so unchanged desired state can skip the write."""
+    metadata = manifest["metadata"]
+    annotations = {
+        key: value
+        for key, value in metadata.get("annotations", {}).items()
+        if key != SPEC_HASH_ANNOTATION
+    }
+    owned = {
+        "annotations": annotations,
+        "ownerReferences": metadata.get("ownerReferences", []),
+        "spec": manifest["spec"],
+    }
+    if metadata.get("labels"):
+        owned["labels"] = metadata["labels"]
+    encoded = json.dumps(owned, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def with_spec_hash(manifest: dict) -> dict:
+    annotations = manifest["metadata"].setdefault("annotations", {})
+    annotations[SPEC_HASH_ANNOTATION] = spec_hash(manifest)
+    return manifest
+
+
+def _owned_fields(existing: dict, desired: dict) -> dict:
+    """The parts of ``existing`` that ``desired`` sets, in the shape spec_hash reads."""
+    metadata = existing.get("metadata") or {}
+    desired_metadata = desired["metadata"]
+    owned_metadata = {"ownerReferences": metadata.get("ownerReferences", [])}
+    for field in ("annotations", "labels"):
+        values = metadata.get(field) or {}
+        owned_metadata[field] = {key: values[key] for key in desired_metadata.get(field, {}) if key in values}
+    spec = existing.get("spec") or {}
+    return {
+        "metadata": owned_metadata,
+        "spec": {key: spec[key] for key in desired["spec"] if key in spec},
+    }
+
+
+def is_up_to_date(existing: dict, desired: dict) -> bool:
+    """Whether the live object still matches ``desired`` in every field we own.
+
+    The live fields are hashed rather than trusting the stored annotation, so
+    an edit that left the annotation in place is still seen as drift. Fields
+    other managers or the apiserver added are not ours and are ignored.
+    """
+    if not existing:
+        return False
+    return spec_hash(_owned_fields(existing, desired)) == desired["metadata"]["annotations"][SPEC_HASH_ANNOTATION]
+
+
+def _label_value(value: str) -> str:
+    # Label values are limited to 63 characters; VirtualService names are not.
+    if len(value) <= 63:
+        return value
+    digest = hashlib.sha256(value.encode()).hexdigest()[:10]
+    return f"{value[:52].rstrip('.-_')}-{digest}"
+
+
+def owner_labels(namespace: str, name: str) -> dict:
+    return {
+        MANAGED_BY_LABEL: FIELD_MANAGER,
+        OWNER_NAMESPACE_LABEL: namespace,
+        OWNER_NAME_LABEL: _label_value(name),
+    }
+
+
+def owner_selector(namespace: str, name: str) -> str:
+    return ",".join(f"{key}={value}" for key, value in owner_labels(namespace, name).items())
+
+
+def gateway_owner(gateway: dict):
+    """namespace/name of the VirtualService that owns a Gateway, if any."""
+    return (gateway.get("metadata", {}).get("annotations") or {}).get(OWNER_ANNOTATION)
+
+
+def gateway_members(gateway: dict) -> dict:
+    """Member VirtualServices of a shared gateway: namespace/name -> hosts and profile."""
+    annotations = (gateway or {}).get("metadata", {}).get("annotations") or {}
+    return json.loads(annotations.get(MEMBERS_ANNOTATION) or "{}")
+
+
+def gateway_shards(gateway: dict) -> dict:
+    """Certificates of a shared gateway: name -> hosts and profile."""
+    annotations = (gateway or {}).get("metadata", {}).get("annotations") or {}
+    return json.loads(annotations.get(SHARDS_ANNOTATION) or "{}")
+
+
+def is_shared(gateway: dict) -> bool:
+    return MEMBERS_ANNOTATION in ((gateway or {}).get("metadata", {}).get("annotations") or {})
+
+
+def gateway_hosts(gateway: dict) -> list[str]:
+    return [
+        host
+        for server in gateway.get("spec", {}).get("servers") or []
+        for host in server.get("hosts") or []
+    ]
+
+
+def parse_timestamp(value: str):
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def certificate_condition(certificate: dict, condition_type: str = "Ready"):
+    for condition in (certificate or {}).get("status", {}).get("conditions") or []:
+        if condition.get("type") == condition_type:
+            return condition
+    return None
+
+
+def certificate_ready(certificate: dict) -> bool:
+    condition = certificate_condition(certificate)
+    return condition is not None and condition.get("status") == "True"
+
+
+def certificate_issued(certificate: dict) -> bool:
+    """
+    Whether the Certificate's secret has been issued at least once. A
+    Certificate that is re-issuing after a change is not Ready, but its
+    secret still serves, so a Gateway bound to it stays bound.
+    """
+    status = (certificate or {}).get("status", {})
+    return certificate_ready(certificate) or bool(status.get("revision") or status.get("notAfter"))
+
+
+def certificate_issuer(certificate: dict) -> str:
+    issuer_ref = certificate.get("spec", {}).get("issuerRef") or {}
+    return f"{issuer_ref.get('kind', 'Issuer')}/{issuer_ref.get('name', '')}"
+
+
+def gateway_credential(gateway: dict):
+    """The credentialName the Gateway serves, or None while it is pending."""
+    for server in (gateway or {}).get("spec", {}).get("servers") or []:
+        credential_name = (server.get("tls") or {}).get("credentialName")
+        if credential_name:
+            return credential_name
+    return None
+
+
+def certificate_manifest(
+    certificate: CertificateSchema, owner_reference: GatewayOwnerReferenceSchema
+) -> dict:
+    return with_spec_hash({
+        "apiVersion": "cert-manager.io/v1",
+        "kind": "Certificate",
+        "metadata": {
+            "name": certificate.name,
+            "namespace": certificate.namespace,
+            "ownerReferences": [owner_reference.model_dump()],
+        },
+        "spec": {
+            "secretName": certificate.secret_name,
+            "duration": certificate.duration,
+            "renewBefore": certificate.renew_before,
+            "dnsNames": certificate.dns_names,
+            "usages": [
+                "digital signature",
+                "key encipherment",
+            ],
+            "issuerRef": {
+                "name": certificate.issuer_name,
+                "kind": certificate.issuer_kind,
+                "group": "cert-manager.io",
+            },
+        },
+    })
+
+
+def gateway_server(hosts: list[str], credential_name: str = None, port_name: str = "https") -> dict:
+    if credential_name:
+        return {
+            "port": {
+                "number": 443,
+                "name": port_name,
+                "protocol": "HTTPS",
+            },
+            "tls": {
+                "mode": "SIMPLE",
+                "credentialName": credential_name,
+            },
+            "hosts": hosts,
+        }
+    # Until the Certificate is issued there is no secret to serve. Istio
+    # rejects SIMPLE TLS without a credentialName, and a credentialName
+    # that does not exist yet makes Envoy reject the listener over and
+    # over, so the hosts are held on a passthrough server instead.
+    return {
+        "port": {
+            "number": 443,
+            "name": port_name.replace("https", "tls-pending", 1),
+            "protocol": "TLS",
+        },
+        "tls": {
+            "mode": "PASSTHROUGH",
+        },
+        "hosts": hosts,
+    }
+
+
+def gateway_manifest(
+    name: str,
+    namespace: str,
+    annotations: dict,
+    hosts: list[str],
+    credential_name: str = None,
+    labels: dict = None,
+    servers: list[dict] = None,
+) -> dict:
+    """Gateway with one server for ``hosts``, or with ``servers`` when given."""
+    if servers is None:
+        servers = [gateway_server(hosts, credential_name)]
+    metadata = {
+        "name": name,
+        "namespace": namespace,
+        "annotations": dict(annotations)
+    }
+    if labels:
+        metadata["labels"] = dict(labels)
+    return with_spec_hash({
+        "apiVersion": "networking.istio.io/v1",
+        "kind": "Gateway",
+        "metadata": metadata,
+        "spec": {
+            "selector": {
+                "istio": "ingressgateway",
+            },
+            "servers": servers
+        }
+    })
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+
+from config import ResyncConfig
+from errors import AnnotationDoesNotExist
+from handler import IstioHandler, shared_gateways
+from metrics import RESYNC_DRIFT, RESYNC_DURATION, count_error
+from resources import MANAGED_SELECTOR, SPEC_HASH_ANNOTATION, gateway_members, gateway_owner, is_shared, is_up_to_date
+from schemas import ReconcileRequestSchema
+
+
+class DriftResync:
+    """
+    Periodically compares the Gateways and Certificates every VirtualService
+    should have with what is in the cluster and queues repairs for the
+    differences only.
+
+    VirtualServices are read with paginated LISTs and processed page by page.
+    Gateways and Certificates come from the informer cache when it has synced
+    and from paginated LISTs otherwise, so a pass never issues a GET per
+    object. Repairs go through the reconcile queue, which bounds how many run
+    at once; the pass itself waits while the queue holds more than
+    ``ResyncConfig.max_pending`` keys.
+
+    The reconcile queue lives in memory only, so the first pass runs as soon
+    as the replica starts writing: it re-queues whatever a restart or a
+    leadership change dropped from the queue.
+    """
+
+    def __init__(self, kubernetes_utility, cluster_cache, reconcile_queue):
+        self.kubernetes_utility = kubernetes_utility
+        self.cluster_cache = cluster_cache
+        self.reconcile_queue = reconcile_queue
+        self._task = None
+
+    def start(self):
+        if not ResyncConfig.enabled:
+            logging.info("Drift resync disabled")
+            return
+        self._task = asyncio.create_task(self._run(), name="drift-resync")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.resync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                count_error(e, "resync")
+                logging.error("Drift resync failed: %s", e)
+            await asyncio.sleep(ResyncConfig.period)
+
+    async def _snapshot(self, informer, label_selector: str = None) -> dict:
+        if informer.has_synced():
+            objects = informer.list()
+        else:
+            objects = []
+            async for page in self.kubernetes_utility.iter_custom_objects(
+                informer.group, informer.plural, informer.namespace, ResyncConfig.page_size, label_selector
+            ):
+                objects.extend(page)
+        return {obj["metadata"]["name"]: obj for obj in objects}
+
+    async def resync(self) -> int:
+        """Run one pass and return the number of repairs queued."""
+        start = time.perf_counter()
+        # Gateways are read before VirtualServices: a Gateway is only created
+        # after its VirtualService, so none can look orphaned by the ordering.
+        gateways = await self._snapshot(self.cluster_cache.gateways, MANAGED_SELECTOR)
+        certificates = await self._snapshot(self.cluster_cache.certificates)
+        referenced = set()
+        repairs = 0
+        async for page in self.kubernetes_utility.iter_custom_objects(
+            "networking.istio.io", "virtualservices", page_size=ResyncConfig.page_size
+        ):
+            for virtual_service in page:
+                request = ReconcileRequestSchema.from_virtual_service(virtual_service, "RESYNC")
+                referenced.update(
+                    (f"{request.namespace}/{request.name}", gateway.split("/")[-1])
+                    for gateway in request.gateways
+                )
+                reason = self.drift(request, gateways, certificates)
+                if reason:
+                    RESYNC_DRIFT.labels(*reason).inc()
+                    await self._enqueue(request)
+                    repairs += 1
+
+        for name, gateway in gateways.items():
+            annotations = gateway["metadata"].get("annotations") or {}
+            if SPEC_HASH_ANNOTATION not in annotations:
+                continue
+            owners = gateway_members(gateway) if is_shared(gateway) else [gateway_owner(gateway)]
+            for owner in owners:
+                if not owner or (owner, name) in referenced:
+                    continue
+                namespace, _, vs_name = owner.partition("/")
+                RESYNC_DRIFT.labels("gateways", "orphaned").inc()
+                await self._enqueue(
+                    ReconcileRequestSchema.model_construct(
+                        operation="PRUNE",
+                        name=vs_name,
+                        namespace=namespace,
+                        gateways=[f"istio-system/{name}"],
+                        hosts=[],
+                        annotations={},
+                    )
+                )
+                repairs += 1
+
+        elapsed = time.perf_counter() - start
+        RESYNC_DURATION.observe(elapsed)
+        logging.info("Drift resync queued %s repairs in %.1fs", repairs, elapsed)
+        return repairs
+
+    def drift(self, request: ReconcileRequestSchema, gateways: dict, certificates: dict):
+        """Return (resource, reason) when the VirtualService needs a reconcile."""
+        if not request.gateways or not request.gateways[0].startswith("istio-system/"):
+            return None
+        handler = IstioHandler(request.as_request_object())
+        try:
+            handler.certificate_settings()
+        except AnnotationDoesNotExist:
+            return None
+        for gateway_name in handler.shared_gateway_names:
+            reason = shared_gateways.drift(
+                gateway_name, handler.request_object, handler.certificate_data, gateways, certificates
+            )
+            if reason:
+                return reason
+        owner = f"{request.namespace}/{request.name}"
+        for gateway_name in handler.dedicated_gateways:
+            reason = self._gateway_drift(handler, owner, gateway_name, gateways, certificates)
+            if reason:
+                return reason
+        return None
+
+    @staticmethod
+    def _gateway_drift(handler: IstioHandler, owner: str, gateway_name: str, gateways: dict, certificates: dict):
+        certificate = certificates.get(handler.credential_name(gateway_name))
+        desired_gateway = handler.desired_gateway(gateway_name, certificate)
+        existing_gateway = gateways.get(gateway_name)
+        if existing_gateway is None:
+            return "gateways", "missing"
+        if gateway_owner(existing_gateway) != owner:
+            # Owned by another VirtualService; admission rejects this one.
+            return None
+        if not is_up_to_date(existing_gateway, desired_gateway):
+            return "gateways", "changed"
+        desired_certificate = handler.desired_certificate(existing_gateway)
+        existing_certificate = certificates.get(desired_certificate["metadata"]["name"])
+        if existing_certificate is None:
+            return "certificates", "missing"
+        if not is_up_to_date(existing_certificate, desired_certificate):
+            return "certificates", "changed"
+        return None
+
+    async def _enqueue(self, request: ReconcileRequestSchema):
+        while self.reconcile_queue.depth >= ResyncConfig.max_pending:
+            await asyncio.sleep(0.1)
+        self.reconcile_queue.add(request.key, request)
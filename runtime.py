@@ -0,0 +1,48 @@
+"""
+The parts of the webhook that need the Kubernetes client. Importing
+kubernetes_asyncio dominates start-up time, so main imports this module in a
+thread after the server is up and reports ready once start() has finished
+and the informers have synced.
+"""
+from certificate_tracker import CertificateTracker
+from config import CacheConfig
+from errors import (
+    AnnotationDoesNotExist,
+    GatewayAlreadyExists,
+    IstioGatewayNamespaceError,
+    SharedGatewayConflict,
+)
+from handler import IstioHandler, cluster_cache, kubernetes_utility, reconcile
+from resync import DriftResync
+from schemas import ReconcileRequestSchema
+from shared_state import WorkerCoordinator
+from work_queue import ReconcileQueue
+
+reconcile_queue = ReconcileQueue(
+    reconcile,
+    permanent_errors=(
+        AnnotationDoesNotExist,
+        GatewayAlreadyExists,
+        IstioGatewayNamespaceError,
+        SharedGatewayConflict,
+    ),
+)
+resync = DriftResync(kubernetes_utility, cluster_cache, reconcile_queue)
+coordinator = WorkerCoordinator(cluster_cache, reconcile_queue, ReconcileRequestSchema, resync)
+certificate_tracker = CertificateTracker(cluster_cache, coordinator.submit, ReconcileRequestSchema)
+
+
+async def start():
+    await kubernetes_utility.initialize()
+    await kubernetes_utility.warm_up()
+    certificate_tracker.start()
+    await coordinator.start()
+
+
+async def stop():
+    await coordinator.stop()
+    await kubernetes_utility.close()
+
+
+def ready() -> bool:
+    return not CacheConfig.enabled or cluster_cache.has_synced()
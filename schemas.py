@@ -1,5 +1,7 @@
 from pydantic import BaseModel
 
+from config import ConsolidationConfig
+
 
 
 class CertificateSchema(BaseModel):
@@ -30,6 +32,77 @@ class VirtualServiceOwnerReferenceSchema(BaseModel):
     blockOwnerDeletion: bool = True
 
 
+def is_shared_gateway(gateway_reference: str) -> bool:
+    """Whether a gateway reference names a consolidated, shared gateway."""
+    return ConsolidationConfig.enabled and gateway_reference.split("/")[-1].startswith(
+        ConsolidationConfig.gateway_prefix
+    )
+
+
+class ReconcileRequestSchema(BaseModel):
+    """The fields of a VirtualService the background reconcile needs."""
+
+    operation: str
+    name: str
+    namespace: str
+    gateways: list[str] = []
+    hosts: list[str] = []
+    annotations: dict[str, str] = {}
+    generation: int = 0
+    # uid of the AdmissionReview that produced the request, for log correlation.
+    uid: str = ""
+    # metadata.uid of the VirtualService; a re-created object gets a new one.
+    object_uid: str = ""
+
+    @classmethod
+    def from_virtual_service(cls, virtual_service: dict, operation: str, uid: str = ""):
+        metadata = virtual_service.get("metadata", {})
+        spec = virtual_service.get("spec", {})
+        # Objects come from the apiserver, so skip re-validating them.
+        return cls.model_construct(
+            operation=operation,
+            name=metadata.get("name", ""),
+            namespace=metadata.get("namespace", ""),
+            gateways=spec.get("gateways") or [],
+            hosts=spec.get("hosts") or [],
+            annotations={
+                key: value
+                for key, value in (metadata.get("annotations") or {}).items()
+                if key.startswith("cert-manager.io/")
+            },
+            generation=metadata.get("generation") or 0,
+            uid=uid,
+            object_uid=metadata.get("uid", ""),
+        )
+
+    def inputs(self) -> tuple:
+        """The fields IstioHandler acts on; equal inputs need no reconcile."""
+        return (self.gateways, self.hosts, self.annotations)
+
+    @property
+    def key(self) -> str:
+        gateway = self.gateways[0] if self.gateways else ""
+        key = f"istio-system/{gateway.split('/')[-1]}"
+        # Many VirtualServices share a consolidated gateway, and coalescing
+        # their requests would drop all but the last.
+        if is_shared_gateway(gateway):
+            return f"{key}/{self.namespace}/{self.name}"
+        return key
+
+    def as_request_object(self) -> dict:
+        return {
+            "metadata": {
+                "name": self.name,
+                "namespace": self.namespace,
+                "annotations": self.annotations,
+            },
+            "spec": {
+                "gateways": self.gateways,
+                "hosts": self.hosts,
+            },
+        }
+
+
 class AdmissionResponseSchema(BaseModel):
     allowed: bool
     uid: str
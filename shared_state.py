@@ -0,0 +1,363 @@
+"""
+State shared between uvicorn worker processes started with ``app.py --workers``.
+
+The supervisor starts a manager process that owns the informer stores and an
+inbox of reconcile requests. Exactly one worker, the holder of an flock on
+the primary lock file, runs the informers and the reconcile queue. It keeps
+the informer stores, with their indices and staleness, in its own memory and
+copies every change to the manager in the background. The other workers read
+cluster state from the manager and hand their reconcile requests to the
+primary through the inbox, so there is a single writer per pod. With leader
+election enabled, the primary of the replica holding the Lease is the single
+writer of the whole Deployment.
+
+No IPC call runs on the event loop: reads go through a thread, and writes go
+through a single thread so they reach the manager in order.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import secrets
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.managers import BaseManager
+
+from cache import MemoryStore, ResourceInformer
+from config import LeaderElectionConfig
+from leader_election import LeaderElector
+
+ADDRESS_ENV = "WEBHOOK_SHARED_STATE_ADDRESS"
+AUTHKEY_ENV = "WEBHOOK_SHARED_STATE_AUTHKEY"
+LOCK_ENV = "WEBHOOK_PRIMARY_LOCK"
+# How often the primary copies store changes to the manager, and how often
+# secondaries read whether the stores have synced and since when they fail.
+REPLICATION_INTERVAL = 0.05
+STATUS_INTERVAL = 0.5
+
+
+class SharedStore:
+    """Lives in the manager process; every method is one IPC round trip."""
+
+    # The MemoryStore methods apply() may call.
+    CHANGES = ("set", "delete", "replace", "set_failing_since")
+
+    def __init__(self):
+        self._stores = {}
+        self._inbox = {}
+
+    def _store(self, kind: str) -> MemoryStore:
+        return self._stores.setdefault(kind, MemoryStore())
+
+    def get(self, kind: str, key: str):
+        return self._store(kind).get(key)
+
+    def values(self, kind: str) -> list[dict]:
+        return self._store(kind).values()
+
+    def by_index(self, kind: str, name: str, value: str) -> list[dict]:
+        return self._store(kind).by_index(name, value)
+
+    def apply(self, changes: list):
+        """Apply the (kind, method, args) changes the primary made to its stores, in order."""
+        for kind, method, args in changes:
+            if method in self.CHANGES:
+                getattr(self._store(kind), method)(*args)
+
+    def status(self) -> dict:
+        """(synced, failing since) per kind."""
+        return {kind: (store.synced(), store.failing_since()) for kind, store in self._stores.items()}
+
+    def submit(self, key: str, item: dict):
+        # Keyed like the reconcile queue, so the inbox coalesces as well.
+        self._inbox[key] = item
+
+    def drain(self) -> dict:
+        inbox, self._inbox = self._inbox, {}
+        return inbox
+
+
+_store = SharedStore()
+
+
+def _get_store() -> SharedStore:
+    return _store
+
+
+class SharedStateManager(BaseManager):
+    pass
+
+
+SharedStateManager.register("store", callable=_get_store)
+
+
+class ReplicatedStore(MemoryStore):
+    """The primary's MemoryStore, which records its changes for the manager."""
+
+    def __init__(self, kind: str, changes: list):
+        super().__init__()
+        self._kind = kind
+        self._changes = changes
+
+    def set(self, key: str, obj: dict, index_values: dict = None):
+        super().set(key, obj, index_values)
+        self._changes.append((self._kind, "set", (key, obj, index_values)))
+
+    def delete(self, key: str):
+        super().delete(key)
+        self._changes.append((self._kind, "delete", (key,)))
+
+    def replace(self, items: dict, index_values: dict = None):
+        super().replace(items, index_values)
+        # Later set() and delete() calls change items in place.
+        self._changes.append((self._kind, "replace", (dict(items), index_values)))
+
+    def set_failing_since(self, value):
+        super().set_failing_since(value)
+        self._changes.append((self._kind, "set_failing_since", (value,)))
+
+
+class RemoteStore:
+    """
+    A secondary's read-only view of the primary's store. get(), values() and
+    by_index() block on IPC; the admission path uses the fetch methods, which
+    run in a thread. synced() and failing_since() answer from the status the
+    coordinator polls.
+    """
+
+    def __init__(self, proxy, kind: str, status: dict):
+        self._proxy = proxy
+        self._kind = kind
+        self._status = status
+
+    def get(self, key: str):
+        return self._proxy.get(self._kind, key)
+
+    def values(self) -> list[dict]:
+        return self._proxy.values(self._kind)
+
+    def by_index(self, name: str, value: str) -> list[dict]:
+        return self._proxy.by_index(self._kind, name, value)
+
+    async def fetch(self, key: str):
+        return await asyncio.to_thread(self.get, key)
+
+    async def fetch_by_index(self, name: str, value: str) -> list[dict]:
+        return await asyncio.to_thread(self.by_index, name, value)
+
+    def synced(self) -> bool:
+        return self._status.get(self._kind, (False, None))[0]
+
+    def failing_since(self):
+        # time.monotonic() is system-wide on Linux, so the primary's value holds here.
+        return self._status.get(self._kind, (False, None))[1]
+
+
+def start_manager() -> SharedStateManager:
+    """Start the manager in the supervisor and export its address to workers."""
+    directory = tempfile.mkdtemp(prefix="istio-cert-webhook-")
+    authkey = secrets.token_bytes(32)
+    manager = SharedStateManager(address=os.path.join(directory, "state.sock"), authkey=authkey)
+    manager.start()
+    os.environ[ADDRESS_ENV] = manager.address
+    os.environ[AUTHKEY_ENV] = authkey.hex()
+    os.environ[LOCK_ENV] = os.path.join(directory, "primary.lock")
+    return manager
+
+
+class WorkerCoordinator:
+    """
+    Decides whether this process is the primary worker and routes reconcile
+    requests accordingly. Without --workers there is no manager and the single
+    process is always primary.
+
+    The primary always runs the informers that admission reads from. It runs
+    the writers (reconcile queue, drift resync) only while it leads: always
+    without leader election, and while holding the Lease with it. The leader
+    also watches VirtualServices, so changes admitted by other replicas are
+    reconciled here; other replicas drop their reconcile requests.
+    """
+
+    def __init__(self, cluster_cache, reconcile_queue, request_type, resync=None):
+        self.cluster_cache = cluster_cache
+        self.reconcile_queue = reconcile_queue
+        self.request_type = request_type
+        self.resync = resync
+        self.proxy = None
+        self.primary = False
+        self.elector = None
+        self.virtual_services = None
+        self._writing = False
+        self._lock_file = None
+        self._tasks = []
+        self._status = {}
+        self._status_task = None
+        self._changes = []
+        # One thread, so forwarded requests and store changes stay in order.
+        self._ipc = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+
+    @property
+    def leading(self) -> bool:
+        return self._writing
+
+    async def start(self):
+        address = os.environ.get(ADDRESS_ENV)
+        if not address:
+            self._become_primary()
+            return
+        manager = SharedStateManager(address=address, authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+        manager.connect()
+        self.proxy = manager.store()
+        if self._try_lock():
+            self._become_primary()
+        else:
+            logging.info("Worker %s is a secondary, forwarding writes to the primary", os.getpid())
+            for informer in self.cluster_cache.informers:
+                informer.store = RemoteStore(self.proxy, informer.plural, self._status)
+            self._status_task = asyncio.create_task(self._poll_status())
+            self._tasks.append(asyncio.create_task(self._wait_for_primary_lock()))
+
+    def _try_lock(self) -> bool:
+        lock_file = open(os.environ[LOCK_ENV], "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _become_primary(self):
+        self.primary = True
+        if self.proxy is not None:
+            logging.info("Worker %s is the primary", os.getpid())
+            if self._status_task is not None:
+                self._status_task.cancel()
+                self._status_task = None
+            for informer in self.cluster_cache.informers:
+                informer.store = ReplicatedStore(informer.plural, self._changes)
+            self._tasks.append(asyncio.create_task(self._replicate()))
+            self._tasks.append(asyncio.create_task(self._drain_inbox()))
+        self.cluster_cache.start()
+        if LeaderElectionConfig.enabled:
+            self.virtual_services = ResourceInformer(
+                self.cluster_cache.kubernetes_utility,
+                "networking.istio.io",
+                "v1",
+                "virtualservices",
+                transform=lambda obj: self.request_type.from_virtual_service(obj, "UPDATE"),
+                on_change=self._on_virtual_service,
+            )
+            self.elector = LeaderElector(
+                self.cluster_cache.kubernetes_utility, self._start_writing, self._stop_writing
+            )
+            self.elector.start()
+        else:
+            self._start_writing()
+
+    def _start_writing(self):
+        self._writing = True
+        self.reconcile_queue.start()
+        if self.resync is not None:
+            self.resync.start()
+        if self.virtual_services is not None:
+            self.virtual_services.start()
+
+    async def _stop_writing(self, drain: bool = False):
+        # Losing the Lease cancels at once: the next leader owns the writes.
+        self._writing = False
+        if self.virtual_services is not None:
+            await self.virtual_services.stop()
+        if self.resync is not None:
+            await self.resync.stop()
+        await self.reconcile_queue.stop(drain=drain)
+
+    def _on_virtual_service(self, event_type: str, old, new):
+        if event_type == "DELETED":
+            if old is not None and old.annotations:
+                self.reconcile_queue.add(old.key, old.model_copy(update={"operation": "DELETE"}))
+            return
+        if not new.gateways or not new.annotations:
+            return
+        if old is not None and old.inputs() == new.inputs():
+            return
+        operation = "CREATE" if event_type == "ADDED" else "UPDATE"
+        self.reconcile_queue.add(new.key, new.model_copy(update={"operation": operation}))
+
+    async def _wait_for_primary_lock(self):
+        while not self._try_lock():
+            await asyncio.sleep(1)
+        self._become_primary()
+
+    async def _ipc_call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._ipc, func, *args)
+
+    async def _drain_inbox(self):
+        while True:
+            try:
+                inbox = await self._ipc_call(self.proxy.drain)
+            except Exception as e:
+                logging.error("Could not read the shared inbox: %s", e)
+                inbox = {}
+            for key, item in inbox.items():
+                if self._writing:
+                    self.reconcile_queue.add(key, self.request_type.model_construct(**item))
+            await asyncio.sleep(0.05)
+
+    async def _replicate(self):
+        while True:
+            await asyncio.sleep(REPLICATION_INTERVAL)
+            if not self._changes:
+                continue
+            changes = self._changes.copy()
+            self._changes.clear()
+            try:
+                await self._ipc_call(self.proxy.apply, changes)
+            except Exception as e:
+                logging.error("Could not copy %s store changes to the shared store: %s", len(changes), e)
+                # Changes made meanwhile come after these.
+                self._changes[:0] = changes
+
+    async def _poll_status(self):
+        while True:
+            try:
+                status = await asyncio.to_thread(self.proxy.status)
+                self._status.clear()
+                self._status.update(status)
+            except Exception as e:
+                logging.error("Could not read the shared store status: %s", e)
+                # Unsynced stores make lookups read from the apiserver.
+                self._status.clear()
+            await asyncio.sleep(STATUS_INTERVAL)
+
+    def _forward(self, key: str, item: dict):
+        try:
+            self.proxy.submit(key, item)
+        except Exception as e:
+            logging.error("Could not forward %s to the primary: %s", key, e)
+
+    def submit(self, item):
+        if self._writing:
+            self.reconcile_queue.add(item.key, item)
+        elif not self.primary:
+            self._ipc.submit(self._forward, item.key, item.model_dump())
+        # Otherwise another replica leads and picks the change up from its
+        # VirtualService watch.
+
+    async def stop(self):
+        if self._status_task is not None:
+            self._tasks.append(self._status_task)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.elector is not None:
+            await self.elector.stop()
+        elif self._writing:
+            await self._stop_writing(drain=True)
+        if self.primary:
+            await self.cluster_cache.stop()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        # Requests still being forwarded are sent before the process exits.
+        self._ipc.shutdown(wait=False)
@@ -0,0 +1,90 @@
+import atexit
+import contextvars
+import datetime
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+import orjson
+
+from config import LoggingConfig
+from metrics import LOG_RECORDS_DROPPED
+
+# uid of the AdmissionReview being handled, attached to every log record.
+request_uid = contextvars.ContextVar("request_uid", default="")
+
+TEXT_FORMAT = "%(levelname)s:     %(message)s"
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        uid = getattr(record, "uid", "")
+        if uid:
+            entry["uid"] = uid
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without formatting them. The stock
+    QueueHandler formats in prepare(), on the event loop, which is the cost
+    this handler exists to move off it. Records are dropped, and counted,
+    when the queue is full rather than blocking the caller.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.uid = request_uid.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def setup_logging():
+    """Route the root logger through a queue to a JSON (or text) stderr handler."""
+    global _listener
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if LoggingConfig.format == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    records = queue.Queue(LoggingConfig.queue_size)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_NonBlockingQueueHandler(records))
+    root.setLevel(LoggingConfig.level.upper())
+    # Neither format shows which thread or process logged a record, and
+    # collecting that costs more than formatting the record.
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    _listener = logging.handlers.QueueListener(records, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def payload_sampled() -> bool:
+    """Whether to log the full payload of this request at DEBUG level."""
+    return (
+        LoggingConfig.payload_sample_rate > 0
+        and logging.getLogger().isEnabledFor(logging.DEBUG)
+        and random.random() < LoggingConfig.payload_sample_rate
+    )
@@ -0,0 +1,135 @@
+import asyncio
+import types
+
+import orjson
+import pytest
+
+import main
+from admission_cache import RecentAdmissions
+from codec import VALIDATION_PASSED
+from errors import GatewayAlreadyExists
+from schemas import ReconcileRequestSchema
+
+
+def _virtual_service(object_uid: str, name: str = "a", namespace: str = "ns", generation: int = 1) -> dict:
+    return {
+        "metadata": {
+            "name": name,
+            "namespace": namespace,
+            "uid": object_uid,
+            "generation": generation,
+            "annotations": {"cert-manager.io/cluster-issuer": "letsencrypt"},
+        },
+        "spec": {"gateways": ["istio-system/a-gateway"], "hosts": ["a.example.com"]},
+    }
+
+
+def _request(object_uid: str, **kwargs) -> ReconcileRequestSchema:
+    return ReconcileRequestSchema.from_virtual_service(_virtual_service(object_uid, **kwargs), "CREATE")
+
+
+def test_recreated_object_does_not_match_its_predecessor():
+    recent = RecentAdmissions(size=8)
+    recent.add(_request("uid-1"), VALIDATION_PASSED)
+
+    assert recent.get(_request("uid-1")) == VALIDATION_PASSED
+    assert recent.get(_request("uid-2")) is None
+    assert recent.get(_request("uid-1", generation=2)) is None
+
+
+def test_objects_without_uid_are_not_cached():
+    recent = RecentAdmissions(size=8)
+    recent.add(_request(""), VALIDATION_PASSED)
+
+    assert recent.get(_request("")) is None
+
+
+class _Request:
+    def __init__(self, review: dict):
+        self._body = orjson.dumps(review)
+
+    async def body(self) -> bytes:
+        return self._body
+
+
+class _Runtime:
+    """Stands in for the runtime module: a preflight that can be made to fail."""
+
+    def __init__(self):
+        self.submitted = []
+        self.preflights = 0
+        self.taken = False
+        self.coordinator = types.SimpleNamespace(submit=self.submitted.append)
+        runtime = self
+
+        class IstioHandler:
+            def __init__(self, request_object):
+                self.request_object = request_object
+
+            async def preflight_check(self):
+                runtime.preflights += 1
+                if runtime.taken:
+                    raise GatewayAlreadyExists("Gateway a-gateway already exists")
+
+        self.IstioHandler = IstioHandler
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    fake = _Runtime()
+    monkeypatch.setattr(main, "runtime", fake)
+    monkeypatch.setattr(main, "recent_admissions", RecentAdmissions(size=8))
+    monkeypatch.setattr(main, "_startup", None)
+    return fake
+
+
+def _admit(review_uid: str, virtual_service: dict) -> dict:
+    async def call():
+        main._startup = asyncio.get_running_loop().create_future()
+        main._startup.set_result(None)
+        review = {"request": {"uid": review_uid, "operation": "CREATE", "object": virtual_service}}
+        response = await main._validate(_Request(review))
+        return orjson.loads(response.body)["response"]
+
+    return asyncio.run(call())
+
+
+def test_recreate_after_gateway_was_claimed_is_denied(runtime):
+    assert _admit("r1", _virtual_service("uid-1"))["allowed"]
+    assert len(runtime.submitted) == 1
+
+    # The Gateway is deleted and another VirtualService claims it; then ns/a
+    # is re-created from the same manifest.
+    runtime.taken = True
+    response = _admit("r2", _virtual_service("uid-2"))
+
+    assert not response["allowed"]
+    assert "already exists" in response["status"]["message"]
+    assert runtime.preflights == 2
+    assert len(runtime.submitted) == 1
+
+
+def test_retried_review_skips_the_preflight_but_still_reconciles(runtime):
+    assert _admit("r1", _virtual_service("uid-1"))["allowed"]
+    assert _admit("r1", _virtual_service("uid-1"))["allowed"]
+
+    assert runtime.preflights == 1
+    assert len(runtime.submitted) == 2
+
+
+def test_delete_is_allowed_and_reconciles_the_old_object(runtime):
+    async def call():
+        main._startup = asyncio.get_running_loop().create_future()
+        main._startup.set_result(None)
+        review = {"request": {"uid": "r1", "operation": "DELETE", "object": None, "oldObject": _virtual_service("uid-1")}}
+        return await main._delete(_Request(review))
+
+    response = asyncio.run(call())
+
+    assert response.media_type == "application/json"
+    assert orjson.loads(response.body)["response"] == {
+        "uid": "r1",
+        "allowed": True,
+        "status": {"message": VALIDATION_PASSED},
+    }
+    assert [(request.operation, request.name) for request in runtime.submitted] == [("DELETE", "a")]
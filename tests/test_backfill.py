@@ -0,0 +1,90 @@
+import asyncio
+import json
+import types
+
+import pytest
+
+import backfill
+from backfill import Backfill
+
+
+def _virtual_service(namespace: str, name: str) -> dict:
+    return {"metadata": {"namespace": namespace, "name": name}}
+
+
+class _KubernetesUtility:
+    def __init__(self, pages: list):
+        self.pages = pages
+
+    async def initialize(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def iter_custom_objects(self, group, plural, page_size=500):
+        for page in self.pages:
+            yield page
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    """Three pages of VirtualServices and a run that records what it processes."""
+    pages = [
+        [_virtual_service("a", "1"), _virtual_service("a", "2")],
+        [_virtual_service("b", "1"), _virtual_service("b", "2")],
+        [_virtual_service("c", "1")],
+    ]
+
+    async def stop():
+        pass
+
+    monkeypatch.setattr(backfill, "kubernetes_utility", _KubernetesUtility(pages))
+    monkeypatch.setattr(backfill, "cluster_cache", types.SimpleNamespace(informers=[], stop=stop))
+    processed = []
+
+    async def process(self, virtual_service):
+        processed.append(self._key(virtual_service))
+        self.counts["processed"] += 1
+
+    monkeypatch.setattr(Backfill, "_process", process)
+    return processed
+
+
+def test_checkpoint_only_advances_past_pages_that_are_done(tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    run = Backfill(checkpoint=str(checkpoint))
+    run._pages = {0: [2, "a/2"], 1: [1, "b/1"]}
+
+    # Page 1 finishes before page 0; nothing is safe to skip yet.
+    run._page_done(1)
+    assert run.resume_after == ""
+    assert not checkpoint.exists()
+
+    run._page_done(0)
+    run._page_done(0)
+    assert run.resume_after == "b/1"
+    assert json.loads(checkpoint.read_text())["last"] == "b/1"
+
+
+def test_resumed_run_skips_everything_up_to_the_checkpoint(tmp_path, cluster):
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"last": "a/2"}))
+
+    report = asyncio.run(Backfill(checkpoint=str(checkpoint)).run())
+
+    assert cluster == ["b/1", "b/2", "c/1"]
+    assert report["resumed_after"] == "a/2"
+    state = json.loads(checkpoint.read_text())
+    assert state["last"] == "c/1"
+    assert state["counts"]["processed"] == 3
+
+
+def test_dry_run_leaves_the_checkpoint_alone(tmp_path, cluster):
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"last": "a/1"}))
+
+    asyncio.run(Backfill(checkpoint=str(checkpoint), dry_run=True).run())
+
+    assert cluster == ["a/2", "b/1", "b/2", "c/1"]
+    assert json.loads(checkpoint.read_text()) == {"last": "a/1"}
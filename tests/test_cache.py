@@ -0,0 +1,59 @@
+import asyncio
+import types
+
+from cache import ResourceInformer
+
+
+def _certificate(name: str, ready: str) -> dict:
+    return {
+        "metadata": {"name": name, "namespace": "istio-system"},
+        "status": {"conditions": [{"type": "Ready", "status": ready}]},
+    }
+
+
+def _informer(lists: list) -> tuple:
+    async def list_namespaced_custom_object(group, version, namespace, plural):
+        return {"metadata": {"resourceVersion": str(len(lists))}, "items": lists.pop(0)}
+
+    client = types.SimpleNamespace(list_namespaced_custom_object=list_namespaced_custom_object)
+    events = []
+    informer = ResourceInformer(
+        types.SimpleNamespace(client=client),
+        "cert-manager.io",
+        "v1",
+        "certificates",
+        namespace="istio-system",
+        on_change=lambda event_type, old, new: events.append((event_type, old and old["metadata"]["name"], new)),
+    )
+    return informer, events
+
+
+def test_first_list_fills_the_store_without_events():
+    informer, events = _informer([[_certificate("a", "False")]])
+    asyncio.run(informer._list())
+
+    assert informer.store.get("istio-system/a") == _certificate("a", "False")
+    assert events == []
+
+
+def test_relist_reports_what_the_watch_missed():
+    unchanged = _certificate("a", "True")
+    informer, events = _informer(
+        [
+            [unchanged, _certificate("b", "False"), _certificate("c", "True")],
+            [unchanged, _certificate("b", "True"), _certificate("d", "False")],
+        ]
+    )
+
+    async def relist():
+        await informer._list()
+        await informer._list()
+
+    asyncio.run(relist())
+
+    assert sorted(events, key=lambda event: event[0]) == [
+        ("ADDED", None, _certificate("d", "False")),
+        ("DELETED", "c", _certificate("c", "True")),
+        ("MODIFIED", "b", _certificate("b", "True")),
+    ]
+    assert informer.store.get("istio-system/c") is None
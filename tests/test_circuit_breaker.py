@@ -0,0 +1,89 @@
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, resource_of
+from config import ApiServerConfig
+from errors import CircuitOpen
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(ApiServerConfig, "breaker_failures", 3)
+    monkeypatch.setattr(ApiServerConfig, "breaker_open_seconds", 30.0)
+
+
+def _opened(clock: Clock) -> CircuitBreaker:
+    breaker = CircuitBreaker("gateways", clock)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.failure()
+    return breaker
+
+
+def test_consecutive_failures_open_the_breaker():
+    breaker = CircuitBreaker("gateways", Clock())
+    for _ in range(2):
+        breaker.failure()
+    breaker.success()
+    for _ in range(2):
+        breaker.failure()
+    assert breaker.state == CLOSED
+
+    breaker.failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+
+def test_one_probe_after_open_seconds_and_success_closes():
+    clock = Clock()
+    breaker = _opened(clock)
+
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    breaker.success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_opens_the_breaker_again():
+    clock = Clock()
+    breaker = _opened(clock)
+
+    clock.now += 30
+    breaker.before_call()
+    breaker.failure()
+    assert breaker.state == OPEN
+
+    clock.now += 29
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+
+def test_released_probe_lets_the_next_call_probe():
+    clock = Clock()
+    breaker = _opened(clock)
+
+    clock.now += 30
+    breaker.before_call()
+    breaker.release()
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+
+
+def test_resource_of_reads_the_plural_from_the_path():
+    assert resource_of("https://k8s/apis/networking.istio.io/v1/namespaces/istio-system/gateways/gw") == "gateways"
+    assert resource_of("https://k8s/apis/cert-manager.io/v1/certificates?watch=true") == "certificates"
+    assert resource_of("https://k8s/api/v1/namespaces/ns/secrets") == "secrets"
+    assert resource_of("https://k8s/version") == "other"
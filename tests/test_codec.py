@@ -0,0 +1,62 @@
+import orjson
+
+from codec import ANNOTATION_SKIPPED, VALIDATION_PASSED, decode_admission_review, encode_admission_response
+from schemas import AdmissionResponseSchema, ControllerResponseSchema
+
+
+def _review(operation: str, obj: dict = None, old_obj: dict = None) -> bytes:
+    return orjson.dumps(
+        {
+            "apiVersion": "admission.k8s.io/v1",
+            "kind": "AdmissionReview",
+            "request": {"uid": "uid-1", "operation": operation, "object": obj, "oldObject": old_obj},
+        }
+    )
+
+
+def _virtual_service(**spec) -> dict:
+    return {
+        "metadata": {
+            "name": "vs",
+            "namespace": "ns",
+            "uid": "vs-uid",
+            "generation": 3,
+            "annotations": {"cert-manager.io/cluster-issuer": "letsencrypt", "other": "dropped"},
+            "managedFields": [{"manager": "kubectl"}],
+        },
+        "spec": {"gateways": ["istio-system/gw"], "hosts": ["a.example.com"], "http": [{"route": []}], **spec},
+    }
+
+
+def test_decode_keeps_only_the_fields_the_handler_reads():
+    review = decode_admission_review(_review("UPDATE", _virtual_service(), _virtual_service(hosts=["b.example.com"])))
+
+    assert review.uid == "uid-1"
+    assert review.operation == "UPDATE"
+    assert review.object.name == "vs"
+    assert review.object.namespace == "ns"
+    assert review.object.generation == 3
+    assert review.object.gateways == ["istio-system/gw"]
+    assert review.object.annotations == {"cert-manager.io/cluster-issuer": "letsencrypt"}
+    assert review.object.uid == "uid-1"
+    assert review.old_object.hosts == ["b.example.com"]
+    assert review.object.as_request_object() == {
+        "metadata": {"name": "vs", "namespace": "ns", "annotations": {"cert-manager.io/cluster-issuer": "letsencrypt"}},
+        "spec": {"gateways": ["istio-system/gw"], "hosts": ["a.example.com"]},
+    }
+
+
+def test_decode_delete_has_only_the_old_object():
+    review = decode_admission_review(_review("DELETE", None, _virtual_service()))
+
+    assert review.object is None
+    assert review.old_object.name == "vs"
+
+
+def test_encoded_response_matches_the_pydantic_schema():
+    for allowed, message in ((True, VALIDATION_PASSED), (True, ANNOTATION_SKIPPED), (False, 'quote " and é')):
+        encoded = encode_admission_response("uid-1", allowed, message)
+        expected = ControllerResponseSchema(
+            response=AdmissionResponseSchema(allowed=allowed, uid="uid-1", status={"message": message})
+        ).model_dump()
+        assert orjson.loads(encoded) == expected
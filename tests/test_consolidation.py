@@ -0,0 +1,44 @@
+from consolidation import pack
+
+PROFILE = "ClusterIssuer/letsencrypt/2160h/360h"
+OTHER = "ClusterIssuer/internal/2160h/360h"
+
+
+def _members(**hosts_by_member) -> dict:
+    return {key: {"profile": PROFILE, "hosts": hosts} for key, hosts in hosts_by_member.items()}
+
+
+def test_new_hosts_fill_shards_up_to_max_hosts():
+    packed = pack("shared", _members(a=["a1", "a2", "a3"], b=["b1"]), {}, max_hosts=3)
+
+    assert packed == {
+        "shared-0-tls": {"profile": PROFILE, "hosts": ["a1", "a2", "a3"]},
+        "shared-1-tls": {"profile": PROFILE, "hosts": ["b1"]},
+    }
+
+
+def test_placed_hosts_stay_and_unneeded_hosts_are_dropped():
+    shards = {
+        "shared-0-tls": {"profile": PROFILE, "hosts": ["a1", "gone", "a3"]},
+        "shared-1-tls": {"profile": PROFILE, "hosts": ["b1"]},
+    }
+
+    packed = pack("shared", _members(a=["a1", "a3"], b=["b1", "b2"]), shards, max_hosts=3)
+
+    # Only shard 0 changes: the freed slot takes the new host.
+    assert packed == {
+        "shared-0-tls": {"profile": PROFILE, "hosts": ["a1", "a3", "b2"]},
+        "shared-1-tls": {"profile": PROFILE, "hosts": ["b1"]},
+    }
+
+
+def test_profiles_do_not_share_shards_and_empty_shards_are_freed():
+    shards = {"shared-0-tls": {"profile": PROFILE, "hosts": ["gone"]}}
+    members = {"a": {"profile": PROFILE, "hosts": ["a1"]}, "b": {"profile": OTHER, "hosts": ["b1"]}}
+
+    packed = pack("shared", members, shards, max_hosts=3)
+
+    assert packed == {
+        "shared-0-tls": {"profile": OTHER, "hosts": ["b1"]},
+        "shared-1-tls": {"profile": PROFILE, "hosts": ["a1"]},
+    }
@@ -0,0 +1,89 @@
+import asyncio
+import copy
+import types
+
+import pytest
+
+from errors import Deferred
+from handler import IstioHandler, gather_all, gather_lookups
+
+
+async def _value(value, delay: float = 0):
+    await asyncio.sleep(delay)
+    return value
+
+
+async def _fail(error: Exception, delay: float = 0):
+    await asyncio.sleep(delay)
+    raise error
+
+
+def test_gather_lookups_keeps_the_order_of_its_lookups():
+    async def lookups():
+        return (
+            await gather_lookups(),
+            await gather_lookups(_value("a")),
+            await gather_lookups(_value("a", 0.02), _value("b")),
+        )
+
+    assert asyncio.run(lookups()) == ([], ["a"], ["a", "b"])
+
+
+def test_gather_all_waits_for_every_write_before_raising():
+    finished = []
+
+    async def write(name: str):
+        await asyncio.sleep(0.02)
+        finished.append(name)
+
+    async def writes():
+        await gather_all(_fail(RuntimeError("first")), write("second"))
+
+    with pytest.raises(RuntimeError, match="first"):
+        asyncio.run(writes())
+    assert finished == ["second"]
+
+
+def test_gather_all_raises_the_shortest_deferral_unless_something_failed():
+    async def deferred():
+        await gather_all(_fail(Deferred("later", 30)), _fail(Deferred("sooner", 5)), _value("done"))
+
+    async def failed():
+        await gather_all(_fail(Deferred("later", 30)), _fail(RuntimeError("broken")))
+
+    with pytest.raises(Deferred, match="sooner"):
+        asyncio.run(deferred())
+    with pytest.raises(RuntimeError, match="broken"):
+        asyncio.run(failed())
+    with pytest.raises(Deferred, match="alone"):
+        asyncio.run(gather_all(_fail(Deferred("alone", 1))))
+
+
+def test_create_skips_only_objects_whose_live_fields_match():
+    class _KubernetesUtility:
+        def __init__(self):
+            self.applied = []
+
+        async def apply_istio_gateway(self, gateway):
+            self.applied.append(gateway["spec"]["servers"][0]["hosts"])
+            return gateway
+
+    handler = IstioHandler(
+        {
+            "metadata": {"namespace": "shop", "name": "web", "annotations": {}},
+            "spec": {"gateways": ["istio-system/web-gateway"], "hosts": ["shop.example.com"]},
+        }
+    )
+    handler.kubernetes_utility = _KubernetesUtility()
+    handler.cluster_cache = types.SimpleNamespace(gateways=types.SimpleNamespace(upsert=lambda gateway: None))
+    live = copy.deepcopy(handler.desired_gateway("web-gateway"))
+    live["metadata"]["uid"] = "gateway-uid"
+
+    async def create():
+        await handler.create_gateway("web-gateway", live, None)
+        # Edited in the cluster; the spec-hash annotation still matches.
+        live["spec"]["servers"][0]["hosts"] = ["other.example.com"]
+        await handler.create_gateway("web-gateway", live, None)
+
+    asyncio.run(create())
+    assert handler.kubernetes_utility.applied == [["shop.example.com"]]
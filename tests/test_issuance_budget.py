@@ -0,0 +1,175 @@
+import asyncio
+import datetime
+import types
+
+import pytest
+
+from config import IssuanceConfig
+from errors import IssuanceDeferred
+from issuance_budget import IssuanceBudget, _Window
+
+NOW = 1_800_000_000.0
+
+
+class Clock:
+    def __init__(self, now: float = NOW):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(IssuanceConfig, "enabled", True)
+    monkeypatch.setattr(IssuanceConfig, "domain_limit", 3)
+    monkeypatch.setattr(IssuanceConfig, "domain_window", 100)
+    monkeypatch.setattr(IssuanceConfig, "issuer_limit", 10)
+    monkeypatch.setattr(IssuanceConfig, "issuer_window", 50)
+    monkeypatch.setattr(IssuanceConfig, "reserve", 0.0)
+    monkeypatch.setattr(IssuanceConfig, "exempt_issuers", [])
+
+
+def _certificate(name: str, hosts: list[str], not_before: str = None, issuer: str = "letsencrypt") -> dict:
+    certificate = {
+        "metadata": {"name": name, "namespace": "istio-system"},
+        "spec": {
+            "dnsNames": hosts,
+            "secretName": name,
+            "issuerRef": {"kind": "ClusterIssuer", "name": issuer},
+        },
+    }
+    if not_before:
+        certificate["status"] = {"notBefore": not_before}
+    return certificate
+
+
+class _KubernetesUtility:
+    """Lists the cluster's Certificates a page at a time, yielding to the loop in between."""
+
+    def __init__(self, certificates: list[dict]):
+        self.certificates = certificates
+        self.lists = 0
+
+    async def iter_custom_objects(self, group, plural, namespace, page_size):
+        self.lists += 1
+        for certificate in self.certificates:
+            await asyncio.sleep(0)
+            yield [certificate]
+
+
+class _ClusterCache:
+    """An ACME ClusterIssuer, letsencrypt, and an internal CA."""
+
+    CLUSTER_ISSUERS = {
+        "letsencrypt": {"spec": {"acme": {"server": "https://acme-v02.api.letsencrypt.org/directory"}}},
+        "internal-ca": {"spec": {"ca": {"secretName": "internal-ca"}}},
+    }
+
+    def __init__(self):
+        self.certificates = types.SimpleNamespace(
+            group="cert-manager.io", plural="certificates", has_synced=lambda: False
+        )
+
+    async def get_cluster_issuer(self, name):
+        return self.CLUSTER_ISSUERS[name]
+
+
+def _budget(certificates: list[dict] = (), clock: Clock = None) -> tuple:
+    kubernetes_utility = _KubernetesUtility(list(certificates))
+    budget = IssuanceBudget(kubernetes_utility, _ClusterCache(), clock or Clock())
+    return budget, kubernetes_utility
+
+
+def test_window_delay_is_until_the_oldest_counted_issuance_expires():
+    window = _Window(limit=2, length=10)
+    assert window.delay(0) == 0.0
+
+    window.record(1)
+    window.record(4)
+    assert window.delay(5) == pytest.approx(6)
+    assert window.remaining(5) == 0
+
+    # The first issuance has left the window.
+    assert window.delay(11) == 0.0
+    assert window.remaining(11) == 1
+
+
+def test_window_without_room_waits_a_whole_window():
+    window = _Window(limit=0, length=10)
+
+    assert window.delay(0) == 10
+
+
+def test_window_keeps_out_of_order_seeds_sorted():
+    window = _Window(limit=3, length=10)
+    for at in (5, 2, 8):
+        window.record(at)
+
+    assert list(window.times) == [2, 5, 8]
+    assert window.delay(9) == pytest.approx(3)
+
+
+def test_reserve_defers_once_the_domain_window_is_spent_and_resumes_later():
+    clock = Clock()
+    budget, _ = _budget(clock=clock)
+
+    async def reserve(index: int):
+        await budget.reserve(None, _certificate(f"c{index}", [f"h{index}.example.com"]))
+
+    for index in range(3):
+        clock.now += 1
+        asyncio.run(reserve(index))
+    with pytest.raises(IssuanceDeferred) as deferred:
+        asyncio.run(reserve(3))
+    assert deferred.value.retry_after == pytest.approx(98)
+
+    clock.now += deferred.value.retry_after
+    asyncio.run(reserve(3))
+
+
+def test_reserve_counts_only_writes_that_start_an_issuance():
+    budget, _ = _budget()
+    certificate = _certificate("c", ["a.example.com"])
+
+    async def reserve():
+        for _ in range(5):
+            await budget.reserve(certificate, certificate)
+
+    asyncio.run(reserve())
+    assert budget.remaining() == {"issuers": {}, "domains": {}}
+
+
+def test_concurrent_first_reserves_seed_once():
+    # Two issuances already in the cluster leave room for one more.
+    issued = datetime.datetime.fromtimestamp(NOW - 10, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    certificates = [_certificate("old-a", ["a.example.com"], issued), _certificate("old-b", ["b.example.com"], issued)]
+    budget, kubernetes_utility = _budget(certificates)
+
+    async def reserve_all():
+        return await asyncio.gather(
+            *(budget.reserve(None, _certificate(f"new-{index}", [f"n{index}.example.com"])) for index in range(3)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(reserve_all())
+
+    assert kubernetes_utility.lists == 1
+    assert results[0] is None
+    assert all(isinstance(result, IssuanceDeferred) for result in results[1:])
+
+
+def test_non_acme_issuers_are_never_counted_or_deferred():
+    issued = datetime.datetime.fromtimestamp(NOW - 10, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    existing = [_certificate(f"old-{index}", [f"o{index}.example.com"], issued, "internal-ca") for index in range(5)]
+    budget, _ = _budget(existing)
+
+    async def reserve():
+        for index in range(10):
+            await budget.reserve(None, _certificate(f"c{index}", [f"h{index}.example.com"], issuer="internal-ca"))
+        # The internal CA's issuances leave the ACME issuer's budget untouched.
+        for index in range(3):
+            await budget.reserve(None, _certificate(f"le{index}", [f"le{index}.example.com"]))
+
+    asyncio.run(reserve())
+    assert budget.remaining() == {"issuers": {"ClusterIssuer/letsencrypt": 7}, "domains": {"example.com": 0}}
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from rate_limit import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_burst_is_free_then_tokens_come_at_qps():
+    clock = Clock()
+    bucket = TokenBucket(qps=10, burst=3, clock=clock)
+
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Each further caller waits for its own token, in arrival order.
+    assert bucket.reserve() == pytest.approx(0.1)
+    assert bucket.reserve() == pytest.approx(0.2)
+
+
+def test_tokens_refill_up_to_burst():
+    clock = Clock()
+    bucket = TokenBucket(qps=10, burst=2, clock=clock)
+    bucket.reserve()
+    bucket.reserve()
+
+    clock.now += 0.1
+    assert bucket.reserve() == pytest.approx(0.0, abs=1e-9)
+    assert bucket.reserve() == pytest.approx(0.1)
+
+    clock.now += 60
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.1)
+
+
+def test_zero_qps_disables_limiting():
+    bucket = TokenBucket(qps=0, burst=1)
+
+    assert all(bucket.reserve() == 0.0 for _ in range(100))
+
+
+def test_acquire_sleeps_for_the_reserved_delay():
+    bucket = TokenBucket(qps=20, burst=1)
+
+    async def acquire_twice():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await bucket.acquire()
+        delay = await bucket.acquire()
+        return delay, loop.time() - start
+
+    delay, elapsed = asyncio.run(acquire_twice())
+    assert delay == pytest.approx(0.05, abs=0.01)
+    assert elapsed >= 0.04
+
+
+def test_reserve_past_max_wait_leaves_the_token():
+    clock = Clock()
+    bucket = TokenBucket(qps=10, burst=1, clock=clock)
+    bucket.reserve()
+
+    assert bucket.reserve(max_wait=0.05) is None
+    assert bucket.reserve(max_wait=0.05) is None
+    # The refused callers did not push later ones back.
+    assert bucket.reserve(max_wait=0.2) == pytest.approx(0.1)
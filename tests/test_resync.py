@@ -0,0 +1,70 @@
+import asyncio
+import copy
+import types
+
+from handler import IstioHandler
+from resync import DriftResync
+from schemas import ReconcileRequestSchema
+
+VIRTUAL_SERVICE = {
+    "metadata": {
+        "namespace": "shop",
+        "name": "web",
+        "annotations": {"cert-manager.io/cluster-issuer": "letsencrypt"},
+    },
+    "spec": {"gateways": ["istio-system/web-gateway"], "hosts": ["shop.example.com"]},
+}
+
+
+class _KubernetesUtility:
+    async def iter_custom_objects(self, group, plural, namespace=None, page_size=500, label_selector=None):
+        yield [VIRTUAL_SERVICE]
+
+
+class _Queue:
+    depth = 0
+
+    def __init__(self):
+        self.keys = []
+
+    def add(self, key, request):
+        self.keys.append(key)
+
+
+def _informer(objects: list) -> types.SimpleNamespace:
+    return types.SimpleNamespace(has_synced=lambda: True, list=lambda: objects)
+
+
+def _live_objects() -> tuple:
+    """The Gateway and Certificate as the apiserver returns them after our apply."""
+    request = ReconcileRequestSchema.from_virtual_service(VIRTUAL_SERVICE, "RESYNC")
+    handler = IstioHandler(request.as_request_object())
+    handler.certificate_settings()
+    gateway = copy.deepcopy(handler.desired_gateway("web-gateway"))
+    gateway["metadata"].update(uid="gateway-uid", resourceVersion="7")
+    # Fields set by other managers are not ours and are no drift.
+    gateway["metadata"]["annotations"]["kubectl.kubernetes.io/last-applied-configuration"] = "{}"
+    certificate = copy.deepcopy(handler.desired_certificate(gateway))
+    certificate["status"] = {"conditions": [{"type": "Ready", "status": "False"}]}
+    return gateway, certificate
+
+
+def _resync(gateway: dict, certificate: dict) -> list:
+    queue = _Queue()
+    cluster_cache = types.SimpleNamespace(gateways=_informer([gateway]), certificates=_informer([certificate]))
+    asyncio.run(DriftResync(_KubernetesUtility(), cluster_cache, queue).resync())
+    return queue.keys
+
+
+def test_resync_leaves_objects_that_match_the_desired_state():
+    assert _resync(*_live_objects()) == []
+
+
+def test_resync_repairs_an_edited_spec_whose_hash_annotation_was_kept():
+    gateway, certificate = _live_objects()
+    gateway["spec"]["servers"][0]["hosts"] = ["other.example.com"]
+    assert _resync(gateway, certificate) == ["istio-system/web-gateway"]
+
+    gateway, certificate = _live_objects()
+    certificate["spec"]["dnsNames"].append("other.example.com")
+    assert _resync(gateway, certificate) == ["istio-system/web-gateway"]
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from cache import MemoryStore
+from shared_state import RemoteStore, ReplicatedStore, SharedStateManager
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    manager = SharedStateManager(address=os.path.join(tmp_path, "state.sock"), authkey=b"test")
+    manager.start()
+    try:
+        yield manager.store()
+    finally:
+        manager.shutdown()
+
+
+def test_memory_store_keeps_indices_in_step_with_objects():
+    store = MemoryStore()
+    store.replace({"a": {"n": "a"}, "b": {"n": "b"}}, {"a": {"host": ["x", "y"]}, "b": {"host": ["y"]}})
+    assert sorted(obj["n"] for obj in store.by_index("host", "y")) == ["a", "b"]
+
+    store.set("a", {"n": "a2"}, {"host": ["z"]})
+    assert store.by_index("host", "x") == []
+    assert store.by_index("host", "z") == [{"n": "a2"}]
+
+    store.delete("b")
+    assert store.by_index("host", "y") == []
+    assert store.synced()
+
+
+def test_secondary_sees_the_primary_indices_and_staleness(proxy):
+    changes = []
+    primary = ReplicatedStore("gateways", changes)
+    primary.replace({"istio-system/gw": {"name": "gw"}}, {"istio-system/gw": {"owner": ["ns/vs"]}})
+    primary.set("istio-system/gw2", {"name": "gw2"}, {"owner": ["ns/vs"]})
+    failing_since = time.monotonic()
+    primary.set_failing_since(failing_since)
+    proxy.apply(changes)
+
+    status = proxy.status()
+    secondary = RemoteStore(proxy, "gateways", status)
+
+    async def read():
+        return (
+            await secondary.fetch("istio-system/gw"),
+            await secondary.fetch_by_index("owner", "ns/vs"),
+        )
+
+    gateway, owned = asyncio.run(read())
+    assert gateway == {"name": "gw"}
+    assert sorted(obj["name"] for obj in owned) == ["gw", "gw2"]
+    assert secondary.synced()
+    assert secondary.failing_since() == failing_since
+
+
+def test_replicated_replace_is_not_changed_by_later_writes(proxy):
+    changes = []
+    primary = ReplicatedStore("certificates", changes)
+    primary.replace({"a": 1}, None)
+    primary.set("b", 2)
+    primary.delete("a")
+    proxy.apply(changes)
+
+    assert proxy.get("certificates", "a") is None
+    assert proxy.get("certificates", "b") == 2
+    assert proxy.values("certificates") == [2]
@@ -0,0 +1,170 @@
+import asyncio
+
+import pytest
+
+from config import QueueConfig
+from errors import Deferred, GatewayAlreadyExists
+from work_queue import ReconcileQueue
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(QueueConfig, "workers", 4)
+    monkeypatch.setattr(QueueConfig, "base_delay", 0.01)
+    monkeypatch.setattr(QueueConfig, "max_delay", 0.05)
+    monkeypatch.setattr(QueueConfig, "max_retries", 2)
+    monkeypatch.setattr(QueueConfig, "shutdown_timeout", 2.0)
+
+
+class Recorder:
+    def __init__(self, fail=None):
+        self.calls = []
+        self.running = set()
+        self.overlapped = False
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.fail = fail or {}
+
+    async def __call__(self, item):
+        key, value = item
+        if key in self.running:
+            self.overlapped = True
+        self.running.add(key)
+        try:
+            await self.gate.wait()
+            self.calls.append(item)
+            errors = self.fail.get(value)
+            if errors:
+                raise errors.pop(0)
+        finally:
+            self.running.discard(key)
+
+
+async def _settle(queue: ReconcileQueue, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        stats = queue.stats()
+        if not stats["depth"] and not stats["in_flight"] and not stats["deferred"] and not stats["retrying"]:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"queue did not settle: {queue.stats()}")
+
+
+def test_pending_items_for_a_key_coalesce_to_the_latest():
+    async def scenario():
+        reconcile = Recorder()
+        queue = ReconcileQueue(reconcile)
+        for value in ("v1", "v2", "v3"):
+            queue.add("a", ("a", value))
+        queue.add("b", ("b", "v1"))
+        queue.start()
+        await _settle(queue)
+        await queue.stop()
+        return reconcile, queue
+
+    reconcile, queue = asyncio.run(scenario())
+    assert sorted(reconcile.calls) == [("a", "v3"), ("b", "v1")]
+    assert queue.coalesced_total == 2
+    assert queue.processed_total == 2
+
+
+def test_key_is_not_processed_twice_at_once_and_newer_item_runs_after():
+    async def scenario():
+        reconcile = Recorder()
+        reconcile.gate.clear()
+        queue = ReconcileQueue(reconcile)
+        queue.start()
+        queue.add("a", ("a", "v1"))
+        await asyncio.sleep(0.02)
+        queue.add("a", ("a", "v2"))
+        await asyncio.sleep(0.02)
+        reconcile.gate.set()
+        await _settle(queue)
+        await queue.stop()
+        return reconcile
+
+    reconcile = asyncio.run(scenario())
+    assert reconcile.calls == [("a", "v1"), ("a", "v2")]
+    assert not reconcile.overlapped
+
+
+def test_failures_are_retried_and_permanent_errors_are_dropped():
+    async def scenario():
+        reconcile = Recorder(
+            fail={
+                "flaky": [RuntimeError("transient")],
+                "broken": [GatewayAlreadyExists("taken")],
+                "hopeless": [RuntimeError("1"), RuntimeError("2"), RuntimeError("3")],
+            }
+        )
+        queue = ReconcileQueue(reconcile, permanent_errors=(GatewayAlreadyExists,))
+        queue.start()
+        queue.add("a", ("a", "flaky"))
+        queue.add("b", ("b", "broken"))
+        queue.add("c", ("c", "hopeless"))
+        await _settle(queue)
+        await queue.stop()
+        return reconcile, queue
+
+    reconcile, queue = asyncio.run(scenario())
+    assert reconcile.calls.count(("a", "flaky")) == 2
+    assert reconcile.calls.count(("b", "broken")) == 1
+    # The first attempt plus max_retries.
+    assert reconcile.calls.count(("c", "hopeless")) == 3
+    assert queue.dropped_total == 2
+    assert queue.retries_total == 3
+
+
+def test_deferred_item_runs_again_after_retry_after_without_counting_as_retry():
+    async def scenario():
+        reconcile = Recorder(fail={"v1": [Deferred("later", retry_after=0.05)]})
+        queue = ReconcileQueue(reconcile)
+        queue.start()
+        queue.add("a", ("a", "v1"))
+        await asyncio.sleep(0.02)
+        deferred = queue.stats()["deferred"]
+        held = queue.queued_items()
+        await _settle(queue)
+        await queue.stop()
+        return reconcile, queue, deferred, held
+
+    reconcile, queue, deferred, held = asyncio.run(scenario())
+    assert deferred == 1
+    assert held == [("a", "v1")]
+    assert reconcile.calls == [("a", "v1"), ("a", "v1")]
+    assert queue.deferred_total == 1
+    assert queue.retries_total == 0
+
+
+def test_newer_item_replaces_a_deferred_one():
+    async def scenario():
+        reconcile = Recorder(fail={"v1": [Deferred("later", retry_after=0.1)]})
+        queue = ReconcileQueue(reconcile)
+        queue.start()
+        queue.add("a", ("a", "v1"))
+        await asyncio.sleep(0.02)
+        queue.add("a", ("a", "v2"))
+        # Past the deferral, which must not bring v1 back.
+        await asyncio.sleep(0.2)
+        await _settle(queue)
+        await queue.stop()
+        return reconcile
+
+    reconcile = asyncio.run(scenario())
+    assert reconcile.calls == [("a", "v1"), ("a", "v2")]
+
+
+def test_stop_drains_pending_items():
+    async def scenario():
+        reconcile = Recorder()
+        queue = ReconcileQueue(reconcile)
+        queue.start()
+        for index in range(20):
+            queue.add(f"k{index}", (f"k{index}", "v"))
+        await queue.stop()
+        return reconcile, queue
+
+    reconcile, queue = asyncio.run(scenario())
+    assert len(reconcile.calls) == 20
+    assert queue.depth == 0
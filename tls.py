@@ -0,0 +1,118 @@
+import logging
+import os
+import ssl
+import threading
+import time
+
+import uvicorn
+from uvicorn.config import create_ssl_context
+
+from metrics import TLS_CERTIFICATE_RELOADS
+
+
+class CertificateReloader:
+    """
+    Serves the webhook certificate from files that may be replaced while
+    the server runs, as a mounted Secret is on rotation.
+
+    asyncio binds one SSLContext to the listening socket, so the server uses
+    a base context whose SNI callback moves every new connection onto the
+    most recently loaded context. A daemon thread polls the files and builds
+    replacement contexts off the event loop; a pair that fails to load, for
+    example while the files are only half updated, is retried on the next
+    poll and the previous certificate stays in use. Session tickets are
+    issued under the base context's keys, so clients can still resume their
+    sessions after a rotation. Each worker process has its own ticket keys.
+    """
+
+    def __init__(self, config: uvicorn.Config, interval: float, session_tickets: int):
+        self.config = config
+        self.interval = interval
+        self.session_tickets = session_tickets
+        self.current = self._load()
+        self.context = self._load()
+        self.context.sni_callback = self._select_context
+        self._stamp = self._file_stamp()
+
+    def _load(self) -> ssl.SSLContext:
+        context = create_ssl_context(
+            keyfile=self.config.ssl_keyfile,
+            certfile=self.config.ssl_certfile,
+            password=self.config.ssl_keyfile_password,
+            ssl_version=self.config.ssl_version,
+            cert_reqs=self.config.ssl_cert_reqs,
+            ca_certs=self.config.ssl_ca_certs,
+            ciphers=self.config.ssl_ciphers,
+        )
+        # Resumption skips the full handshake on reconnects; 0 disables it.
+        if self.session_tickets:
+            context.options &= ~ssl.OP_NO_TICKET
+            context.num_tickets = self.session_tickets
+        else:
+            context.options |= ssl.OP_NO_TICKET
+            context.num_tickets = 0
+        context.set_alpn_protocols(["http/1.1"])
+        return context
+
+    def _file_stamp(self) -> tuple:
+        # stat() follows the Secret volume's ..data symlink, which is swapped
+        # atomically on update, so the inode changes along with the contents.
+        stamp = []
+        for path in (self.config.ssl_certfile, self.config.ssl_keyfile):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stamp.append(None)
+                continue
+            stamp.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
+
+    def _select_context(self, ssl_object, server_name, context):
+        current = self.current
+        if ssl_object.context is not current:
+            ssl_object.context = current
+
+    def start(self):
+        if self.interval > 0:
+            threading.Thread(target=self._run, name="certificate-reloader", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            stamp = self._file_stamp()
+            if stamp == self._stamp:
+                continue
+            try:
+                self.current = self._load()
+            except (OSError, ssl.SSLError) as e:
+                TLS_CERTIFICATE_RELOADS.labels("error").inc()
+                logging.warning(
+                    "Could not reload certificate %s, will retry: %s",
+                    self.config.ssl_certfile, e,
+                )
+                continue
+            self._stamp = stamp
+            TLS_CERTIFICATE_RELOADS.labels("success").inc()
+            logging.info("Reloaded certificate %s", self.config.ssl_certfile)
+
+
+class ServerConfig(uvicorn.Config):
+    """
+    uvicorn config that serves TLS through a CertificateReloader. load()
+    runs in each worker process, so every worker watches the files itself.
+    """
+
+    def __init__(self, *args, tls_reload_interval: float = 10, tls_session_tickets: int = 2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tls_reload_interval = tls_reload_interval
+        self.tls_session_tickets = tls_session_tickets
+        self.certificate_reloader = None
+
+    def load(self):
+        super().load()
+        if self.is_ssl:
+            self.certificate_reloader = CertificateReloader(
+                self, self.tls_reload_interval, self.tls_session_tickets
+            )
+            self.ssl = self.certificate_reloader.context
+            self.certificate_reloader.start()
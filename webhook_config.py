@@ -0,0 +1,109 @@
+"""
+Renders the ValidatingWebhookConfiguration for the webhook. Run with
+``python app.py --certfile tls.crt render-webhook``.
+"""
+import base64
+import math
+
+from config import AdmissionConfig
+
+ANNOTATIONS = ("cert-manager.io/issuer", "cert-manager.io/cluster-issuer")
+DEFAULT_EXCLUDED_NAMESPACES = ("kube-system", "kube-public", "kube-node-lease")
+CA_BUNDLE_PLACEHOLDER = "<ca-bundle>"
+
+
+def annotation_condition() -> str:
+    """
+    CEL that matches VirtualServices with a cert-manager annotation. The old
+    object is checked as well, so an update that removes the annotations
+    still reaches the webhook.
+    """
+    annotated = " || ".join(f"'{annotation}' in o.metadata.annotations" for annotation in ANNOTATIONS)
+    return f"[object, oldObject].exists(o, o != null && has(o.metadata.annotations) && ({annotated}))"
+
+
+def _selector(match_labels: dict, match_expressions: list) -> dict:
+    selector = {}
+    if match_labels:
+        selector["matchLabels"] = match_labels
+    if match_expressions:
+        selector["matchExpressions"] = match_expressions
+    return selector
+
+
+def webhook_configuration(
+    ca_bundle: str,
+    name: str = "istio-cert-admission-webhook",
+    service_name: str = "gateway-admission-webhook",
+    service_namespace: str = "istio-system",
+    excluded_namespaces: list[str] = None,
+    namespace_labels: dict = None,
+    object_labels: dict = None,
+    match_conditions: bool = True,
+) -> dict:
+    """
+    ValidatingWebhookConfiguration that only sends the webhook the
+    VirtualServices it acts on. Label selectors are evaluated by the
+    apiserver before the CEL matchConditions; matchConditions need
+    Kubernetes 1.28 or later.
+    """
+    if excluded_namespaces is None:
+        excluded_namespaces = DEFAULT_EXCLUDED_NAMESPACES
+    namespace_expressions = []
+    if excluded_namespaces:
+        namespace_expressions.append(
+            {
+                "key": "kubernetes.io/metadata.name",
+                "operator": "NotIn",
+                "values": sorted(excluded_namespaces),
+            }
+        )
+    webhook = {
+        "admissionReviewVersions": ["v1"],
+        "clientConfig": {
+            "caBundle": ca_bundle,
+            "service": {
+                "name": service_name,
+                "namespace": service_namespace,
+                "path": "/validate",
+                "port": 443,
+            },
+        },
+        "failurePolicy": "Fail",
+        "matchPolicy": "Equivalent",
+        "name": "webhook.istio.io",
+        "namespaceSelector": _selector(namespace_labels, namespace_expressions),
+        "objectSelector": _selector(object_labels, []),
+        "rules": [
+            {
+                "apiGroups": ["networking.istio.io"],
+                "apiVersions": ["v1"],
+                "operations": ["CREATE", "UPDATE"],
+                "resources": ["virtualservices"],
+                "scope": "Namespaced",
+            }
+        ],
+        "sideEffects": "None",
+        "timeoutSeconds": math.ceil(AdmissionConfig.timeout),
+    }
+    if match_conditions:
+        webhook["matchConditions"] = [
+            {"name": "cert-manager-annotations", "expression": annotation_condition()}
+        ]
+    return {
+        "apiVersion": "admissionregistration.k8s.io/v1",
+        "kind": "ValidatingWebhookConfiguration",
+        "metadata": {"name": name},
+        "webhooks": [webhook],
+    }
+
+
+def ca_bundle_from(certfile: str) -> str:
+    """Base64 of the PEM certificate (chain) the webhook serves."""
+    if not certfile:
+        return CA_BUNDLE_PLACEHOLDER
+    with open(certfile, "rb") as f:
+        pem = f.read()
+    if b"-----BEGIN CERTIFICATE-----" not in pem:
+        raise ValueError(f"{certfile} does not contain a PEM certificate")
+    return base64.b64encode(pem).decode()
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+
+from config import QueueConfig
+from errors import Deferred
+from metrics import (
+    QUEUE_DEPTH,
+    QUEUE_EVENTS,
+    QUEUE_WAIT,
+    RECONCILE_DURATION,
+    RECONCILE_IN_FLIGHT,
+    count_error,
+)
+from structured_logging import request_uid
+
+
+class ReconcileQueue:
+    """
+    Keyed work queue for the background Gateway/Certificate writes.
+
+    Only the latest item per key is kept, so repeated events for the same
+    key coalesce while it waits, and a key is never processed by two workers
+    at once. Failed items are retried with exponential backoff unless the
+    error is one of ``permanent_errors``. Items that raise Deferred are
+    retried after the delay it asks for, without counting as a failure.
+
+    Pending keys are held in memory and lost when the process exits; the
+    drift resync (resync.py) rebuilds them from the cluster on start.
+    """
+
+    def __init__(self, reconcile, permanent_errors: tuple = ()):
+        self._reconcile = reconcile
+        self._permanent_errors = permanent_errors
+        self._pending = {}
+        self._queued = set()
+        self._processing = set()
+        self._attempts = {}
+        self._deferred = {}
+        self._keys = None
+        self._workers = []
+        self.added_total = 0
+        self.coalesced_total = 0
+        self.processed_total = 0
+        self.retries_total = 0
+        self.dropped_total = 0
+        self.deferred_total = 0
+        self.last_wait_seconds = 0.0
+        self._enqueued_at = {}
+
+    def start(self):
+        self._keys = asyncio.Queue()
+        # Keys left over from an earlier stop() are scheduled again.
+        self._queued.clear()
+        for key in self._pending:
+            self._schedule(key)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"reconcile-worker-{index}")
+            for index in range(QueueConfig.workers)
+        ]
+        logging.info("Started %s reconcile workers", QueueConfig.workers)
+
+    async def stop(self, drain: bool = True):
+        """Give in-flight items a chance to finish, then cancel the workers."""
+        deadline = time.monotonic() + (QueueConfig.shutdown_timeout if drain else 0)
+        while (self._pending or self._processing) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._pending:
+            logging.warning("Reconcile queue stopped with %s pending keys", len(self._pending))
+
+    def add(self, key: str, item):
+        # A newer desired state replaces a deferred one.
+        self._deferred.pop(key, None)
+        self.added_total += 1
+        QUEUE_EVENTS.labels("added").inc()
+        if key in self._pending:
+            self.coalesced_total += 1
+            QUEUE_EVENTS.labels("coalesced").inc()
+        else:
+            self._enqueued_at[key] = time.monotonic()
+        self._pending[key] = item
+        self._schedule(key)
+        depth = len(self._pending)
+        QUEUE_DEPTH.set(depth)
+        if depth == QueueConfig.high_watermark:
+            logging.warning("Reconcile queue depth reached %s keys", depth)
+
+    def _schedule(self, key: str):
+        # A key that is being processed is re-queued by its worker when done,
+        # which keeps writes for the same key strictly ordered.
+        if key in self._queued or key in self._processing:
+            return
+        if self._keys is None:
+            # Not started yet; start() schedules every pending key.
+            return
+        self._queued.add(key)
+        self._keys.put_nowait(key)
+
+    def _retry(self, key: str, item, error: Exception):
+        attempt = self._attempts.get(key, 0) + 1
+        if attempt > QueueConfig.max_retries:
+            logging.error("Giving up on %s after %s retries: %s", key, attempt - 1, error)
+            self._attempts.pop(key, None)
+            self.dropped_total += 1
+            QUEUE_EVENTS.labels("dropped").inc()
+            return
+        self._attempts[key] = attempt
+        self.retries_total += 1
+        QUEUE_EVENTS.labels("retried").inc()
+        delay = min(QueueConfig.base_delay * 2 ** (attempt - 1), QueueConfig.max_delay)
+        logging.warning("Retrying %s in %.1fs (attempt %s): %s", key, delay, attempt, error)
+        asyncio.get_running_loop().call_later(delay, self._requeue, key, item)
+
+    def _requeue(self, key: str, item):
+        # A newer desired state that arrived during the backoff wins.
+        if key not in self._pending:
+            self._pending[key] = item
+            self._enqueued_at[key] = time.monotonic()
+            QUEUE_DEPTH.set(len(self._pending))
+        self._schedule(key)
+
+    def _resume(self, key: str, item):
+        if self._deferred.get(key) is item:
+            del self._deferred[key]
+            self._requeue(key, item)
+
+    async def _worker(self):
+        while True:
+            key = await self._keys.get()
+            self._queued.discard(key)
+            item = self._pending.pop(key, None)
+            if item is None:
+                continue
+            QUEUE_DEPTH.set(len(self._pending))
+            self.last_wait_seconds = time.monotonic() - self._enqueued_at.pop(key, time.monotonic())
+            QUEUE_WAIT.observe(self.last_wait_seconds)
+            self._processing.add(key)
+            request_uid.set(getattr(item, "uid", ""))
+            RECONCILE_IN_FLIGHT.inc()
+            start = time.perf_counter()
+            try:
+                await self._reconcile(item)
+                self._attempts.pop(key, None)
+                self.processed_total += 1
+            except asyncio.CancelledError:
+                raise
+            except Deferred as e:
+                logging.info("Deferring %s for %.0fs: %s", key, e.retry_after, e)
+                self._attempts.pop(key, None)
+                self.deferred_total += 1
+                QUEUE_EVENTS.labels("deferred").inc()
+                self._deferred[key] = item
+                asyncio.get_running_loop().call_later(e.retry_after, self._resume, key, item)
+            except self._permanent_errors as e:
+                logging.error("Not retrying %s: %s", key, e)
+                count_error(e, "reconcile")
+                self._attempts.pop(key, None)
+                self.dropped_total += 1
+                QUEUE_EVENTS.labels("dropped").inc()
+            except Exception as e:
+                count_error(e, "reconcile")
+                self._retry(key, item, e)
+            finally:
+                RECONCILE_DURATION.labels(getattr(item, "operation", "")).observe(
+                    time.perf_counter() - start
+                )
+                RECONCILE_IN_FLIGHT.dec()
+                self._processing.discard(key)
+                if key in self._pending:
+                    self._schedule(key)
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def queued_items(self) -> list:
+        """Items waiting to be processed, including deferred ones."""
+        return [*self._pending.values(), *self._deferred.values()]
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self._pending),
+            "in_flight": len(self._processing),
+            "retrying": len(self._attempts),
+            "deferred": len(self._deferred),
+            "workers": len(self._workers),
+            "added_total": self.added_total,
+            "coalesced_total": self.coalesced_total,
+            "processed_total": self.processed_total,
+            "retries_total": self.retries_total,
+            "dropped_total": self.dropped_total,
+            "deferred_total": self.deferred_total,
+            "last_wait_seconds": self.last_wait_seconds,
+        }